@@ -0,0 +1,173 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import math
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from enum import IntEnum
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from metrics import ADMISSION_WAIT
+
+logger = logging.getLogger(__name__)
+
+
+class Priority(IntEnum):
+    """Priority class of a request; lower values are admitted first."""
+    INTERACTIVE = 0
+    BULK = 1
+
+
+class AdmissionRejected(Exception):
+    """Raised when an LLM call is not admitted because the service is overloaded."""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+_current_priority: ContextVar[Priority] = ContextVar("current_priority", default=Priority.INTERACTIVE)
+
+
+def current_priority() -> Priority:
+    """Return the priority class of the request being served."""
+    return _current_priority.get()
+
+
+def set_priority(priority: Priority) -> None:
+    """Set the priority class of the current task and the tasks it starts."""
+    _current_priority.set(priority)
+
+
+class _Waiter:
+    def __init__(self, priority: Priority, sequence: int, future: "asyncio.Future[None]"):
+        self.priority = priority
+        self.sequence = sequence
+        self.future = future
+        self.enqueued_at = time.monotonic()
+
+    def __lt__(self, other: "_Waiter") -> bool:
+        return (self.priority, self.sequence) < (other.priority, other.sequence)
+
+
+class AdmissionController:
+    """Limits concurrent LLM calls, queueing a bounded number by priority.
+
+    A call runs immediately while fewer than `max_in_flight` calls are
+    running. Otherwise it waits in a queue of at most `max_queue` callers,
+    served interactive before bulk and first come, first served within a
+    class. When the queue is full, an interactive caller displaces the most
+    recently queued bulk caller; callers that cannot be queued are rejected
+    at once with AdmissionRejected, which carries a suggested Retry-After.
+    """
+
+    def __init__(self, max_in_flight: int, max_queue: int):
+        """Initialize the admission controller.
+
+        Args:
+            max_in_flight: Maximum number of concurrent LLM calls
+            max_queue: Maximum number of callers waiting for a slot
+        """
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self._waiters: List[_Waiter] = []
+        self._sequence = itertools.count()
+        self._queued = {priority: 0 for priority in Priority}
+        self._average_call = 1.0
+
+        self.admitted = {priority: 0 for priority in Priority}
+        self.rejected = {priority: 0 for priority in Priority}
+        self.shed = 0
+
+    def retry_after(self) -> int:
+        """Seconds after which a rejected caller is likely to be admitted."""
+        backlog = self.in_flight + sum(self._queued.values())
+        return max(1, min(60, math.ceil(backlog * self._average_call / self.max_in_flight)))
+
+    def _dequeue(self, waiter: _Waiter) -> None:
+        self._waiters.remove(waiter)
+        heapq.heapify(self._waiters)
+        self._queued[waiter.priority] -= 1
+
+    def _reject(self, priority: Priority, reason: str) -> AdmissionRejected:
+        self.rejected[priority] += 1
+        retry_after = self.retry_after()
+        logger.warning(f"Rejecting {priority.name.lower()} LLM call ({reason}); retry after {retry_after}s")
+        return AdmissionRejected(f"Service overloaded ({reason}), retry after {retry_after}s", retry_after)
+
+    async def _acquire(self, priority: Priority) -> None:
+        if self.in_flight < self.max_in_flight and not self._waiters:
+            self.in_flight += 1
+            self.admitted[priority] += 1
+            ADMISSION_WAIT.labels(priority.name.lower()).observe(0.0)
+            return
+
+        if len(self._waiters) >= self.max_queue:
+            victim = max(self._waiters, default=None, key=lambda waiter: (waiter.priority, waiter.sequence))
+            if victim is None or victim.priority <= priority:
+                raise self._reject(priority, "queue full")
+            self._dequeue(victim)
+            self.shed += 1
+            victim.future.set_exception(self._reject(victim.priority, "displaced by a higher priority call"))
+
+        waiter = _Waiter(priority, next(self._sequence), asyncio.get_running_loop().create_future())
+        heapq.heappush(self._waiters, waiter)
+        self._queued[priority] += 1
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled() and waiter.future.exception() is None:
+                # The slot was handed over just before the cancellation
+                self._release()
+            elif waiter in self._waiters:
+                self._dequeue(waiter)
+            raise
+        self.admitted[priority] += 1
+        ADMISSION_WAIT.labels(priority.name.lower()).observe(time.monotonic() - waiter.enqueued_at)
+
+    def _release(self) -> None:
+        while self._waiters:
+            waiter = heapq.heappop(self._waiters)
+            self._queued[waiter.priority] -= 1
+            if not waiter.future.done():
+                # Hand the slot straight to the next waiter
+                waiter.future.set_result(None)
+                return
+        self.in_flight -= 1
+
+    @asynccontextmanager
+    async def slot(self, priority: Optional[Priority] = None) -> AsyncIterator[None]:
+        """Hold one LLM call slot for the duration of the block.
+
+        Args:
+            priority: Priority class of the call (defaults to the current
+                request's)
+
+        Raises:
+            AdmissionRejected: If the call can be neither run nor queued
+        """
+        await self._acquire(current_priority() if priority is None else priority)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self._average_call += 0.2 * (time.monotonic() - start - self._average_call)
+            self._release()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return slot usage, queue depth and admission counters."""
+        stats: Dict[str, Any] = {
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "queued": sum(self._queued.values()),
+            "shed": self.shed,
+        }
+        for priority in Priority:
+            name = priority.name.lower()
+            stats[f"queued_{name}"] = self._queued[priority]
+            stats[f"admitted_{name}"] = self.admitted[priority]
+            stats[f"rejected_{name}"] = self.rejected[priority]
+        return stats
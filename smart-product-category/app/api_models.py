@@ -1,5 +1,6 @@
-from pydantic import BaseModel, Field
-from typing import List, Optional
+from enum import Enum
+from pydantic import BaseModel, Field, model_serializer
+from typing import Any, Dict, List, Optional
 
 class ProductRequest(BaseModel):
     """Request model for product categorization."""
@@ -13,10 +14,38 @@ class ProductRequest(BaseModel):
         }
     }
 
+class EnhancedField(str, Enum):
+    """Optional fields of an enhanced categorization; type and variety are always returned."""
+    dietary_attributes = "dietary_attributes"
+    flavor_profile = "flavor_profile"
+    usage_occasions = "usage_occasions"
+    health_benefits = "health_benefits"
+    certifications = "certifications"
+    texture = "texture"
+    ingredients_highlight = "ingredients_highlight"
+    serving_suggestions = "serving_suggestions"
+    pairings = "pairings"
+
+class EnhancedProductRequest(ProductRequest):
+    """Request model for enhanced product categorization."""
+    fields: Optional[List[EnhancedField]] = Field(
+        None, description="Fields to generate besides type and variety; all fields when omitted"
+    )
+    
+    model_config = {
+        "json_schema_extra": {
+            "example": {
+                "product_id": "123456",
+                "fields": ["dietary_attributes", "flavor_profile"]
+            }
+        }
+    }
+
 class ProductResponse(BaseModel):
     """Response model for product categorization."""
     type: str = Field(..., description="The main product type")
     variety: List[str] = Field(..., description="List of product varieties")
+    confidence: Optional[float] = Field(None, description="Confidence of a rule-based facet match; null when categorized by the LLM")
     
     model_config = {
         "json_schema_extra": {
@@ -34,7 +63,11 @@ class HealthResponse(BaseModel):
     timestamp: int = Field(..., description="Current timestamp")
 
 class EnhancedProductResponse(BaseModel):
-    """Enhanced response model for detailed product categorization."""
+    """Enhanced response model for detailed product categorization.
+    
+    Only fields that were set are serialized, so a response carries exactly
+    the fields that were requested.
+    """
     type: str = Field(..., description="The main product type")
     variety: List[str] = Field(..., description="List of product varieties")
     dietary_attributes: List[str] = Field(default_factory=list, description="Dietary attributes (vegan, gluten-free, etc.)")
@@ -63,4 +96,124 @@ class EnhancedProductResponse(BaseModel):
                 "pairings": ["cereal", "coffee", "smoothies"]
             }
         }
-    }
\ No newline at end of file
+    }
+    
+    @model_serializer(mode="wrap")
+    def _serialize_set_fields(self, handler):
+        data = handler(self)
+        return {name: value for name, value in data.items() if name in self.model_fields_set}
+
+class BatchProductRequest(BaseModel):
+    """Request model for batch product categorization."""
+    product_ids: List[str] = Field(..., min_length=1, description="The Woolworths product IDs to categorize")
+    packed: bool = Field(False, description="Categorize several products per LLM call to reduce cost and latency")
+
+    model_config = {
+        "json_schema_extra": {
+            "example": {
+                "product_ids": ["123456", "654321"],
+                "packed": False
+            }
+        }
+    }
+
+class EnhancedBatchProductRequest(BatchProductRequest):
+    """Request model for batch enhanced product categorization."""
+    fields: Optional[List[EnhancedField]] = Field(
+        None, description="Fields to generate besides type and variety; all fields when omitted"
+    )
+
+    model_config = {
+        "json_schema_extra": {
+            "example": {
+                "product_ids": ["123456", "654321"],
+                "packed": False,
+                "fields": ["dietary_attributes", "flavor_profile"]
+            }
+        }
+    }
+
+class BatchItemError(BaseModel):
+    """Error details for a single item of a batch request."""
+    status_code: int = Field(..., description="HTTP status code the single-item endpoint would have returned")
+    detail: str = Field(..., description="Error message")
+
+class BatchProductResult(BaseModel):
+    """Result of categorizing a single product within a batch."""
+    product_id: str = Field(..., description="The Woolworths product ID")
+    result: Optional[ProductResponse] = Field(None, description="Categorization result, if successful")
+    error: Optional[BatchItemError] = Field(None, description="Error details, if categorization failed")
+
+class BatchProductResponse(BaseModel):
+    """Response model for batch product categorization."""
+    results: List[BatchProductResult] = Field(..., description="Per-product results, in request order")
+    succeeded: int = Field(..., description="Number of products categorized successfully")
+    failed: int = Field(..., description="Number of products that failed")
+
+class EnhancedBatchProductResult(BaseModel):
+    """Result of enhanced categorization of a single product within a batch."""
+    product_id: str = Field(..., description="The Woolworths product ID")
+    result: Optional[EnhancedProductResponse] = Field(None, description="Enhanced categorization result, if successful")
+    error: Optional[BatchItemError] = Field(None, description="Error details, if categorization failed")
+
+class EnhancedBatchProductResponse(BaseModel):
+    """Response model for batch enhanced product categorization."""
+    results: List[EnhancedBatchProductResult] = Field(..., description="Per-product results, in request order")
+    succeeded: int = Field(..., description="Number of products categorized successfully")
+    failed: int = Field(..., description="Number of products that failed")
+
+class JobMode(str, Enum):
+    """Categorization a job runs for each product."""
+    basic = "basic"
+    enhanced = "enhanced"
+
+class JobStatus(str, Enum):
+    """Lifecycle of a job."""
+    queued = "queued"
+    running = "running"
+    completed = "completed"
+
+class JobRequest(BaseModel):
+    """Request model for an asynchronous categorization job."""
+    product_ids: List[str] = Field(..., min_length=1, description="The Woolworths product IDs to categorize")
+    mode: JobMode = Field(JobMode.basic, description="Basic or enhanced categorization")
+    fields: Optional[List[EnhancedField]] = Field(
+        None, description="Enhanced fields to generate besides type and variety; all fields when omitted"
+    )
+
+    model_config = {
+        "json_schema_extra": {
+            "example": {
+                "product_ids": ["123456", "654321"],
+                "mode": "enhanced",
+                "fields": ["dietary_attributes"]
+            }
+        }
+    }
+
+class JobResponse(BaseModel):
+    """Status and progress of an asynchronous categorization job."""
+    job_id: str = Field(..., description="Job ID")
+    status: JobStatus = Field(..., description="queued, running or completed")
+    mode: JobMode = Field(..., description="Basic or enhanced categorization")
+    fields: Optional[List[str]] = Field(None, description="Requested enhanced fields; all fields when null")
+    total: int = Field(..., description="Number of products in the job")
+    succeeded: int = Field(..., description="Number of products categorized successfully so far")
+    failed: int = Field(..., description="Number of products that failed so far")
+    created_at: float = Field(..., description="Unix time the job was queued")
+    updated_at: float = Field(..., description="Unix time of the job's latest progress")
+    finished_at: Optional[float] = Field(None, description="Unix time the job completed")
+
+class JobResult(BaseModel):
+    """Result of categorizing a single product within a job."""
+    index: int = Field(..., description="Position of the product in the job request")
+    product_id: str = Field(..., description="The Woolworths product ID")
+    result: Optional[Dict[str, Any]] = Field(None, description="Categorization result, if successful")
+    error: Optional[BatchItemError] = Field(None, description="Error details, if categorization failed")
+
+class JobResultsResponse(BaseModel):
+    """A page of a job's results."""
+    job_id: str = Field(..., description="Job ID")
+    status: JobStatus = Field(..., description="queued, running or completed")
+    results: List[JobResult] = Field(..., description="Finished products, in completion order")
+    next_offset: int = Field(..., description="Offset of the next page")
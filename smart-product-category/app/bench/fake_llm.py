@@ -0,0 +1,130 @@
+import asyncio
+import json
+import random
+import re
+import time
+from typing import Any, Dict, List, Optional
+
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from pydantic import PrivateAttr
+
+PRODUCT_ID_PATTERN = re.compile(r"^### Product id: (\S+)$", re.MULTILINE)
+PRODUCT_NAME_PATTERN = re.compile(r'PRODUCT NAME:\s*(.+)|For this product: "(.+?)"')
+ENHANCED_FIELDS = (
+    "dietary_attributes", "flavor_profile", "usage_occasions", "health_benefits", "certifications",
+    "texture", "ingredients_highlight", "serving_suggestions", "pairings"
+)
+
+
+class SimulatedModelError(ConnectionError):
+    """Raised by FakeChatModel to simulate a failed model call."""
+
+
+class FakeChatModel(BaseChatModel):
+    """Chat model stand-in that answers categorization prompts locally.
+
+    Answers single-product and packed prompts with well-formed results after
+    a configurable latency. A fraction of calls can fail outright or return
+    malformed JSON, so retry and parsing paths are exercised as well. Asked
+    for a confidence, a fraction of results report a low one, so model
+    routing escalates them. With a fixed seed the sequence of failures is
+    reproducible.
+    """
+
+    latency: float = 0.5
+    latency_jitter: float = 0.0
+    error_rate: float = 0.0
+    malformed_rate: float = 0.0
+    uncertain_rate: float = 0.0
+    seed: Optional[int] = None
+
+    _random: random.Random = PrivateAttr()
+    _calls: int = PrivateAttr(default=0)
+    _errors: int = PrivateAttr(default=0)
+    _malformed: int = PrivateAttr(default=0)
+    _uncertain: int = PrivateAttr(default=0)
+
+    def model_post_init(self, __context: Any) -> None:
+        self._random = random.Random(self.seed)
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-categorization-model"
+
+    def reset_counters(self) -> None:
+        self._calls = 0
+        self._errors = 0
+        self._malformed = 0
+        self._uncertain = 0
+
+    def counters(self) -> Dict[str, int]:
+        return {"llm_calls": self._calls, "llm_errors": self._errors, "llm_malformed": self._malformed,
+                "llm_uncertain": self._uncertain}
+
+    def _delay(self) -> float:
+        return max(0.0, self.latency + self._random.uniform(-self.latency_jitter, self.latency_jitter))
+
+    @staticmethod
+    def _product_name(text: str) -> str:
+        match = PRODUCT_NAME_PATTERN.search(text)
+        return (match.group(1) or match.group(2)).strip() if match else ""
+
+    def _result(self, prompt: str, name: str) -> Dict[str, Any]:
+        words = name.split()
+        result: Dict[str, Any] = {
+            "type": words[-1].lower() if words else "product",
+            "variety": [name] if name else []
+        }
+        # Enhanced prompts list the fields they ask for in their JSON schema
+        result.update({field: ["benchmark"] for field in ENHANCED_FIELDS if f'"{field}"' in prompt})
+        if '"confidence"' in prompt:
+            uncertain = self._random.random() < self.uncertain_rate
+            self._uncertain += uncertain
+            result["confidence"] = 0.3 if uncertain else 0.95
+        return result
+
+    def _answer(self, prompt: str) -> str:
+        product_ids = PRODUCT_ID_PATTERN.findall(prompt)
+        if product_ids:
+            # Packed prompt: one block per product, each starting with its id line
+            blocks = re.split(PRODUCT_ID_PATTERN, prompt)[1:]
+            results = []
+            for product_id, block in zip(blocks[::2], blocks[1::2]):
+                results.append({"id": product_id, "result": self._result(prompt, self._product_name(block))})
+            return json.dumps(results)
+
+        return json.dumps(self._result(prompt, self._product_name(prompt)))
+
+    def _respond(self, messages: List[BaseMessage]) -> ChatResult:
+        self._calls += 1
+        roll = self._random.random()
+        if roll < self.error_rate:
+            self._errors += 1
+            raise SimulatedModelError("Simulated model failure")
+
+        prompt = "\n".join(str(message.content) for message in messages)
+        text = self._answer(prompt)
+        if roll < self.error_rate + self.malformed_rate:
+            # Truncated output, as when a response hits the token limit
+            self._malformed += 1
+            text = f"```json\n{text[:max(1, len(text) // 2)]}"
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    def _generate(self,
+                  messages: List[BaseMessage],
+                  stop: Optional[List[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None,
+                  **kwargs: Any) -> ChatResult:
+        time.sleep(self._delay())
+        return self._respond(messages)
+
+    async def _agenerate(self,
+                         messages: List[BaseMessage],
+                         stop: Optional[List[str]] = None,
+                         run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+                         **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self._delay())
+        return self._respond(messages)
@@ -0,0 +1,388 @@
+"""Load and latency benchmark against local upstream stand-ins.
+
+Starts a stub Woolworths server (bench/upstream.py) and plugs fake chat
+models (bench/fake_llm.py) into the GeminiClient of each model tier, serves
+the API in-process with uvicorn and drives its endpoints at each
+concurrency level. Nothing leaves
+the machine, so runs are repeatable and can be compared before and after a
+change.
+
+For every scenario and concurrency level it reports req/s, p50/p95/p99
+latency and the upstream calls made per request, and it saves the results
+as JSON.
+
+Usage (from the app directory):
+    python -m bench.run
+    python -m bench.run --scenarios categorize enhanced --concurrency 1 8 32 --requests 200
+    python -m bench.run --llm-latency 1.0 --llm-error-rate 0.05 --llm-malformed-rate 0.05
+    python -m bench.run --routing single
+    python -m bench.run --scenarios categorize --concurrency 64 --llm-max-in-flight 8 --llm-max-queue 16
+    python -m bench.run --compare bench-results/before.json bench-results/after.json
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Any, Iterator, List, NamedTuple, Optional, Tuple
+
+import aiohttp
+
+from bench.fake_llm import FakeChatModel
+from bench.upstream import StubWoolworthsServer, load_payloads, PAYLOAD_DIR
+
+logger = logging.getLogger("bench")
+
+
+class Scenario(NamedTuple):
+    """An API call the benchmark drives."""
+    path: str
+    batch: bool = False
+    packed: bool = False
+    stream: bool = False
+
+
+SCENARIOS = {
+    "categorize": Scenario("/categorize"),
+    "enhanced": Scenario("/categorize/enhanced"),
+    "batch": Scenario("/categorize/batch", batch=True),
+    "batch_packed": Scenario("/categorize/batch", batch=True, packed=True),
+    "enhanced_batch": Scenario("/categorize/enhanced/batch", batch=True),
+    "enhanced_batch_packed": Scenario("/categorize/enhanced/batch", batch=True, packed=True),
+    "stream": Scenario("/categorize/stream", batch=True, stream=True),
+}
+DEFAULT_SCENARIOS = ["categorize", "enhanced", "batch", "batch_packed", "stream"]
+
+
+class Sample(NamedTuple):
+    """Outcome of one benchmark request."""
+    latency: float
+    ok: bool
+    items: int
+    failed_items: int
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(fraction * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def product_ids(distinct: int) -> Iterator[str]:
+    """Yield product IDs for requests; every ID is new unless `distinct` caps them."""
+    counter = itertools.count(1_000_000)
+    if distinct > 0:
+        return (str(1_000_000 + (next(counter) - 1_000_000) % distinct) for _ in itertools.count())
+    return (str(product_id) for product_id in counter)
+
+
+class LoadDriver:
+    """Closed-loop load generator: each worker sends its next request as soon
+    as the previous one completes."""
+
+    def __init__(self, base_url: str, scenario: Scenario, batch_size: int, ids: Iterator[str],
+                 cache_mode: str):
+        self.base_url = base_url
+        self.scenario = scenario
+        self.batch_size = batch_size
+        self.ids = ids
+        self.headers = {"X-Cache-Control": cache_mode}
+
+    def _body(self) -> Dict[str, Any]:
+        if not self.scenario.batch:
+            return {"product_id": next(self.ids)}
+        body: Dict[str, Any] = {"product_ids": [next(self.ids) for _ in range(self.batch_size)]}
+        if self.scenario.packed:
+            body["packed"] = True
+        return body
+
+    async def _request(self, session: aiohttp.ClientSession) -> Sample:
+        body = self._body()
+        start = time.perf_counter()
+        try:
+            async with session.post(f"{self.base_url}{self.scenario.path}", json=body,
+                                    headers=self.headers) as response:
+                if self.scenario.stream:
+                    lines = [json.loads(line) async for line in response.content if line.strip()]
+                    failed = sum(1 for line in lines if line.get("error"))
+                    return Sample(time.perf_counter() - start, response.status == 200, len(lines), failed)
+
+                payload = await response.json(content_type=None)
+                latency = time.perf_counter() - start
+                if not self.scenario.batch:
+                    ok = response.status == 200
+                    return Sample(latency, ok, 1, 0 if ok else 1)
+                if response.status != 200:
+                    return Sample(latency, False, self.batch_size, self.batch_size)
+                return Sample(latency, True, len(payload["results"]), payload["failed"])
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            logger.warning(f"Request to {self.scenario.path} failed: {str(e)}")
+            items = self.batch_size if self.scenario.batch else 1
+            return Sample(time.perf_counter() - start, False, items, items)
+
+    async def run(self, concurrency: int, requests: int) -> Tuple[List[Sample], float]:
+        """Send `requests` requests from `concurrency` workers.
+
+        Returns:
+            The samples and the wall-clock duration of the run
+        """
+        remaining = itertools.count(requests, -1)
+        samples: List[Sample] = []
+
+        async def worker(session: aiohttp.ClientSession) -> None:
+            while next(remaining) > 0:
+                samples.append(await self._request(session))
+
+        connector = aiohttp.TCPConnector(limit=concurrency)
+        timeout = aiohttp.ClientTimeout(total=None)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            start = time.perf_counter()
+            await asyncio.gather(*(worker(session) for _ in range(concurrency)))
+            return samples, time.perf_counter() - start
+
+
+def summarize(name: str, concurrency: int, samples: List[Sample], duration: float,
+              upstream: Dict[str, int]) -> Dict[str, Any]:
+    """Summarize one scenario run at one concurrency level."""
+    latencies = sorted(sample.latency for sample in samples)
+    requests = len(samples)
+    items = sum(sample.items for sample in samples)
+    return {
+        "scenario": name,
+        "concurrency": concurrency,
+        "requests": requests,
+        "failed_requests": sum(1 for sample in samples if not sample.ok),
+        "items": items,
+        "failed_items": sum(sample.failed_items for sample in samples),
+        "duration_s": round(duration, 3),
+        "requests_per_s": round(requests / duration, 2) if duration else 0.0,
+        "items_per_s": round(items / duration, 2) if duration else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 0.50) * 1000, 1),
+            "p95": round(percentile(latencies, 0.95) * 1000, 1),
+            "p99": round(percentile(latencies, 0.99) * 1000, 1),
+            "mean": round(sum(latencies) / requests * 1000, 1) if requests else 0.0,
+            "max": round(latencies[-1] * 1000, 1) if latencies else 0.0,
+        },
+        "upstream": upstream,
+        "upstream_per_request": {key: round(value / requests, 3) if requests else 0.0
+                                 for key, value in upstream.items()},
+    }
+
+
+def print_results(results: List[Dict[str, Any]]) -> None:
+    header = f"{'scenario':<22}{'conc':>5}{'req/s':>9}{'items/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}" \
+             f"{'fail':>6}{'llm/req':>9}{'fast/req':>9}{'detail/req':>11}{'cookie/req':>11}"
+    print(header)
+    print("-" * len(header))
+    for result in results:
+        latency = result["latency_ms"]
+        per_request = result["upstream_per_request"]
+        print(
+            f"{result['scenario']:<22}{result['concurrency']:>5}{result['requests_per_s']:>9.1f}"
+            f"{result['items_per_s']:>9.1f}{latency['p50']:>9.1f}{latency['p95']:>9.1f}{latency['p99']:>9.1f}"
+            f"{result['failed_requests']:>6}{per_request['llm_calls']:>9.2f}"
+            f"{per_request.get('fast_llm_calls', 0.0):>9.2f}"
+            f"{per_request['detail_requests']:>11.2f}{per_request['cookie_requests']:>11.2f}"
+        )
+
+
+def compare(before_path: Path, after_path: Path) -> None:
+    """Print throughput and latency changes between two saved runs."""
+    def load(path: Path) -> Dict[Tuple[str, int], Dict[str, Any]]:
+        with open(path, "r", encoding="utf-8") as f:
+            return {(result["scenario"], result["concurrency"]): result for result in json.load(f)["results"]}
+
+    def change(old: float, new: float) -> str:
+        return f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+
+    before, after = load(before_path), load(after_path)
+    header = f"{'scenario':<22}{'conc':>5}{'req/s':>18}{'p50 ms':>18}{'p99 ms':>18}"
+    print(header)
+    print("-" * len(header))
+    for key in sorted(before.keys() & after.keys()):
+        old, new = before[key], after[key]
+        print(
+            f"{key[0]:<22}{key[1]:>5}"
+            f"{new['requests_per_s']:>10.1f}{change(old['requests_per_s'], new['requests_per_s']):>8}"
+            f"{new['latency_ms']['p50']:>10.1f}{change(old['latency_ms']['p50'], new['latency_ms']['p50']):>8}"
+            f"{new['latency_ms']['p99']:>10.1f}{change(old['latency_ms']['p99'], new['latency_ms']['p99']):>8}"
+        )
+    for key in sorted(before.keys() ^ after.keys()):
+        print(f"{key[0]:<22}{key[1]:>5}  only in {'before' if key in before else 'after'}")
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark the API against local upstream stand-ins.")
+    parser.add_argument("--scenarios", nargs="+", choices=sorted(SCENARIOS), default=DEFAULT_SCENARIOS,
+                        help=f"Scenarios to run (default: {' '.join(DEFAULT_SCENARIOS)})")
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 8, 32],
+                        help="Concurrency levels (default: 1 8 32)")
+    parser.add_argument("--requests", type=int, default=100, help="Requests per scenario and level (default: 100)")
+    parser.add_argument("--warmup", type=int, default=5, help="Unmeasured requests before each run (default: 5)")
+    parser.add_argument("--batch-size", type=int, default=20, help="Products per batch request (default: 20)")
+    parser.add_argument("--distinct-products", type=int, default=0,
+                        help="Cycle through this many product IDs (default: 0, every request uses new IDs)")
+    parser.add_argument("--cache", choices=["bypass", "use", "refresh"], default="bypass",
+                        help="X-Cache-Control header sent with every request (default: bypass)")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="Fake model latency in seconds (default: 0.5)")
+    parser.add_argument("--llm-latency-jitter", type=float, default=0.1,
+                        help="Uniform +/- jitter on the model latency (default: 0.1)")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="Fraction of model calls that fail")
+    parser.add_argument("--llm-malformed-rate", type=float, default=0.0,
+                        help="Fraction of model calls returning malformed JSON")
+    parser.add_argument("--fast-llm-latency", type=float, default=0.2,
+                        help="Fake fast-tier model latency in seconds (default: 0.2)")
+    parser.add_argument("--llm-uncertain-rate", type=float, default=0.1,
+                        help="Fraction of fast-tier results reporting low confidence (default: 0.1)")
+    parser.add_argument("--routing", choices=["escalate", "single"], default="escalate",
+                        help="Model routing policy (default: escalate)")
+    parser.add_argument("--llm-max-in-flight", type=int, default=None,
+                        help="Concurrent model calls admitted (default: LLM_MAX_IN_FLIGHT)")
+    parser.add_argument("--llm-max-queue", type=int, default=None,
+                        help="Model calls queued for admission before shedding (default: LLM_MAX_QUEUE)")
+    parser.add_argument("--woolworths-latency", type=float, default=0.05,
+                        help="Stub Woolworths latency in seconds (default: 0.05)")
+    parser.add_argument("--payloads", type=Path, default=PAYLOAD_DIR,
+                        help="Directory of recorded product detail responses named <product id>.json")
+    parser.add_argument("--no-product-store", action="store_true",
+                        help="Fetch product details from the stub on every request instead of reading snapshots")
+    parser.add_argument("--rate-limit", action="store_true",
+                        help="Keep the configured outbound rate limits (default: disabled)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the fake model's latency and failures")
+    parser.add_argument("--output", type=Path, default=None,
+                        help="Results file (default: bench-results/<timestamp>.json)")
+    parser.add_argument("--compare", nargs=2, type=Path, metavar=("BEFORE", "AFTER"),
+                        help="Compare two saved results files instead of running")
+    return parser.parse_args(argv)
+
+
+async def run(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    stub = StubWoolworthsServer(load_payloads(args.payloads), latency=args.woolworths_latency)
+    await stub.start()
+
+    # Settings are read on import, so the app is configured and imported only now
+    cache_dir = tempfile.mkdtemp(prefix="bench-cache-")
+    os.environ["WOOLWORTHS_BASE_URL"] = stub.base_url
+    os.environ.setdefault("GOOGLE_API_KEY", "benchmark")
+    os.environ["CACHE_DB_PATH"] = os.path.join(cache_dir, "results.db")
+    os.environ["SIMILARITY_DB_PATH"] = os.path.join(cache_dir, "similarity.db")
+    os.environ["PRODUCT_STORE_DB_PATH"] = os.path.join(cache_dir, "products.db")
+    os.environ["JOBS_DB_PATH"] = os.path.join(cache_dir, "jobs.db")
+    if args.no_product_store:
+        os.environ["PRODUCT_STORE_ENABLED"] = "false"
+    os.environ["MODEL_ROUTING_POLICY"] = args.routing
+    if not args.rate_limit:
+        os.environ["RATE_LIMIT_ENABLED"] = "false"
+    if args.llm_max_in_flight is not None:
+        os.environ["LLM_MAX_IN_FLIGHT"] = str(args.llm_max_in_flight)
+    if args.llm_max_queue is not None:
+        os.environ["LLM_MAX_QUEUE"] = str(args.llm_max_queue)
+
+    import uvicorn
+    import main as api
+    from config import settings
+    from gemini_client import GeminiClient
+
+    llm = FakeChatModel(
+        latency=args.llm_latency,
+        latency_jitter=args.llm_latency_jitter,
+        error_rate=args.llm_error_rate,
+        malformed_rate=args.llm_malformed_rate,
+        uncertain_rate=args.llm_uncertain_rate,
+        seed=args.seed
+    )
+    gemini_client = GeminiClient(admission=api.get_admission_controller(), llm=llm)
+    api.app.dependency_overrides[api.get_gemini_client] = lambda: gemini_client
+    fast_llm = None
+    if args.routing == "escalate":
+        fast_llm = FakeChatModel(
+            latency=args.fast_llm_latency,
+            latency_jitter=args.llm_latency_jitter,
+            error_rate=args.llm_error_rate,
+            malformed_rate=args.llm_malformed_rate,
+            uncertain_rate=args.llm_uncertain_rate,
+            seed=args.seed
+        )
+        fast_gemini_client = GeminiClient(model_name=settings.fast_model_name,
+                                          admission=api.get_admission_controller(), llm=fast_llm)
+        api.app.dependency_overrides[api.get_fast_gemini_client] = lambda: fast_gemini_client
+
+    server = uvicorn.Server(uvicorn.Config(api.app, host="127.0.0.1", port=0, log_level="warning",
+                                           access_log=False))
+    serve_task = asyncio.create_task(server.serve())
+    while not server.started:
+        if serve_task.done():
+            serve_task.result()
+        await asyncio.sleep(0.05)
+    port = server.servers[0].sockets[0].getsockname()[1]
+    base_url = f"http://127.0.0.1:{port}"
+
+    ids = product_ids(args.distinct_products)
+    results = []
+    try:
+        for name in args.scenarios:
+            for concurrency in args.concurrency:
+                driver = LoadDriver(base_url, SCENARIOS[name], args.batch_size, ids, args.cache)
+                if args.warmup:
+                    await driver.run(min(concurrency, args.warmup), args.warmup)
+
+                stub.reset_counters()
+                llm.reset_counters()
+                if fast_llm is not None:
+                    fast_llm.reset_counters()
+                samples, duration = await driver.run(concurrency, args.requests)
+                counters = {**stub.counters(), **llm.counters()}
+                if fast_llm is not None:
+                    counters.update({f"fast_{key}": value for key, value in fast_llm.counters().items()})
+                result = summarize(name, concurrency, samples, duration, counters)
+                logger.info(
+                    f"{name} @ {concurrency}: {result['requests_per_s']} req/s, "
+                    f"p50 {result['latency_ms']['p50']} ms, p99 {result['latency_ms']['p99']} ms"
+                )
+                results.append(result)
+    finally:
+        server.should_exit = True
+        await serve_task
+        await stub.stop()
+    return results
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+    # Per-request application logs would distort the measurements
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    logger.setLevel(logging.INFO)
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    started_at = datetime.now(timezone.utc)
+    results = asyncio.run(run(args))
+    print_results(results)
+
+    output = args.output or Path("bench-results") / f"{started_at.strftime('%Y%m%dT%H%M%SZ')}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({
+            "started_at": started_at.isoformat(),
+            "config": {key: str(value) if isinstance(value, Path) else value
+                       for key, value in vars(args).items() if key not in ("output", "compare")},
+            "results": results,
+        }, f, indent=2)
+    logger.info(f"Saved results to {output}")
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        sys.exit(130)
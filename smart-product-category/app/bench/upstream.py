@@ -0,0 +1,205 @@
+import asyncio
+import copy
+import json
+import logging
+import zlib
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+PAYLOAD_DIR = Path(__file__).parent / "payloads"
+SESSION_COOKIE = "bm_sz"
+
+
+def load_payloads(payload_dir: Path = PAYLOAD_DIR) -> Dict[str, Dict[str, Any]]:
+    """Load recorded product detail responses, keyed by product ID (file stem)."""
+    payloads = {}
+    for path in sorted(payload_dir.glob("*.json")):
+        with open(path, "r", encoding="utf-8") as f:
+            payloads[path.stem] = json.load(f)
+    if not payloads:
+        raise ValueError(f"No product payloads found in {payload_dir}")
+    return payloads
+
+
+class StubWoolworthsServer:
+    """Local stand-in for the Woolworths cookie page and product detail API.
+
+    Serves recorded product detail payloads. Any other numeric product ID is
+    answered with a copy of one of the recordings under a distinct package
+    size, like the size variants of a real product, so benchmarks can use as
+    many different products as they need; other IDs get a 404. Like the real site, the detail API answers 403 until the
+    client has visited the cookie page.
+    """
+
+    def __init__(self,
+                 payloads: Optional[Dict[str, Dict[str, Any]]] = None,
+                 latency: float = 0.0,
+                 host: str = "127.0.0.1",
+                 port: int = 0):
+        """Initialize the stub server.
+
+        Args:
+            payloads: Product detail responses keyed by product ID (defaults
+                to the payloads shipped in bench/payloads)
+            latency: Seconds added to every response
+            host: Interface to listen on
+            port: Port to listen on (0 picks a free port)
+        """
+        self.payloads = payloads or load_payloads()
+        self._recordings: List[Dict[str, Any]] = list(self.payloads.values())
+        self.latency = latency
+        self.host = host
+        self.port = port
+        self.cookie_requests = 0
+        self.detail_requests = 0
+        self._runner: Optional[web.AppRunner] = None
+
+        self.app = web.Application()
+        self.app.router.add_get("/shop/productdetails/", self._cookie_page)
+        self.app.router.add_get("/apis/ui/product/detail/{product_id}/", self._product_detail)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def reset_counters(self) -> None:
+        self.cookie_requests = 0
+        self.detail_requests = 0
+
+    def counters(self) -> Dict[str, int]:
+        return {"cookie_requests": self.cookie_requests, "detail_requests": self.detail_requests}
+
+    def product(self, product_id: str) -> Optional[Dict[str, Any]]:
+        """Return the payload served for a product ID, or None for a 404."""
+        if product_id in self.payloads:
+            return self.payloads[product_id]
+        if not product_id.isdigit():
+            return None
+
+        payload = copy.deepcopy(self._recordings[int(product_id) % len(self._recordings)])
+        product = payload["Product"]
+        product["Stockcode"] = int(product_id)
+        product["DisplayName"] = f"{product['DisplayName']} {product_id}g"
+        return payload
+
+    async def _cookie_page(self, request: web.Request) -> web.Response:
+        self.cookie_requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        response = web.Response(text="<html></html>", content_type="text/html")
+        response.set_cookie(SESSION_COOKIE, "benchmark")
+        return response
+
+    async def _product_detail(self, request: web.Request) -> web.Response:
+        self.detail_requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if SESSION_COOKIE not in request.cookies:
+            return web.json_response({"Message": "Forbidden"}, status=403)
+
+        payload = self.product(request.match_info["product_id"])
+        if payload is None:
+            return web.json_response({"Message": "Not found"}, status=404)
+        return web.json_response(payload)
+
+    async def start(self) -> str:
+        """Start serving and return the base URL to point the client at."""
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        logger.info(f"Stub Woolworths server listening on {self.base_url}")
+        return self.base_url
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+class StubRetrievalServer:
+    """Local stand-in for the product retrieval model's predict endpoint.
+
+    Answers every instance term with `max_results` product numbers and
+    descending scores derived from the term, so results are deterministic.
+    With `token` set, requests without that bearer token get a 401.
+    """
+
+    PREDICT_PATH = "/predict"
+
+    def __init__(self, latency: float = 0.0, token: Optional[str] = None, host: str = "127.0.0.1", port: int = 0):
+        """Initialize the stub server.
+
+        Args:
+            latency: Seconds added to every response
+            token: Bearer token requests must carry (any or none if omitted)
+            host: Interface to listen on
+            port: Port to listen on (0 picks a free port)
+        """
+        self.latency = latency
+        self.token = token
+        self.host = host
+        self.port = port
+        self.requests = 0
+        self.instances = 0
+        self._runner: Optional[web.AppRunner] = None
+
+        self.app = web.Application(client_max_size=64 * 1024 ** 2)
+        self.app.router.add_post(self.PREDICT_PATH, self._predict)
+
+    @property
+    def endpoint(self) -> str:
+        return f"http://{self.host}:{self.port}{self.PREDICT_PATH}"
+
+    def reset_counters(self) -> None:
+        self.requests = 0
+        self.instances = 0
+
+    def counters(self) -> Dict[str, int]:
+        return {"retrieval_requests": self.requests, "retrieval_instances": self.instances}
+
+    @staticmethod
+    def prediction(term: str, max_results: int) -> Dict[str, Any]:
+        """Return the prediction served for a term."""
+        seed = zlib.crc32(term.encode("utf-8"))
+        top = 0.6 + (seed % 400) / 1000
+        return {
+            "keyword": term,
+            "articles": [str(100000 + (seed + i * 7919) % 900000) for i in range(max_results)],
+            "scores": [round(top * (1 - i / max_results), 6) for i in range(max_results)],
+        }
+
+    async def _predict(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.token is not None and request.headers.get("Authorization") != f"Bearer {self.token}":
+            return web.json_response({"error": "Unauthenticated"}, status=401)
+
+        body = await request.json()
+        max_results = int(body.get("parameters", {}).get("max_results", 3))
+        instances = body.get("instances", [])
+        self.instances += len(instances)
+        return web.json_response({
+            "predictions": [self.prediction(str(instance.get("term", "")), max_results) for instance in instances]
+        })
+
+    async def start(self) -> str:
+        """Start serving and return the predict endpoint URL."""
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        logger.info(f"Stub retrieval server listening on {self.endpoint}")
+        return self.endpoint
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
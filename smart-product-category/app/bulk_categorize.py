@@ -0,0 +1,404 @@
+"""Offline bulk categorization.
+
+Runs product IDs (or SearchPhrase,FacetDisplayName pairs such as those in
+facets_b2c.csv) through the same WoolworthsClient -> ProductDataExtractor ->
+PromptLoader -> ModelRouter pipeline as the API, without going through HTTP.
+
+Results are written in chunks to JSONL or Parquet, and every completed item is
+recorded in a checkpoint file so an interrupted run resumes where it stopped.
+Failed items go to a separate errors file and are retried by the next run.
+
+Usage:
+    python bulk_categorize.py --input ids.csv --output results.jsonl
+    python bulk_categorize.py --input ../../facets_b2c.csv --output facets.jsonl
+    python bulk_categorize.py --input ids.parquet --output results.parquet --mode enhanced
+    python bulk_categorize.py --input ids.csv --output results.jsonl --mode enhanced --fields dietary_attributes
+    python bulk_categorize.py --input catalogue.csv --output nightly.jsonl --incremental
+"""
+import argparse
+import asyncio
+import csv
+import json
+import logging
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Dict, Any, Iterator, List, NamedTuple, Optional, Set
+
+from admission import Priority, set_priority
+from categorizer import ENHANCED_FIELDS, ProductCategorizer
+from config import settings
+from main import (
+    get_prompt_loader, get_gemini_client, get_fast_gemini_client, get_model_router, get_woolworths_client,
+    get_product_data_extractor, get_result_cache, get_facet_matcher, get_similarity_cache, get_prompt_builder
+)
+from result_cache import CacheMode, cache_status, change_status
+
+logger = logging.getLogger("bulk_categorize")
+
+
+class BulkItem(NamedTuple):
+    """A single unit of work read from the input file."""
+    key: str
+    product_id: Optional[str] = None
+    search_phrase: Optional[str] = None
+    facet: Optional[str] = None
+
+    def record(self) -> Dict[str, Any]:
+        """Identifying fields written alongside the item's result."""
+        if self.product_id is not None:
+            return {"key": self.key, "product_id": self.product_id}
+        return {"key": self.key, "search_phrase": self.search_phrase, "facet": self.facet}
+
+
+def _item_from_row(row: Dict[str, Any], id_column: str) -> Optional[BulkItem]:
+    """Build a work item from an input row, or None for blank rows."""
+    if row.get(id_column) not in (None, ""):
+        product_id = str(row[id_column]).strip()
+        return BulkItem(key=product_id, product_id=product_id)
+
+    phrase = str(row.get("SearchPhrase") or "").strip()
+    facet = str(row.get("FacetDisplayName") or "").strip()
+    if phrase and facet:
+        return BulkItem(key=f"{phrase}|{facet}", search_phrase=phrase, facet=facet)
+    return None
+
+
+def read_items(path: Path, id_column: str) -> Iterator[BulkItem]:
+    """Read work items from a CSV, JSONL or Parquet file.
+
+    Rows are read as product IDs from `id_column`, or as facet pairs from
+    the SearchPhrase and FacetDisplayName columns.
+
+    Args:
+        path: Input file
+        id_column: Column holding product IDs
+
+    Yields:
+        Work items in file order
+    """
+    suffix = path.suffix.lower()
+
+    if suffix == ".csv":
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            for row in csv.DictReader(f):
+                item = _item_from_row(row, id_column)
+                if item is not None:
+                    yield item
+
+    elif suffix in (".jsonl", ".ndjson"):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                value = json.loads(line)
+                row = value if isinstance(value, dict) else {id_column: value}
+                item = _item_from_row(row, id_column)
+                if item is not None:
+                    yield item
+
+    elif suffix == ".parquet":
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise SystemExit("Reading Parquet requires pyarrow: poetry install --extras offline")
+        for batch in pq.ParquetFile(path).iter_batches():
+            for row in batch.to_pylist():
+                item = _item_from_row(row, id_column)
+                if item is not None:
+                    yield item
+
+    else:
+        raise SystemExit(f"Unsupported input format: {path.suffix} (expected .csv, .jsonl or .parquet)")
+
+
+class Checkpoint:
+    """Append-only log of the keys of completed items."""
+
+    def __init__(self, path: Path):
+        self.path = path
+
+    def load(self) -> Set[str]:
+        if not self.path.exists():
+            return set()
+        with open(self.path, encoding="utf-8") as f:
+            return {line.rstrip("\n") for line in f if line.strip()}
+
+    def mark(self, keys: List[str]) -> None:
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.writelines(f"{key}\n" for key in keys)
+            f.flush()
+            os.fsync(f.fileno())
+
+
+class ResultWriter:
+    """Writes result records to JSONL (appended) or Parquet (one file per chunk)."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.parquet = path.suffix.lower() == ".parquet"
+        if self.parquet:
+            try:
+                import pyarrow  # noqa: F401
+            except ImportError:
+                raise SystemExit("Writing Parquet requires pyarrow: poetry install --extras offline")
+            # Parquet files can't be appended to, so chunks go to part files in a directory
+            self.parts_dir = path.with_suffix("")
+            self.parts_dir.mkdir(parents=True, exist_ok=True)
+            self.next_part = len(list(self.parts_dir.glob("part-*.parquet")))
+        else:
+            path.parent.mkdir(parents=True, exist_ok=True)
+
+    def write(self, records: List[Dict[str, Any]]) -> None:
+        if self.parquet:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            columns = {
+                "key": [r["key"] for r in records],
+                "product_id": [r.get("product_id") for r in records],
+                "search_phrase": [r.get("search_phrase") for r in records],
+                "facet": [r.get("facet") for r in records],
+                "result": [json.dumps(r["result"]) if "result" in r else None for r in records],
+                "error": [json.dumps(r["error"]) if "error" in r else None for r in records],
+            }
+            # Explicit string types keep every part file on the same schema
+            table = pa.table({name: pa.array(values, type=pa.string()) for name, values in columns.items()})
+            pq.write_table(table, self.parts_dir / f"part-{self.next_part:05d}.parquet")
+            self.next_part += 1
+        else:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.writelines(json.dumps(r) + "\n" for r in records)
+                f.flush()
+                os.fsync(f.fileno())
+
+
+class BulkRunner:
+    """Categorizes work items with a pool of asyncio workers."""
+
+    def __init__(self,
+                 categorizer: ProductCategorizer,
+                 writer: ResultWriter,
+                 errors: ResultWriter,
+                 checkpoint: Checkpoint,
+                 enhanced: bool,
+                 workers: int,
+                 chunk_size: int,
+                 cache_mode: CacheMode,
+                 progress_interval: float,
+                 fields: Optional[List[str]] = None):
+        self.categorizer = categorizer
+        self.writer = writer
+        self.errors = errors
+        self.checkpoint = checkpoint
+        self.enhanced = enhanced
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.cache_mode = cache_mode
+        self.progress_interval = progress_interval
+        self.fields = fields
+
+        self._buffer: List[Dict[str, Any]] = []
+        self._flush_lock = asyncio.Lock()
+        self.succeeded = 0
+        self.failed = 0
+        # Products whose result was reused, or recomputed because their data changed or was new
+        self.skipped = 0
+        self.changed = 0
+        self.new = 0
+
+    async def _categorize(self, item: BulkItem) -> Dict[str, Any]:
+        if item.product_id is None:
+            name = item.facet
+            if item.search_phrase.lower() not in item.facet.lower():
+                name = f"{item.facet} {item.search_phrase}"
+            result = await self.categorizer.categorize_name(name, self.cache_mode)
+        elif self.enhanced:
+            result = await self.categorizer.categorize_enhanced(item.product_id, self.cache_mode, self.fields)
+        else:
+            result = await self.categorizer.categorize(item.product_id, self.cache_mode)
+        return result.model_dump()
+
+    def _count_change(self) -> None:
+        if cache_status.get() in ("HIT", "UNCHANGED"):
+            self.skipped += 1
+        elif change_status.get() == "CHANGED":
+            self.changed += 1
+        elif change_status.get() == "NEW":
+            self.new += 1
+
+    async def _flush(self, force: bool = False) -> None:
+        async with self._flush_lock:
+            if not self._buffer or (not force and len(self._buffer) < self.chunk_size):
+                return
+            records, self._buffer = self._buffer, []
+            # Failed items are kept out of the output and the checkpoint so that
+            # a resumed run retries them without duplicating rows
+            results = [r for r in records if "error" not in r]
+            failures = [r for r in records if "error" in r]
+            if results:
+                await asyncio.to_thread(self.writer.write, results)
+                await asyncio.to_thread(self.checkpoint.mark, [r["key"] for r in results])
+            if failures:
+                await asyncio.to_thread(self.errors.write, failures)
+
+    async def _worker(self, queue: "asyncio.Queue[BulkItem]") -> None:
+        while True:
+            item = await queue.get()
+            try:
+                record = item.record()
+                cache_status.set(None)
+                change_status.set(None)
+                try:
+                    record["result"] = await self._categorize(item)
+                    self.succeeded += 1
+                    self._count_change()
+                except Exception as e:
+                    logger.warning(f"Failed to categorize {item.key}: {str(e)}")
+                    record["error"] = {"type": type(e).__name__, "detail": str(e)}
+                    self.failed += 1
+                self._buffer.append(record)
+                await self._flush()
+            finally:
+                queue.task_done()
+
+    async def _report_progress(self, total: int, started_at: float) -> None:
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            done = self.succeeded + self.failed
+            elapsed = time.monotonic() - started_at
+            rate = done / elapsed if elapsed else 0.0
+            eta = (total - done) / rate if rate else float("inf")
+            logger.info(
+                f"Progress: {done}/{total} ({self.failed} failed) | "
+                f"{rate:.1f} items/s | ETA {eta / 60:.1f} min"
+            )
+
+    async def run(self, items: List[BulkItem]) -> None:
+        queue: "asyncio.Queue[BulkItem]" = asyncio.Queue(maxsize=self.workers * 2)
+        started_at = time.monotonic()
+        workers = [asyncio.create_task(self._worker(queue)) for _ in range(self.workers)]
+        reporter = asyncio.create_task(self._report_progress(len(items), started_at))
+
+        try:
+            for item in items:
+                await queue.put(item)
+            await queue.join()
+        finally:
+            for task in workers + [reporter]:
+                task.cancel()
+            await asyncio.gather(*workers, reporter, return_exceptions=True)
+            # Persist whatever completed, so an interrupted run can resume
+            await self._flush(force=True)
+
+        elapsed = time.monotonic() - started_at
+        logger.info(
+            f"Finished {self.succeeded + self.failed} items in {elapsed:.1f}s: "
+            f"{self.succeeded} succeeded, {self.failed} failed; "
+            f"{self.skipped} skipped, {self.changed} changed, {self.new} new"
+        )
+
+
+def build_categorizer(use_cache: bool) -> ProductCategorizer:
+    """Build a categorizer from the same shared components the API uses."""
+    return ProductCategorizer(
+        get_woolworths_client(),
+        get_model_router(get_gemini_client(), get_fast_gemini_client()),
+        get_prompt_loader(),
+        get_product_data_extractor(),
+        get_result_cache() if use_cache else None,
+        get_facet_matcher(),
+        get_similarity_cache() if use_cache else None,
+        get_prompt_builder()
+    )
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Categorize products in bulk without the HTTP API.")
+    parser.add_argument("--input", required=True, type=Path,
+                        help="CSV, JSONL or Parquet file of product IDs or SearchPhrase,FacetDisplayName pairs")
+    parser.add_argument("--output", required=True, type=Path,
+                        help="Output file (.jsonl, or .parquet for a directory of Parquet part files)")
+    parser.add_argument("--mode", choices=["basic", "enhanced"], default="basic",
+                        help="Categorization to run for product IDs (default: basic)")
+    parser.add_argument("--fields", nargs="+", choices=ENHANCED_FIELDS, default=None, metavar="FIELD",
+                        help=f"Enhanced fields to generate besides type and variety, from {', '.join(ENHANCED_FIELDS)} (default: all)")
+    parser.add_argument("--id-column", default="product_id", help="Column holding product IDs (default: product_id)")
+    parser.add_argument("--checkpoint", type=Path, default=None,
+                        help="Checkpoint file (default: <output>.checkpoint)")
+    parser.add_argument("--errors", type=Path, default=None,
+                        help="JSONL file of failed items (default: <output>.errors.jsonl)")
+    parser.add_argument("--workers", type=int, default=settings.batch_concurrency,
+                        help="Number of concurrent workers (default: BATCH_CONCURRENCY)")
+    parser.add_argument("--chunk-size", type=int, default=500, help="Results per output write (default: 500)")
+    parser.add_argument("--progress-interval", type=float, default=10.0,
+                        help="Seconds between progress lines (default: 10)")
+    parser.add_argument("--no-cache", action="store_true", help="Don't read from or write to the result cache")
+    parser.add_argument("--refresh-cache", action="store_true", help="Recompute results and update the result cache")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Check every product's data and recompute only those that changed since their cached result")
+    return parser.parse_args(argv)
+
+
+async def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+    # Offline runs are bulk work as far as admission control is concerned
+    set_priority(Priority.BULK)
+    checkpoint = Checkpoint(args.checkpoint or args.output.with_name(args.output.name + ".checkpoint"))
+
+    completed = checkpoint.load()
+    items = list({item.key: item for item in read_items(args.input, args.id_column)}.values())
+    todo = [item for item in items if item.key not in completed]
+    logger.info(f"Read {len(items)} items from {args.input}; {len(items) - len(todo)} already completed")
+
+    if args.mode == "enhanced" and any(item.product_id is None for item in todo):
+        raise SystemExit("Enhanced categorization needs product IDs; facet pairs only support basic mode")
+    if not todo:
+        return
+
+    use_cache = not args.no_cache
+    if args.refresh_cache and args.incremental:
+        raise SystemExit("--refresh-cache and --incremental cannot be combined")
+    if args.incremental and not use_cache:
+        raise SystemExit("--incremental needs the result cache; drop --no-cache")
+    cache_mode = CacheMode.USE
+    if args.refresh_cache:
+        cache_mode = CacheMode.REFRESH
+    elif args.incremental:
+        cache_mode = CacheMode.REVALIDATE
+    woolworths_client = get_woolworths_client()
+    await woolworths_client.start()
+    try:
+        runner = BulkRunner(
+            build_categorizer(use_cache),
+            ResultWriter(args.output),
+            ResultWriter(args.errors or args.output.with_name(args.output.name + ".errors.jsonl")),
+            checkpoint,
+            enhanced=args.mode == "enhanced",
+            workers=max(1, args.workers),
+            chunk_size=max(1, args.chunk_size),
+            cache_mode=cache_mode,
+            progress_interval=args.progress_interval,
+            fields=args.fields
+        )
+        await runner.run(todo)
+    finally:
+        await woolworths_client.close()
+        if woolworths_client.snapshots is not None:
+            woolworths_client.snapshots.close()
+        result_cache = get_result_cache()
+        if use_cache and result_cache is not None:
+            result_cache.close()
+        similarity_cache = get_similarity_cache()
+        if use_cache and similarity_cache is not None:
+            similarity_cache.close()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        logger.warning("Interrupted; rerun the same command to resume from the checkpoint")
+        sys.exit(130)
@@ -0,0 +1,653 @@
+import asyncio
+import logging
+from functools import lru_cache
+from typing import Any, Dict, FrozenSet, Iterable, List, NamedTuple, Optional, Callable, Awaitable, Tuple, Type, TypeVar, Union
+
+from pydantic import BaseModel
+
+from api_models import ProductResponse, EnhancedProductResponse
+from config import settings
+from facet_matcher import FacetMatcher
+from metrics import timed_stage
+from model_router import ModelRouter
+from prompt_builder import PromptBuilder
+from prompt_loader import PromptLoader
+from woolworths_client import WoolworthsClient
+from product_utils import ProductDataExtractor
+from result_cache import ResultCache, CacheMode, cache_status
+from similarity_cache import SimilarityCache
+from templates import CATEGORY_PACK_ITEM_TEMPLATE, ENHANCED_CATEGORY_PACK_ITEM_TEMPLATE
+
+logger = logging.getLogger(__name__)
+
+# JSON structure for the response
+JSON_STRUCTURE = {
+    "type": "string",
+    "variety": ["string"]
+}
+
+# JSON structure for enhanced response
+ENHANCED_JSON_STRUCTURE = {
+    "type": "string",
+    "variety": ["string"],
+    "dietary_attributes": ["string"],
+    "flavor_profile": ["string"],
+    "usage_occasions": ["string"],
+    "health_benefits": ["string"],
+    "certifications": ["string"],
+    "texture": ["string"],
+    "ingredients_highlight": ["string"],
+    "serving_suggestions": ["string"],
+    "pairings": ["string"]
+}
+
+# Enhanced fields that are always generated; the rest are generated on request
+ENHANCED_BASE_FIELDS = ("type", "variety")
+ENHANCED_FIELDS = tuple(name for name in ENHANCED_JSON_STRUCTURE if name not in ENHANCED_BASE_FIELDS)
+
+# Prompt instruction for each enhanced field, in the order they are listed
+ENHANCED_FIELD_INSTRUCTIONS = {
+    "type": "Primary product type (e.g., plant-based milk, kombucha, organic snack)",
+    "variety": "Specific product varieties (e.g., almond milk, raspberry flavor, unsweetened)",
+    "package_size": 'Package size (e.g., "1L", "250g", "6 pack") - standardize the format if needed',
+    "dietary_attributes": "Dietary attributes (e.g., vegan, gluten-free, low-sugar)",
+    "flavor_profile": "Flavor profile (e.g., sweet, tart, fruity, savory)",
+    "usage_occasions": "Usage occasions (e.g., breakfast, post-workout, snacking)",
+    "health_benefits": "Health benefits (if applicable, e.g., probiotic, high-protein)",
+    "certifications": "Certifications (e.g., organic, non-GMO)",
+    "texture": "Texture (e.g., crunchy, smooth, fizzy)",
+    "ingredients_highlight": "Key ingredients to highlight",
+    "serving_suggestions": "Serving suggestions",
+    "pairings": "Food/drink pairings",
+}
+
+
+# Variables each prompt is formatted with, checked when prompts are preloaded
+PROMPT_VARIABLES = {
+    "category_prompt": ["product_name"],
+    "enhanced_category_prompt": [
+        "product_name", "product_description", "ingredients",
+        "package_size", "dietary_info", "department_category", "field_instructions", "examples"
+    ],
+    "category_batch_prompt": [],
+    "enhanced_category_batch_prompt": ["field_instructions", "examples"],
+}
+
+# Few-shot examples file of each prompt with an {examples} variable
+PROMPT_EXAMPLES = {
+    "enhanced_category_prompt": "enhanced_category_examples",
+    "enhanced_category_batch_prompt": "enhanced_category_examples",
+}
+
+# Estimated output tokens of one product's result, used to size packed prompts
+CATEGORY_OUTPUT_TOKENS = 60
+ENHANCED_FIELD_OUTPUT_TOKENS = 38
+
+ResultT = TypeVar("ResultT", bound=BaseModel)
+
+
+class EnhancedVariant(NamedTuple):
+    """Schema and prompt instructions for one set of requested enhanced fields."""
+    fields: Tuple[str, ...]
+    json_structure: Dict[str, Any]
+    instructions: str
+    omitted: FrozenSet[str]
+    output_tokens: int
+
+    def covers(self, values: Dict[str, Any]) -> bool:
+        return all(name in values for name in self.fields)
+
+    def select(self, values: Dict[str, Any]) -> EnhancedProductResponse:
+        """Build a response carrying exactly the base and requested fields."""
+        return EnhancedProductResponse(**{
+            name: values[name] if name in values else [] for name in ENHANCED_BASE_FIELDS + self.fields
+        })
+
+
+@lru_cache(maxsize=None)
+def enhanced_variant(fields: FrozenSet[str] = frozenset(ENHANCED_FIELDS)) -> EnhancedVariant:
+    """Return the variant for a set of enhanced fields, built once per set.
+
+    Raises:
+        ValueError: If a field is not an enhanced field
+    """
+    unknown = fields - set(ENHANCED_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown enhanced fields: {sorted(unknown)}")
+
+    ordered = tuple(name for name in ENHANCED_FIELDS if name in fields)
+    instructed = ENHANCED_BASE_FIELDS + ("package_size",) + ordered
+    return EnhancedVariant(
+        fields=ordered,
+        json_structure={name: ENHANCED_JSON_STRUCTURE[name] for name in ENHANCED_BASE_FIELDS + ordered},
+        instructions="\n".join(
+            f"{number}. {ENHANCED_FIELD_INSTRUCTIONS[name]}" for number, name in enumerate(instructed, 1)
+        ),
+        omitted=frozenset(ENHANCED_FIELDS) - fields,
+        output_tokens=CATEGORY_OUTPUT_TOKENS + ENHANCED_FIELD_OUTPUT_TOKENS * len(ordered)
+    )
+
+
+class ProductNotFoundError(LookupError):
+    """Raised when a product cannot be found or has no usable data."""
+
+
+class ProductCategorizer:
+    """Runs the Woolworths -> prompt -> Gemini pipeline for a single product.
+
+    Shared by the single-product endpoints and the batch endpoints so that
+    both paths categorize products in exactly the same way.
+    """
+
+    def __init__(self,
+                 woolworths_client: WoolworthsClient,
+                 model_router: ModelRouter,
+                 prompt_loader: PromptLoader,
+                 product_extractor: ProductDataExtractor,
+                 result_cache: Optional[ResultCache] = None,
+                 facet_matcher: Optional[FacetMatcher] = None,
+                 similarity_cache: Optional[SimilarityCache] = None,
+                 prompt_builder: Optional[PromptBuilder] = None):
+        """Initialize the categorizer.
+
+        Args:
+            woolworths_client: Client used to fetch product details
+            model_router: Routes the categorization prompts to the Gemini model tiers
+            prompt_loader: Loader for the prompt templates
+            product_extractor: Extractor for the enhanced prompt variables
+            result_cache: Optional cache of previous categorization results
+            facet_matcher: Optional matcher answering confident facet
+                matches without the LLM
+            similarity_cache: Optional cache reusing the results of
+                near-duplicate product names
+            prompt_builder: Builder formatting prompts within the token
+                budget (defaults to one over `prompt_loader`)
+        """
+        self.woolworths_client = woolworths_client
+        self.model_router = model_router
+        self.prompt_loader = prompt_loader
+        self.product_extractor = product_extractor
+        self.result_cache = result_cache
+        self.facet_matcher = facet_matcher
+        self.similarity_cache = similarity_cache
+        self.prompt_builder = prompt_builder or PromptBuilder(
+            prompt_loader, PROMPT_EXAMPLES, settings.prompt_token_budget
+        )
+
+    def _cache_key(self, endpoint: str, prompt_name: str, product_id: str) -> str:
+        return ResultCache.make_key(
+            product_id,
+            endpoint,
+            self.prompt_builder.template_hash(prompt_name),
+            self.model_router.model_name,
+            self.model_router.temperature
+        )
+
+    def _fingerprint(self, prompt_name: str, variables: Dict[str, Any]) -> str:
+        return ResultCache.make_fingerprint(
+            variables,
+            self.prompt_builder.template_hash(prompt_name),
+            self.model_router.model_name,
+            self.model_router.temperature
+        )
+
+    async def _revalidate(self,
+                          key: str,
+                          prompt_name: str,
+                          variables: Dict[str, Any],
+                          cache_mode: CacheMode) -> Tuple[str, Optional[Dict[str, Any]]]:
+        """Fingerprint a product's prompt variables and look for a result computed from the same ones.
+
+        Returns:
+            The fingerprint, and the stored result when it is unchanged
+            (never in REFRESH mode)
+        """
+        fingerprint = self._fingerprint(prompt_name, variables)
+        if cache_mode == CacheMode.REFRESH:
+            return fingerprint, None
+        with timed_stage("cache_lookup"):
+            return fingerprint, await self.result_cache.revalidate(key, fingerprint)
+
+    async def _cached(self,
+                      endpoint: str,
+                      prompt_name: str,
+                      product_id: str,
+                      cache_mode: CacheMode,
+                      response_model: Type[ResultT],
+                      load: Callable[[], Awaitable[Dict[str, Any]]],
+                      compute: Callable[[Dict[str, Any]], Awaitable[ResultT]]) -> ResultT:
+        """Serve a result from the cache or compute and store it.
+
+        On a cache miss the product's prompt variables are loaded and
+        fingerprinted; a stored result computed from the same variables,
+        prompt and model is reused without calling the LLM. Sets the
+        `cache_status` context variable to HIT, UNCHANGED, MISS or BYPASS
+        (`compute` may set it to SIMILAR, or to FACET for a facet answer,
+        which is not stored: it is cheap to recompute and should follow the
+        current vocabulary).
+
+        Args:
+            endpoint: Name of the categorization endpoint
+            prompt_name: Prompt template used by the endpoint
+            product_id: The Woolworths product ID
+            cache_mode: How this request interacts with the cache
+            response_model: Model used to rebuild cached results
+            load: Coroutine function returning the product's prompt variables
+            compute: Coroutine function producing a fresh result from them
+
+        Returns:
+            Cached or freshly computed result
+        """
+        if self.result_cache is None or cache_mode == CacheMode.BYPASS:
+            cache_status.set("BYPASS")
+            return await compute(await load())
+
+        key = self._cache_key(endpoint, prompt_name, product_id)
+
+        if cache_mode == CacheMode.USE:
+            with timed_stage("cache_lookup"):
+                cached = await self.result_cache.get(key)
+            if cached is not None:
+                logger.info(f"Cache hit for {endpoint} product ID: {product_id}")
+                cache_status.set("HIT")
+                return response_model(**cached)
+
+        variables = await load()
+        fingerprint, unchanged = await self._revalidate(key, prompt_name, variables, cache_mode)
+        if unchanged is not None:
+            logger.info(f"Unchanged {endpoint} inputs for product ID: {product_id}")
+            cache_status.set("UNCHANGED")
+            await self.result_cache.set(key, unchanged, fingerprint)
+            return response_model(**unchanged)
+
+        cache_status.set("MISS")
+        result = await compute(variables)
+        if cache_status.get() != "FACET":
+            await self.result_cache.set(key, result.model_dump(), fingerprint)
+        return result
+
+    async def categorize(self, product_id: str, cache_mode: CacheMode = CacheMode.USE) -> ProductResponse:
+        """Categorize a product into a type and list of varieties.
+
+        Args:
+            product_id: The Woolworths product ID
+            cache_mode: How this request interacts with the result cache
+
+        Returns:
+            ProductResponse with categorization information
+
+        Raises:
+            ProductNotFoundError: If the product has no display name
+            ValueError: If the upstream data or model response is invalid
+        """
+        return await self._cached(
+            "categorize", "category_prompt", product_id, cache_mode, ProductResponse,
+            lambda: self._category_variables(product_id),
+            lambda variables: self.categorize_name(variables["product_name"], cache_mode)
+        )
+
+    async def _category_variables(self, product_id: str) -> Dict[str, Any]:
+        # Fetch product details from Woolworths
+        product_details = await self.woolworths_client.get_product_details(product_id)
+
+        # Handle the Product wrapper
+        if not isinstance(product_details, dict):
+            raise TypeError("Unexpected response format from Woolworths API")
+
+        product_data = product_details.get("Product") or {}
+        display_name = product_data.get("DisplayName")
+
+        if not display_name:
+            logger.error(f"Missing DisplayName in product data: {product_data}")
+            raise ProductNotFoundError("Product not found or missing display name")
+
+        return {"product_name": display_name}
+
+    def match_facets(self, product_name: str) -> Optional[ProductResponse]:
+        """Answer from the facet vocabulary when the name matches it confidently.
+
+        Args:
+            product_name: Display name (or search term) to categorize
+
+        Returns:
+            ProductResponse with the match confidence, or None when the LLM
+            is needed
+        """
+        if self.facet_matcher is None:
+            return None
+
+        with timed_stage("facet_match"):
+            match = self.facet_matcher.match(product_name, settings.facet_min_confidence)
+        if match is None:
+            return None
+
+        logger.info(f"Facet fast path matched '{product_name}' as {match.type} {match.variety} "
+                    f"(confidence {match.confidence})")
+        return ProductResponse(type=match.type, variety=match.variety, confidence=match.confidence)
+
+    def _similarity_namespace(self, endpoint: str, prompt_name: str) -> str:
+        return SimilarityCache.make_namespace(
+            endpoint,
+            self.prompt_builder.template_hash(prompt_name),
+            self.model_router.model_name,
+            self.model_router.temperature
+        )
+
+    def match_similar(self,
+                      endpoint: str,
+                      prompt_name: str,
+                      product_name: str,
+                      cache_mode: CacheMode,
+                      response_model: Type[ResultT],
+                      fields: Iterable[str] = ()) -> Optional[ResultT]:
+        """Reuse the result of a near-duplicate product categorized before.
+
+        Sets the `cache_status` context variable to SIMILAR on a match.
+
+        Args:
+            endpoint: Name of the categorization endpoint
+            prompt_name: Prompt template used by the endpoint
+            product_name: Display name of the product
+            cache_mode: How this request interacts with the caches
+            response_model: Model used to rebuild the reused result
+            fields: Fields the reused result must have
+
+        Returns:
+            The reused result, or None when the LLM is needed
+        """
+        if self.similarity_cache is None or cache_mode in (CacheMode.BYPASS, CacheMode.REFRESH):
+            return None
+
+        with timed_stage("similarity_lookup"):
+            match = self.similarity_cache.lookup(
+                self._similarity_namespace(endpoint, prompt_name), product_name, required_keys=fields
+            )
+        if match is None:
+            return None
+
+        logger.info(f"Reusing {endpoint} result of '{match.name}' for '{product_name}' "
+                    f"(similarity {match.similarity:.2f})")
+        cache_status.set("SIMILAR")
+        return response_model(**match.value)
+
+    async def remember_similar(self,
+                               endpoint: str,
+                               prompt_name: str,
+                               product_name: str,
+                               cache_mode: CacheMode,
+                               result: BaseModel) -> None:
+        """Index a model-generated result for reuse by near-duplicates."""
+        if self.similarity_cache is None or cache_mode == CacheMode.BYPASS:
+            return
+        await self.similarity_cache.add(
+            self._similarity_namespace(endpoint, prompt_name), product_name, result.model_dump()
+        )
+
+    async def categorize_name(self, product_name: str, cache_mode: CacheMode = CacheMode.USE) -> ProductResponse:
+        """Categorize a product from its name alone, without fetching details.
+
+        Names that confidently match the facet vocabulary, or that are near
+        duplicates of a name categorized before, are answered without
+        calling the LLM. Sets the `cache_status` context variable to FACET
+        or SIMILAR when they are.
+
+        Args:
+            product_name: Display name (or search term) to categorize
+            cache_mode: How this request interacts with the similarity cache
+
+        Returns:
+            ProductResponse with categorization information
+
+        Raises:
+            ValueError: If the model response is invalid
+        """
+        matched = self.match_facets(product_name)
+        if matched is not None:
+            cache_status.set("FACET")
+            return matched
+
+        similar = self.match_similar("categorize", "category_prompt", product_name, cache_mode, ProductResponse)
+        if similar is not None:
+            return similar
+
+        # Load and format prompt
+        with timed_stage("prompt_format"):
+            prompt = self.prompt_builder.build("category_prompt", {"product_name": product_name})
+
+        # Process with Gemini
+        model_response = await self.model_router.process_prompt(prompt, JSON_STRUCTURE, ProductResponse)
+
+        result = ProductResponse(**model_response.response)
+        await self.remember_similar("categorize", "category_prompt", product_name, cache_mode, result)
+        return result
+
+    async def categorize_enhanced(self,
+                                  product_id: str,
+                                  cache_mode: CacheMode = CacheMode.USE,
+                                  fields: Optional[Iterable[str]] = None) -> EnhancedProductResponse:
+        """Categorize a product with rich attributes for search relevance.
+
+        Fields already cached for the product are served from the cache;
+        only the missing ones are generated and merged into the cached entry.
+        On a cache miss, a stored result is reused if the product's extracted
+        data, prompt and model are unchanged. Sets the `cache_status` context
+        variable to HIT, UNCHANGED, PARTIAL, MISS or BYPASS (or SIMILAR when a
+        near-duplicate's result is reused).
+
+        Args:
+            product_id: The Woolworths product ID
+            cache_mode: How this request interacts with the result cache
+            fields: Enhanced fields to return besides type and variety
+                (defaults to all of them)
+
+        Returns:
+            EnhancedProductResponse with type, variety and the requested fields
+
+        Raises:
+            ValueError: If product data cannot be extracted, a field is
+                unknown or the model response is invalid
+        """
+        variant = enhanced_variant(frozenset(ENHANCED_FIELDS if fields is None else fields))
+        if self.result_cache is None or cache_mode == CacheMode.BYPASS:
+            cache_status.set("BYPASS")
+            return await self._categorize_enhanced(await self._enhanced_variables(product_id), cache_mode, variant)
+
+        key = self._cache_key("categorize_enhanced", "enhanced_category_prompt", product_id)
+        if cache_mode == CacheMode.USE:
+            with timed_stage("cache_lookup"):
+                cached = await self.result_cache.get(key)
+            if cached is not None and variant.covers(cached):
+                logger.info(f"Cache hit for categorize_enhanced product ID: {product_id}")
+                cache_status.set("HIT")
+                return variant.select(cached)
+
+        extracted_data = await self._enhanced_variables(product_id)
+        fingerprint, unchanged = await self._revalidate(key, "enhanced_category_prompt", extracted_data, cache_mode)
+        if unchanged is None:
+            cache_status.set("MISS")
+            values = (await self._categorize_enhanced(extracted_data, cache_mode, variant)).model_dump()
+        elif variant.covers(unchanged):
+            logger.info(f"Unchanged categorize_enhanced inputs for product ID: {product_id}")
+            cache_status.set("UNCHANGED")
+            values = unchanged
+        else:
+            missing = frozenset(variant.fields).difference(unchanged)
+            logger.info(f"Partial cache hit for categorize_enhanced product ID: {product_id}, "
+                        f"generating {sorted(missing)}")
+            cache_status.set("PARTIAL")
+            generated = await self._categorize_enhanced(extracted_data, cache_mode, enhanced_variant(missing))
+            # Cached type and variety win so the merged entry stays consistent
+            values = {**generated.model_dump(), **unchanged}
+
+        await self.result_cache.set(key, values, fingerprint)
+        return variant.select(values)
+
+    async def _enhanced_variables(self, product_id: str) -> Dict[str, Any]:
+        # Fetch product details from Woolworths
+        product_details = await self.woolworths_client.get_product_details(product_id)
+
+        # Extract product data for enhanced prompt
+        with timed_stage("extraction"):
+            extracted_data = self.product_extractor.extract_product_data(product_details)
+
+        if not extracted_data:
+            raise ValueError(f"Could not extract data for product ID: {product_id}")
+
+        logger.debug(f"Extracted product data: {extracted_data}")
+        return extracted_data
+
+    async def _categorize_enhanced(self,
+                                   extracted_data: Dict[str, Any],
+                                   cache_mode: CacheMode,
+                                   variant: EnhancedVariant) -> EnhancedProductResponse:
+        product_name = extracted_data["product_name"]
+        similar = self.match_similar("categorize_enhanced", "enhanced_category_prompt", product_name, cache_mode,
+                                     EnhancedProductResponse, variant.fields)
+        if similar is not None:
+            return variant.select(similar.model_dump())
+
+        # Format prompt with the extracted data and examples, within the token budget
+        with timed_stage("prompt_format"):
+            prompt = self.prompt_builder.build(
+                "enhanced_category_prompt",
+                {**extracted_data, "field_instructions": variant.instructions},
+                variant.omitted
+            )
+
+        # Process with Gemini
+        model_response = await self.model_router.process_prompt(prompt, variant.json_structure, EnhancedProductResponse)
+
+        result = variant.select(model_response.response)
+        await self.remember_similar("categorize_enhanced", "enhanced_category_prompt", product_name, cache_mode, result)
+        return result
+
+    async def categorize_packed(self,
+                                product_ids: List[str],
+                                enhanced: bool = False,
+                                cache_mode: CacheMode = CacheMode.USE,
+                                fields: Optional[Iterable[str]] = None) -> Dict[str, Union[BaseModel, Exception]]:
+        """Categorize many products using packed multi-product prompts.
+
+        Cached results are served directly; the remaining products are
+        fetched concurrently and sent to Gemini several per prompt, so the
+        fixed instruction tokens are paid once per pack instead of per product.
+        Basic categorizations that confidently match the facet vocabulary,
+        and near duplicates of products categorized before, skip Gemini
+        altogether, as do products whose prompt inputs are unchanged since
+        their stored result was computed. Enhanced results missing some
+        requested fields are regenerated with the requested fields and merged
+        into the cache.
+
+        Args:
+            product_ids: The Woolworths product IDs
+            enhanced: Produce enhanced rather than basic categorizations
+            cache_mode: How this request interacts with the result cache
+            fields: Enhanced fields to return besides type and variety
+                (defaults to all of them)
+
+        Returns:
+            For every product ID, either its result or the exception
+            explaining why it could not be categorized
+
+        Raises:
+            ValueError: If an enhanced field is unknown
+        """
+        if enhanced:
+            variant = enhanced_variant(frozenset(ENHANCED_FIELDS if fields is None else fields))
+            endpoint, prompt_name = "categorize_enhanced", "enhanced_category_prompt"
+            pack_prompt_name, item_template = "enhanced_category_batch_prompt", ENHANCED_CATEGORY_PACK_ITEM_TEMPLATE
+            json_structure, response_model = variant.json_structure, EnhancedProductResponse
+            output_tokens = variant.output_tokens
+            pack_variables, omit_output_keys = {"field_instructions": variant.instructions}, variant.omitted
+            required_fields, covers, select = variant.fields, variant.covers, variant.select
+        else:
+            endpoint, prompt_name = "categorize", "category_prompt"
+            pack_prompt_name, item_template = "category_batch_prompt", CATEGORY_PACK_ITEM_TEMPLATE
+            json_structure, response_model = JSON_STRUCTURE, ProductResponse
+            output_tokens = CATEGORY_OUTPUT_TOKENS
+            pack_variables, omit_output_keys = {}, frozenset()
+            required_fields, covers, select = (), lambda values: True, lambda values: ProductResponse(**values)
+
+        use_cache = self.result_cache is not None and cache_mode != CacheMode.BYPASS
+        results: Dict[str, Union[BaseModel, Exception]] = {}
+        keys: Dict[str, str] = {}
+        fingerprints: Dict[str, str] = {}
+        partial: Dict[str, Dict[str, Any]] = {}
+
+        if use_cache:
+            for product_id in dict.fromkeys(product_ids):
+                keys[product_id] = self._cache_key(endpoint, prompt_name, product_id)
+                if cache_mode == CacheMode.USE:
+                    cached = await self.result_cache.get(keys[product_id])
+                    if cached is not None and covers(cached):
+                        results[product_id] = select(cached)
+
+        async def store(product_id: str, result: BaseModel) -> BaseModel:
+            """Merge a result into the product's cached fields, cache it and select the requested fields."""
+            values = {**result.model_dump(), **partial.get(product_id, {})}
+            if use_cache:
+                await self.result_cache.set(keys[product_id], values, fingerprints[product_id])
+            return select(values)
+
+        semaphore = asyncio.Semaphore(settings.batch_concurrency)
+
+        async def extract(product_id: str) -> Union[Dict[str, str], Exception]:
+            async with semaphore:
+                try:
+                    product_details = await self.woolworths_client.get_product_details(product_id)
+                    with timed_stage("extraction"):
+                        extracted_data = self.product_extractor.extract_product_data(product_details)
+                    if not extracted_data or not extracted_data.get("product_name"):
+                        raise ProductNotFoundError("Product not found or missing display name")
+                    return extracted_data
+                except Exception as e:
+                    return e
+
+        misses = [product_id for product_id in dict.fromkeys(product_ids) if product_id not in results]
+        items: Dict[str, str] = {}
+        names: Dict[str, str] = {}
+        for product_id, extracted_data in zip(misses, await asyncio.gather(*(extract(p) for p in misses))):
+            if isinstance(extracted_data, Exception):
+                results[product_id] = extracted_data
+                continue
+
+            product_name = extracted_data["product_name"]
+            if use_cache:
+                variables = extracted_data if enhanced else {"product_name": product_name}
+                fingerprints[product_id], unchanged = await self._revalidate(
+                    keys[product_id], prompt_name, variables, cache_mode
+                )
+                if unchanged is not None and covers(unchanged):
+                    await self.result_cache.set(keys[product_id], unchanged, fingerprints[product_id])
+                    results[product_id] = select(unchanged)
+                    continue
+                if unchanged is not None:
+                    partial[product_id] = unchanged
+
+            matched = None if enhanced else self.match_facets(product_name)
+            if matched is not None:
+                # Not cached, like facet answers to single products
+                results[product_id] = matched
+                continue
+            matched = self.match_similar(endpoint, prompt_name, product_name, cache_mode, response_model,
+                                         required_fields)
+            if matched is not None:
+                results[product_id] = await store(product_id, matched)
+            else:
+                items[product_id] = item_template.format(**self.prompt_builder.compact_fields(extracted_data))
+                names[product_id] = product_name
+
+        if items:
+            instructions = self.prompt_builder.build(pack_prompt_name, pack_variables, omit_output_keys)
+            generated = await self.model_router.process_packed_prompts(
+                instructions, items, json_structure, response_model, output_tokens
+            )
+            for product_id, result in generated.items():
+                if isinstance(result, Exception):
+                    results[product_id] = result
+                    continue
+                results[product_id] = await store(product_id, result)
+                await self.remember_similar(endpoint, prompt_name, names[product_id], cache_mode,
+                                            results[product_id])
+
+        return results
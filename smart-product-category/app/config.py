@@ -15,10 +15,92 @@ class Settings(BaseSettings):
     temperature: float = Field(0.7, env="MODEL_TEMPERATURE")
     max_output_tokens: int = Field(2048, env="MAX_OUTPUT_TOKENS")
     
+    # Model routing
+    model_routing_policy: str = Field("single", env="MODEL_ROUTING_POLICY")  # single or escalate
+    fast_model_name: str = Field("gemini-2.0-flash-lite", env="FAST_MODEL_NAME")
+    escalation_min_confidence: float = Field(0.7, env="ESCALATION_MIN_CONFIDENCE")
+    
+    # Serving
+    port: int = Field(8000, env="PORT")
+    web_concurrency: int = Field(1, env="WEB_CONCURRENCY")  # worker processes, 0 starts one per CPU
+    graceful_shutdown_timeout: int = Field(30, env="GRACEFUL_SHUTDOWN_TIMEOUT")  # in seconds
+    
     # API Rate limiting
-    rate_limit_enabled: bool = Field(True, env="RATE_LIMIT_ENABLED")
+    rate_limit_enabled: bool = Field(False, env="RATE_LIMIT_ENABLED")  # set the limits below to the real quota first
     rate_limit_requests: int = Field(10, env="RATE_LIMIT_REQUESTS")
     rate_limit_timeframe: int = Field(60, env="RATE_LIMIT_TIMEFRAME")  # in seconds
+    rate_limit_burst: int = Field(1, env="RATE_LIMIT_BURST")
+    woolworths_rate_limit_requests: int = Field(10, env="WOOLWORTHS_RATE_LIMIT_REQUESTS")
+    woolworths_rate_limit_timeframe: int = Field(1, env="WOOLWORTHS_RATE_LIMIT_TIMEFRAME")  # in seconds
+    woolworths_rate_limit_burst: int = Field(5, env="WOOLWORTHS_RATE_LIMIT_BURST")
+    rate_limit_db_path: str = Field("cache/rate_limits.db", env="RATE_LIMIT_DB_PATH")  # shared by worker processes
+    
+    # Facet fast path
+    facet_fast_path_enabled: bool = Field(False, env="FACET_FAST_PATH_ENABLED")  # opt-in until checked against LLM labels
+    facets_path: str = Field("../../facets_b2c.csv", env="FACETS_PATH")  # relative to app/
+    facet_min_confidence: float = Field(0.85, env="FACET_MIN_CONFIDENCE")
+    
+    # Prompts
+    prompt_reload_interval: float = Field(5.0, env="PROMPT_RELOAD_INTERVAL")  # in seconds, negative disables
+    prompt_token_budget: int = Field(1000, env="PROMPT_TOKEN_BUDGET")  # estimated tokens, including examples
+    
+    # Request deadlines and retries
+    request_deadline: float = Field(30.0, env="REQUEST_DEADLINE")  # in seconds, 0 disables
+    batch_request_deadline: float = Field(300.0, env="BATCH_REQUEST_DEADLINE")  # in seconds, 0 disables
+    request_deadline_max: float = Field(600.0, env="REQUEST_DEADLINE_MAX")  # cap on X-Request-Timeout, in seconds
+    retry_budget: int = Field(3, env="RETRY_BUDGET")  # retries per request, or per item of a batch
+    woolworths_hedge_after: float = Field(0.0, env="WOOLWORTHS_HEDGE_AFTER")  # in seconds, 0 disables hedging
+    
+    # LLM admission control
+    admission_control_enabled: bool = Field(True, env="ADMISSION_CONTROL_ENABLED")
+    llm_max_in_flight: int = Field(8, env="LLM_MAX_IN_FLIGHT")
+    llm_max_queue: int = Field(32, env="LLM_MAX_QUEUE")  # calls waiting for a slot, 0 rejects when all are busy
+    
+    # Woolworths HTTP client
+    woolworths_base_url: str = Field("https://www.woolworths.com.au", env="WOOLWORTHS_BASE_URL")
+    woolworths_pool_limit: int = Field(100, env="WOOLWORTHS_POOL_LIMIT")
+    woolworths_pool_limit_per_host: int = Field(20, env="WOOLWORTHS_POOL_LIMIT_PER_HOST")
+    woolworths_keepalive_timeout: float = Field(30.0, env="WOOLWORTHS_KEEPALIVE_TIMEOUT")  # in seconds
+    woolworths_dns_cache_ttl: int = Field(300, env="WOOLWORTHS_DNS_CACHE_TTL")  # in seconds
+    woolworths_cookie_ttl: int = Field(900, env="WOOLWORTHS_COOKIE_TTL")  # in seconds
+    
+    # Product snapshot store
+    product_store_enabled: bool = Field(True, env="PRODUCT_STORE_ENABLED")
+    product_store_db_path: str = Field("cache/products.db", env="PRODUCT_STORE_DB_PATH")
+    product_store_refresh_after: int = Field(24 * 3600, env="PRODUCT_STORE_REFRESH_AFTER")  # in seconds
+    product_store_max_age: int = Field(7 * 24 * 3600, env="PRODUCT_STORE_MAX_AGE")  # in seconds, 0 never expires
+    product_store_refresh_interval: float = Field(300.0, env="PRODUCT_STORE_REFRESH_INTERVAL")  # in seconds, 0 disables sweeps
+    product_store_refresh_batch: int = Field(100, env="PRODUCT_STORE_REFRESH_BATCH")
+    
+    # Result cache
+    cache_enabled: bool = Field(True, env="CACHE_ENABLED")
+    cache_memory_max_entries: int = Field(10000, env="CACHE_MEMORY_MAX_ENTRIES")
+    cache_memory_ttl: int = Field(3600, env="CACHE_MEMORY_TTL")  # in seconds
+    cache_db_path: str = Field("cache/results.db", env="CACHE_DB_PATH")
+    cache_disk_ttl: int = Field(7 * 24 * 3600, env="CACHE_DISK_TTL")  # in seconds
+    cache_fingerprint_ttl: int = Field(90 * 24 * 3600, env="CACHE_FINGERPRINT_TTL")  # in seconds, since last reuse
+    
+    # Near-duplicate similarity cache
+    similarity_cache_enabled: bool = Field(True, env="SIMILARITY_CACHE_ENABLED")
+    similarity_threshold: float = Field(0.9, env="SIMILARITY_THRESHOLD")
+    similarity_max_entries: int = Field(50000, env="SIMILARITY_MAX_ENTRIES")
+    similarity_db_path: str = Field("cache/similarity.db", env="SIMILARITY_DB_PATH")
+    similarity_sync_interval: float = Field(1.0, env="SIMILARITY_SYNC_INTERVAL")  # in seconds, with several workers
+    
+    # Batch categorization
+    batch_max_size: int = Field(500, env="BATCH_MAX_SIZE")
+    batch_concurrency: int = Field(10, env="BATCH_CONCURRENCY")
+    
+    # Asynchronous jobs
+    jobs_enabled: bool = Field(True, env="JOBS_ENABLED")
+    jobs_db_path: str = Field("cache/jobs.db", env="JOBS_DB_PATH")
+    job_workers: int = Field(4, env="JOB_WORKERS")
+    job_max_size: int = Field(100000, env="JOB_MAX_SIZE")
+    
+    # Packed (multi-product) prompts
+    pack_max_items: int = Field(20, env="PACK_MAX_ITEMS")
+    pack_max_attempts: int = Field(2, env="PACK_MAX_ATTEMPTS")
+    pack_concurrency: int = Field(4, env="PACK_CONCURRENCY")
     
     # Logging
     log_level: str = Field("INFO", env="LOG_LEVEL")
@@ -29,6 +111,46 @@ class Settings(BaseSettings):
             raise ValueError("GOOGLE_API_KEY is required")
         return v
 
+    @validator('rate_limit_requests', 'rate_limit_timeframe', 'woolworths_rate_limit_requests',
+               'woolworths_rate_limit_timeframe', 'similarity_max_entries', 'prompt_token_budget', 'batch_max_size', 'batch_concurrency', 'pack_max_items', 'pack_max_attempts', 'pack_concurrency',
+               'llm_max_in_flight', 'job_workers', 'job_max_size', 'product_store_refresh_batch', 'port', 'cache_fingerprint_ttl')
+    def validate_positive(cls, v):
+        if v < 1:
+            raise ValueError("must be at least 1")
+        return v
+
+    @validator('request_deadline', 'batch_request_deadline', 'request_deadline_max', 'retry_budget',
+               'woolworths_hedge_after', 'llm_max_queue', 'product_store_refresh_after', 'product_store_max_age',
+               'product_store_refresh_interval', 'graceful_shutdown_timeout', 'similarity_sync_interval')
+    def validate_non_negative(cls, v):
+        if v < 0:
+            raise ValueError("must not be negative")
+        return v
+
+    @validator('web_concurrency')
+    def validate_web_concurrency(cls, v):
+        if v < 0:
+            raise ValueError("must not be negative")
+        return v or os.cpu_count() or 1
+
+    @validator('model_routing_policy')
+    def validate_model_routing_policy(cls, v):
+        if v not in ("escalate", "single"):
+            raise ValueError("must be 'escalate' or 'single'")
+        return v
+
+    @validator('escalation_min_confidence')
+    def validate_escalation_min_confidence(cls, v):
+        if not 0 <= v <= 1:
+            raise ValueError("must be between 0 and 1")
+        return v
+
+    @validator('similarity_threshold')
+    def validate_similarity_threshold(cls, v):
+        if not 0 < v <= 1:
+            raise ValueError("must be greater than 0 and at most 1")
+        return v
+
     @validator('log_level')
     def validate_log_level(cls, v):
         allowed_levels = ['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL']
@@ -37,6 +159,11 @@ class Settings(BaseSettings):
             return "INFO"
         return v
         
+    @property
+    def multi_worker(self) -> bool:
+        """Whether the API runs in several worker processes that must share state."""
+        return self.web_concurrency > 1
+        
     class Config:
         env_file = ".env"
         env_file_encoding = "utf-8"
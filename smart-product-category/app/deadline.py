@@ -0,0 +1,185 @@
+import asyncio
+import functools
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Iterator, Optional, Tuple, Type, TypeVar
+
+import backoff
+
+from metrics import UPSTREAM_RETRY_GIVEUPS, record_retry
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a request's deadline passes before its work is done."""
+
+
+class Deadline:
+    """Point in time by which a request must be answered, plus its retry budget.
+
+    Every upstream call made on behalf of the request is bounded by the time
+    remaining, and retries of any upstream draw from the same budget.
+    """
+
+    def __init__(self, timeout: float, retry_budget: int, expires_at: Optional[float] = None):
+        """Initialize the deadline.
+
+        Args:
+            timeout: Seconds from now until the deadline
+            retry_budget: Retries the request may make across all upstreams
+            expires_at: Monotonic time of the deadline, when it started
+                earlier (defaults to `timeout` from now)
+        """
+        self.timeout = timeout
+        self.expires_at = time.monotonic() + timeout if expires_at is None else expires_at
+        self.retry_budget = retry_budget
+        self.retries_left = retry_budget
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires_at
+
+    def check(self, stage: str) -> None:
+        """Raise DeadlineExceeded if the deadline has passed.
+
+        Args:
+            stage: What was about to run, for the error message
+        """
+        if self.expired():
+            raise DeadlineExceeded(f"Request deadline of {self.timeout:g}s exceeded before {stage}")
+
+    def for_item(self) -> "Deadline":
+        """Return a deadline with the same expiry and a fresh retry budget."""
+        return Deadline(self.timeout, self.retry_budget, self.expires_at)
+
+
+_current_deadline: ContextVar[Optional[Deadline]] = ContextVar("current_deadline", default=None)
+
+
+def current_deadline() -> Optional[Deadline]:
+    """Return the deadline of the request being served, if any."""
+    return _current_deadline.get()
+
+
+def start_deadline(deadline: Optional[Deadline]) -> None:
+    """Make `deadline` apply to the current task and the tasks it starts."""
+    _current_deadline.set(deadline)
+
+
+@contextmanager
+def item_deadline() -> Iterator[Optional[Deadline]]:
+    """Give one item of a batch its own retry budget under the request's deadline."""
+    deadline = current_deadline()
+    if deadline is None:
+        yield None
+        return
+    token = _current_deadline.set(deadline.for_item())
+    try:
+        yield _current_deadline.get()
+    finally:
+        _current_deadline.reset(token)
+
+
+class _AttemptTimer:
+    """Exponentially weighted average duration of an upstream's attempts."""
+
+    def __init__(self, alpha: float = 0.2):
+        self.alpha = alpha
+        self.average: Optional[float] = None
+
+    def observe(self, duration: float) -> None:
+        if self.average is None:
+            self.average = duration
+        else:
+            self.average += self.alpha * (duration - self.average)
+
+
+_attempt_timers: Dict[str, _AttemptTimer] = {}
+
+
+def _remaining_time() -> Optional[float]:
+    deadline = current_deadline()
+    return None if deadline is None else deadline.remaining()
+
+
+def deadline_retry(upstream: str,
+                   exceptions: Tuple[Type[BaseException], ...],
+                   giveup: Callable[[Exception], bool] = lambda e: False,
+                   max_tries: int = 3) -> Callable[[Callable[..., Awaitable[T]]], Callable[..., Awaitable[T]]]:
+    """Retry an upstream call with backoff, within the request's deadline.
+
+    Without a deadline in context this is a plain exponential backoff of up
+    to `max_tries` attempts. With one, each attempt is cut off when the
+    deadline passes, backoff waits never run past it, and a retry is only
+    made if the request's retry budget has a retry left and the remaining
+    time covers a typical attempt of this upstream.
+
+    Args:
+        upstream: Name of the upstream, used in metrics and logs
+        exceptions: Exceptions that may be retried
+        giveup: Returns True for retryable exceptions that should not be retried
+        max_tries: Maximum attempts per call
+
+    Raises:
+        DeadlineExceeded: From the decorated call, once the deadline has passed
+    """
+    timer = _attempt_timers.setdefault(upstream, _AttemptTimer())
+
+    def should_give_up(e: Exception) -> bool:
+        if isinstance(e, DeadlineExceeded) or giveup(e):
+            return True
+        deadline = current_deadline()
+        if deadline is None:
+            return False
+        if deadline.retries_left <= 0:
+            UPSTREAM_RETRY_GIVEUPS.labels(upstream, "budget").inc()
+            logger.warning(f"Not retrying {upstream} call: request retry budget exhausted")
+            return True
+        if deadline.remaining() < (timer.average or 0.0):
+            UPSTREAM_RETRY_GIVEUPS.labels(upstream, "deadline").inc()
+            logger.warning(f"Not retrying {upstream} call: {deadline.remaining():.2f}s left of the request deadline")
+            return True
+        deadline.retries_left -= 1
+        return False
+
+    def decorate(target: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[T]]:
+        @functools.wraps(target)
+        async def attempt(*args: Any, **kwargs: Any) -> T:
+            deadline = current_deadline()
+            if deadline is None:
+                return await target(*args, **kwargs)
+
+            deadline.check(f"{upstream} call")
+            start = time.monotonic()
+            try:
+                result = await asyncio.wait_for(target(*args, **kwargs), deadline.remaining())
+            except asyncio.TimeoutError:
+                if deadline.expired():
+                    raise DeadlineExceeded(
+                        f"Request deadline of {deadline.timeout:g}s exceeded during {upstream} call"
+                    )
+                timer.observe(time.monotonic() - start)
+                raise
+            except Exception:
+                timer.observe(time.monotonic() - start)
+                raise
+            timer.observe(time.monotonic() - start)
+            return result
+
+        return backoff.on_exception(
+            backoff.expo,
+            exceptions,
+            max_tries=max_tries,
+            max_time=_remaining_time,
+            giveup=should_give_up,
+            on_backoff=record_retry(upstream)
+        )(attempt)
+
+    return decorate
@@ -0,0 +1,319 @@
+import csv
+import logging
+import re
+from collections import deque
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from product_utils import ProductDataExtractor
+
+logger = logging.getLogger(__name__)
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+# Words after which the rest of a name describes the head rather than being
+# it ("Tuna in Olive Oil", "Pasta with Basil"); "&" is normalized to "and"
+_CONNECTIVES = frozenset({"in", "with", "and"})
+
+# Product type answered for each search phrase, in the vocabulary the model
+# uses. Phrases naming a department, brand or occasion rather than a product
+# type ("cat", "drinks", "mco beauty", "christmas") are left out, and names
+# that only match those are left to the model.
+PRODUCT_TYPES: Dict[str, str] = {
+    "baby food": "baby food",
+    "baby formula": "baby formula",
+    "bacon": "bacon",
+    "beans": "beans",
+    "beef": "beef",
+    "biscuits": "biscuits",
+    "bread": "bread",
+    "butter": "butter",
+    "cake": "cake",
+    "cake mix": "cake mix",
+    "cakes": "cake",
+    "cat food": "cat food",
+    "cereal": "cereal",
+    "cheese": "cheese",
+    "chicken": "chicken",
+    "chips": "chips",
+    "chocolate": "chocolate",
+    "coffee": "coffee",
+    "condoms": "condoms",
+    "cookies": "cookies",
+    "cream": "cream",
+    "dog food": "dog food",
+    "eggs": "eggs",
+    "fish": "fish",
+    "flour": "flour",
+    "frozen meals": "frozen meals",
+    "ham": "ham",
+    "ice cream": "ice cream",
+    "icecream": "ice cream",
+    "juice": "juice",
+    "lamb": "lamb",
+    "lollies": "lollies",
+    "mayonaise": "mayonnaise",
+    "milk": "milk",
+    "mince": "mince",
+    "nappies": "nappies",
+    "noodles": "noodles",
+    "oats": "oats",
+    "oil": "oil",
+    "olive oil": "olive oil",
+    "pads": "pads",
+    "pasta": "pasta",
+    "pizza": "pizza",
+    "pork": "pork",
+    "prawns": "prawns",
+    "protein bar": "protein bar",
+    "protein powder": "protein powder",
+    "ready meals": "ready meals",
+    "ready to eat meals": "ready meals",
+    "rice": "rice",
+    "salmon": "salmon",
+    "sauce": "sauce",
+    "sausages": "sausages",
+    "shampoo": "shampoo",
+    "soap": "soap",
+    "soft drink": "soft drink",
+    "soup": "soup",
+    "sugar": "sugar",
+    "sunscreen": "sunscreen",
+    "tea": "tea",
+    "toilet paper": "toilet paper",
+    "toothbrush": "toothbrush",
+    "toothpaste": "toothpaste",
+    "water": "water",
+    "wipes": "wipes",
+    "yoghurt": "yoghurt",
+}
+
+
+def normalize_tokens(text: str) -> Tuple[str, ...]:
+    """Lower-case, split on non-alphanumerics and singularize simple plurals."""
+    tokens = []
+    for token in _TOKEN.findall(text.lower().replace("&", " and ")):
+        if len(token) > 4 and token.endswith("ies"):
+            token = token[:-3] + "y"
+        elif len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        tokens.append(token)
+    return tuple(tokens)
+
+
+class FacetMatch(NamedTuple):
+    """An answer from the facet matcher."""
+    type: str
+    variety: List[str]
+    confidence: float
+
+
+class _Automaton:
+    """Aho-Corasick automaton over token sequences.
+
+    Finds every occurrence of every pattern in one pass over the tokens of a
+    name, however many patterns there are.
+    """
+
+    def __init__(self, patterns: List[Tuple[str, ...]]):
+        self.patterns = patterns
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[int]] = [[]]
+
+        for index, pattern in enumerate(patterns):
+            node = 0
+            for token in pattern:
+                if token not in self._goto[node]:
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                    self._goto[node][token] = len(self._goto) - 1
+                node = self._goto[node][token]
+            self._out[node].append(index)
+
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for token, child in self._goto[node].items():
+                queue.append(child)
+                fallback = self._fail[node]
+                while fallback and token not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(token, 0)
+                self._out[child] = self._out[child] + self._out[self._fail[child]]
+
+    def find(self, tokens: Tuple[str, ...]) -> List[Tuple[int, int]]:
+        """Return (start, pattern index) for every pattern occurrence."""
+        matches = []
+        node = 0
+        for position, token in enumerate(tokens):
+            while node and token not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(token, 0)
+            for index in self._out[node]:
+                matches.append((position - len(self.patterns[index]) + 1, index))
+        return matches
+
+
+class FacetMatcher:
+    """Maps product names onto the SearchPhrase -> FacetDisplayName vocabulary.
+
+    Facets found in a name (ignoring those inside a longer matched facet,
+    e.g. "Milk" inside "Oat Milk") are answered with the product type of
+    their search phrase and the facets as the varieties. Matches resolving to
+    a search phrase without a product type are left to the model. The
+    confidence reflects how unambiguous the match is:
+
+    - 0.95: one facet, under one search phrase that also appears in the name
+    - 0.9: several facets, all under the one search phrase in the name
+    - 0.85: one facet under several search phrases, one of them in the name
+    - 0.8: the one search phrase in the name covers only some of the facets
+    - 0.7: one facet, under one search phrase that is not in the name
+
+    A facet only names the product when it, or its search phrase, is the
+    head of the name, i.e. the last words before the package size ("Oat
+    Milk", "Sourdough Bread"), and the words after "in", "with" or "&" are
+    never the head. When the name goes on past both ("Coconut Milk Shampoo",
+    "Oat Milk Porridge"), or they only follow such a word ("Tuna in Olive
+    Oil"), the facet is probably a modifier, and the confidence is capped at
+    `MODIFIER_CONFIDENCE`.
+
+    Anything else is left to the model.
+    """
+
+    LOG_INTERVAL = 1000
+    MODIFIER_CONFIDENCE = 0.6
+
+    def __init__(self, facets: List[Tuple[str, str]], product_types: Optional[Dict[str, str]] = None):
+        """Build the matcher.
+
+        Args:
+            facets: (search phrase, facet display name) pairs
+            product_types: Product type answered for each lower-cased search
+                phrase (defaults to `PRODUCT_TYPES`)
+        """
+        self.product_types = PRODUCT_TYPES if product_types is None else product_types
+        by_pattern: Dict[Tuple[str, ...], Dict[str, str]] = {}
+        self._phrases: Dict[str, Tuple[str, ...]] = {}
+        for phrase, facet in facets:
+            phrase, facet = phrase.strip(), facet.strip()
+            pattern = normalize_tokens(facet)
+            if not pattern or not phrase:
+                continue
+            phrase_key = phrase.lower()
+            self._phrases.setdefault(phrase_key, normalize_tokens(phrase))
+            # First display name seen for a facet under a phrase wins
+            by_pattern.setdefault(pattern, {}).setdefault(phrase_key, facet)
+
+        self._patterns = list(by_pattern)
+        self._candidates = [by_pattern[pattern] for pattern in self._patterns]
+        self._automaton = _Automaton(self._patterns)
+
+        self.lookups = 0
+        self.hits = 0
+
+    @classmethod
+    def from_csv(cls, path: Path) -> "FacetMatcher":
+        """Build the matcher from a SearchPhrase,FacetDisplayName CSV file."""
+        with open(path, "r", encoding="utf-8-sig", newline="") as f:
+            facets = [(row.get("SearchPhrase") or "", row.get("FacetDisplayName") or "") for row in csv.DictReader(f)]
+        matcher = cls(facets)
+        logger.info(f"Built facet matcher with {len(matcher._patterns)} facet patterns from {path}")
+        return matcher
+
+    @staticmethod
+    def _contains(tokens: Tuple[str, ...], phrase: Tuple[str, ...]) -> bool:
+        return any(tokens[i:i + len(phrase)] == phrase for i in range(len(tokens) - len(phrase) + 1))
+
+    @staticmethod
+    def _end(tokens: Tuple[str, ...], phrase: Tuple[str, ...]) -> int:
+        """Position after the last occurrence of a phrase, or 0."""
+        for i in range(len(tokens) - len(phrase), -1, -1):
+            if tokens[i:i + len(phrase)] == phrase:
+                return i + len(phrase)
+        return 0
+
+    def _match(self, name: str) -> Optional[FacetMatch]:
+        tokens = normalize_tokens(ProductDataExtractor.strip_package_size(name))
+        found = self._automaton.find(tokens)
+        if not found:
+            return None
+
+        # Keep only facets that are not part of a longer facet match, in name order
+        spans = sorted((start, start + len(self._patterns[index]), index) for start, index in found)
+        maximal: List[int] = []
+        for start, end, index in spans:
+            contained = any(s <= start and end <= e and (e - s) > (end - start) for s, e, _ in spans)
+            if not contained and index not in maximal:
+                maximal.append(index)
+
+        facets = [self._candidates[index] for index in maximal]
+        phrases = {phrase for candidates in facets for phrase in candidates}
+        in_name = [phrase for phrase in phrases if self._contains(tokens, self._phrases[phrase])]
+        # The head of the name ends at the first connective outside a facet.
+        # Words after the last facet or search phrase up to there, other than
+        # stray numbers, are the head; a facet or phrase past it is not.
+        head_end = next((i for i, token in enumerate(tokens)
+                         if token in _CONNECTIVES and not any(s < i < e for s, e, _ in spans)), len(tokens))
+        last_end = max([end for _, end, _ in spans] + [self._end(tokens, self._phrases[phrase]) for phrase in in_name])
+        modifier = last_end > head_end or any(not token.isdigit() for token in tokens[last_end:head_end])
+
+        if len(facets) == 1 and len(phrases) == 1:
+            phrase = next(iter(phrases))
+            product_type = self.product_types.get(phrase)
+            if product_type is None:
+                return None
+            confidence = 0.95 if in_name else 0.7
+            return FacetMatch(product_type, [facets[0][phrase]],
+                              min(confidence, self.MODIFIER_CONFIDENCE) if modifier else confidence)
+        if len(in_name) != 1:
+            return None
+
+        phrase = in_name[0]
+        product_type = self.product_types.get(phrase)
+        if product_type is None:
+            return None
+        varieties = [candidates[phrase] for candidates in facets if phrase in candidates]
+        if len(varieties) < len(facets):
+            confidence = 0.8
+        elif len(facets) > 1:
+            confidence = 0.9
+        else:
+            confidence = 0.85
+        if modifier:
+            confidence = min(confidence, self.MODIFIER_CONFIDENCE)
+        return FacetMatch(product_type, varieties, confidence)
+
+    def match(self, name: str, min_confidence: float = 0.0) -> Optional[FacetMatch]:
+        """Match a product name against the facet vocabulary.
+
+        Every `LOG_INTERVAL` lookups the hit rate so far is logged.
+
+        Args:
+            name: Product display name
+            min_confidence: Matches below this confidence are not returned
+
+        Returns:
+            The matched type, variety and confidence, or None when the name
+            contains no facet, more than one, or the match is not confident
+        """
+        result = self._match(name)
+        if result is not None and result.confidence < min_confidence:
+            result = None
+
+        self.lookups += 1
+        if result is not None:
+            self.hits += 1
+        if self.lookups % self.LOG_INTERVAL == 0:
+            logger.info(f"Facet fast path hit rate: {self.hits / self.lookups:.1%} ({self.hits}/{self.lookups})")
+        return result
+
+    def stats(self) -> Dict[str, float]:
+        """Return lookup counters and the match rate."""
+        return {
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_ratio": self.hits / self.lookups if self.lookups else 0.0,
+            "patterns": len(self._patterns),
+        }
@@ -0,0 +1,381 @@
+"""Facet to product retrieval.
+
+Looks up the products matching each FacetDisplayName of a facets file (such
+as facets_b2c.csv) with the product retrieval model endpoint, keeps those
+scoring at least the threshold and writes the (facet, product, search
+phrase) rows in one go. This replaces the per-SearchPhrase loop of the
+prototype notebook.
+
+Facet names are deduplicated and packed many per request `instances`
+payload, requests are sent concurrently over one pooled HTTP session, and
+the access token is cached until shortly before it expires.
+
+Usage:
+    python facet_retrieval.py --input ../../facets_b2c.csv --output facet_products.parquet
+    python facet_retrieval.py --input ../../facets_b2c.csv --output facet_products.csv --threshold 0.7
+    python facet_retrieval.py --input ../../facets_b2c.csv --output facet_products.parquet \\
+        --bigquery-table 99_temp.facets_products_hackathon --project gcp-wow-rwds-ai-search-dev
+    python facet_retrieval.py --input ../../facets_b2c.csv --output out.csv --endpoint http://127.0.0.1:8080/predict --no-auth
+"""
+import argparse
+import asyncio
+import csv
+import logging
+import os
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import aiohttp
+from aiohttp import ClientError, ClientSession, ClientTimeout, TCPConnector
+
+from deadline import deadline_retry
+
+try:
+    import numpy as np
+    import pandas as pd
+except ImportError:  # Only this offline tool needs them, not the API
+    np = pd = None
+
+logger = logging.getLogger("facet_retrieval")
+
+DEFAULT_ENDPOINT = (
+    "https://australia-southeast1-aiplatform.googleapis.com/v1/projects/639471061669"
+    "/locations/us-central1/endpoints/8303344687196930048:predict"
+)
+CLOUD_PLATFORM_SCOPE = "https://www.googleapis.com/auth/cloud-platform"
+
+
+class AccessTokenProvider:
+    """Google Cloud access token, cached until shortly before it expires.
+
+    Tokens come from application default credentials when google-auth is
+    installed and configured, and from `gcloud auth print-access-token`
+    otherwise. Concurrent callers share a single refresh.
+    """
+
+    def __init__(self, refresh_margin: float = 300.0, gcloud_token_ttl: float = 1800.0):
+        """Initialize the token provider.
+
+        Args:
+            refresh_margin: Seconds before expiry at which a token is refreshed
+            gcloud_token_ttl: Seconds a token printed by gcloud is assumed to
+                stay valid, since gcloud doesn't report its expiry
+        """
+        self.refresh_margin = refresh_margin
+        self.gcloud_token_ttl = gcloud_token_ttl
+        self._token: Optional[str] = None
+        self._expires_at = 0.0
+        self._lock = asyncio.Lock()
+        self.refreshes = 0
+
+    def _valid(self) -> bool:
+        return self._token is not None and time.monotonic() < self._expires_at - self.refresh_margin
+
+    async def get(self) -> str:
+        """Return a valid access token, refreshing it if needed."""
+        if self._valid():
+            return self._token
+        async with self._lock:
+            if not self._valid():
+                token, lifetime = await self._fetch()
+                self._token = token
+                self._expires_at = time.monotonic() + lifetime
+                self.refreshes += 1
+            return self._token
+
+    def invalidate(self, stale_token: str) -> None:
+        """Drop the cached token unless another caller already refreshed it."""
+        if self._token == stale_token:
+            self._token = None
+
+    async def _fetch(self) -> Tuple[str, float]:
+        """Fetch a new token and return it with its lifetime in seconds."""
+        try:
+            import google.auth
+            import google.auth.transport.requests
+            from google.auth.exceptions import GoogleAuthError
+        except ImportError:
+            return await self._fetch_gcloud()
+
+        try:
+            credentials, _ = google.auth.default(scopes=[CLOUD_PLATFORM_SCOPE])
+            await asyncio.to_thread(credentials.refresh, google.auth.transport.requests.Request())
+        except GoogleAuthError as e:
+            logger.info(f"Application default credentials unavailable ({str(e)}); falling back to gcloud")
+            return await self._fetch_gcloud()
+
+        lifetime = self.gcloud_token_ttl
+        if credentials.expiry is not None:
+            # google-auth reports expiry as a naive UTC datetime
+            now = datetime.now(timezone.utc).replace(tzinfo=None)
+            lifetime = (credentials.expiry - now).total_seconds()
+        return credentials.token, lifetime
+
+    async def _fetch_gcloud(self) -> Tuple[str, float]:
+        process = await asyncio.create_subprocess_exec(
+            "gcloud", "auth", "print-access-token",
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        stdout, stderr = await process.communicate()
+        if process.returncode != 0:
+            raise RuntimeError(f"gcloud auth print-access-token failed: {stderr.decode('utf-8').strip()}")
+        return stdout.decode("utf-8").strip(), self.gcloud_token_ttl
+
+
+def _is_permanent_error(e: Exception) -> bool:
+    """Client errors other than expired auth, timeouts and throttling aren't retried."""
+    return (isinstance(e, aiohttp.ClientResponseError)
+            and 400 <= e.status < 500 and e.status not in (401, 408, 429))
+
+
+def filter_prediction(prediction: Dict[str, Any], threshold: float) -> Tuple["np.ndarray", "np.ndarray"]:
+    """Return the articles of a prediction scoring at least `threshold`, and their scores.
+
+    Filtering is a single vectorized comparison over the prediction's score
+    array, before anything is exploded into rows.
+    """
+    scores = np.asarray(prediction.get("scores") or [], dtype=float)
+    articles = np.asarray(prediction.get("articles") or [], dtype=str)
+    size = min(len(scores), len(articles))
+    keep = scores[:size] >= threshold
+    return articles[:size][keep], scores[:size][keep]
+
+
+class FacetRetrievalClient:
+    """Client for the product retrieval model endpoint."""
+
+    DEFAULT_TIMEOUT = ClientTimeout(total=120, connect=10)
+
+    def __init__(self,
+                 endpoint: str = DEFAULT_ENDPOINT,
+                 token_provider: Optional[AccessTokenProvider] = None,
+                 max_results: int = 1000,
+                 batch_size: int = 50,
+                 concurrency: int = 4,
+                 timeout: Optional[ClientTimeout] = None):
+        """Initialize the retrieval client.
+
+        The underlying HTTP session is created lazily (or by `start`) and is
+        shared by all requests made through this client.
+
+        Args:
+            endpoint: URL of the model's predict endpoint, e.g. a local
+                stand-in for tests
+            token_provider: Source of bearer tokens (no Authorization header
+                if omitted)
+            max_results: Products the model returns per term
+            batch_size: Terms packed into one request
+            concurrency: Requests in flight at once
+            timeout: Optional custom timeout for requests
+        """
+        self.endpoint = endpoint
+        self.token_provider = token_provider
+        self.max_results = max_results
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.timeout = timeout or self.DEFAULT_TIMEOUT
+        self._session: Optional[ClientSession] = None
+        self.requests = 0
+
+    async def start(self) -> None:
+        """Create the shared HTTP session if it is not already open."""
+        await self._get_session()
+
+    async def close(self) -> None:
+        """Close the shared HTTP session."""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def _get_session(self) -> ClientSession:
+        if self._session is None or self._session.closed:
+            connector = TCPConnector(limit=self.concurrency, keepalive_timeout=30)
+            self._session = ClientSession(connector=connector, timeout=self.timeout)
+        return self._session
+
+    @deadline_retry("facet_retrieval", (ClientError, TimeoutError), giveup=_is_permanent_error)
+    async def predict(self, terms: List[str]) -> List[Dict[str, Any]]:
+        """Retrieve products for a batch of terms in one request.
+
+        Args:
+            terms: Terms to send as the request's instances
+
+        Returns:
+            One prediction per term, in order, each with `articles` and `scores`
+
+        Raises:
+            ClientError: If the request fails after retries
+            ValueError: If the response doesn't hold one prediction per term
+        """
+        session = await self._get_session()
+        headers = {"Content-Type": "application/json"}
+        token = None
+        if self.token_provider is not None:
+            token = await self.token_provider.get()
+            headers["Authorization"] = f"Bearer {token}"
+
+        payload = {
+            "instances": [{"term": term} for term in terms],
+            "parameters": {"max_results": self.max_results}
+        }
+        self.requests += 1
+        async with session.post(self.endpoint, json=payload, headers=headers) as response:
+            if response.status == 401 and token is not None:
+                # Expired or revoked; the retry fetches a new token
+                self.token_provider.invalidate(token)
+            response.raise_for_status()
+            data = await response.json(content_type=None)
+
+        predictions = data.get("predictions") if isinstance(data, dict) else None
+        if not isinstance(predictions, list) or len(predictions) != len(terms):
+            raise ValueError(f"Expected {len(terms)} predictions, got {len(predictions or [])}")
+        return predictions
+
+    async def retrieve(self,
+                       terms: Iterable[str],
+                       threshold: float) -> Dict[str, Tuple["np.ndarray", "np.ndarray"]]:
+        """Retrieve the products scoring at least `threshold` for each distinct term.
+
+        Terms are deduplicated, packed `batch_size` per request and sent
+        with at most `concurrency` requests in flight. A batch that fails
+        after retries is logged and its terms are left out.
+
+        Returns:
+            Product numbers and scores keyed by term
+        """
+        unique = list(dict.fromkeys(terms))
+        batches = [unique[i:i + self.batch_size] for i in range(0, len(unique), self.batch_size)]
+        semaphore = asyncio.Semaphore(self.concurrency)
+        results: Dict[str, Tuple["np.ndarray", "np.ndarray"]] = {}
+
+        async def run_batch(batch: List[str]) -> None:
+            async with semaphore:
+                try:
+                    predictions = await self.predict(batch)
+                except (ClientError, TimeoutError, ValueError) as e:
+                    logger.error(f"Failed to retrieve products for {len(batch)} terms: {str(e)}")
+                    return
+            for term, prediction in zip(batch, predictions):
+                results[term] = filter_prediction(prediction, threshold)
+
+        logger.info(f"Retrieving products for {len(unique)} terms in {len(batches)} requests")
+        await asyncio.gather(*(run_batch(batch) for batch in batches))
+        return results
+
+
+def read_facets(path: Path) -> List[Tuple[str, str]]:
+    """Read distinct (SearchPhrase, FacetDisplayName) pairs from a facets CSV, in file order."""
+    pairs: Dict[Tuple[str, str], None] = {}
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        for row in csv.DictReader(f):
+            phrase = str(row.get("SearchPhrase") or "").strip()
+            facet = str(row.get("FacetDisplayName") or "").strip()
+            if phrase and facet:
+                pairs[(phrase, facet)] = None
+    return list(pairs)
+
+
+def build_frame(pairs: List[Tuple[str, str]],
+                retrieved: Dict[str, Tuple["np.ndarray", "np.ndarray"]]) -> "pd.DataFrame":
+    """Build the result rows of every facet pair in one allocation.
+
+    Returns:
+        DataFrame with `kw` (facet name), `product_nbr`, `score` and
+        `original_term` (search phrase) columns
+    """
+    matched = [(phrase, facet) for phrase, facet in pairs if facet in retrieved]
+    articles = [retrieved[facet][0] for _, facet in matched]
+    scores = [retrieved[facet][1] for _, facet in matched]
+    counts = np.fromiter((len(a) for a in articles), dtype=np.int64, count=len(articles))
+    return pd.DataFrame({
+        "kw": np.repeat(np.array([facet for _, facet in matched], dtype=object), counts),
+        "product_nbr": np.concatenate(articles).astype(object) if articles else np.array([], dtype=object),
+        "score": np.concatenate(scores) if scores else np.array([], dtype=float),
+        "original_term": np.repeat(np.array([phrase for phrase, _ in matched], dtype=object), counts),
+    })
+
+
+def write_results(frame: "pd.DataFrame", path: Path) -> None:
+    """Write all result rows to a CSV, JSONL or Parquet file at once."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    suffix = path.suffix.lower()
+    if suffix == ".csv":
+        frame.to_csv(path, index=False)
+    elif suffix in (".jsonl", ".ndjson"):
+        frame.to_json(path, orient="records", lines=True)
+    elif suffix == ".parquet":
+        try:
+            frame.to_parquet(path, index=False)
+        except ImportError:
+            raise SystemExit("Writing Parquet requires pyarrow: poetry install --extras offline")
+    else:
+        raise SystemExit(f"Unsupported output format: {path.suffix} (expected .csv, .jsonl or .parquet)")
+
+
+def upload_to_bigquery(frame: "pd.DataFrame", table: str, project: Optional[str]) -> None:
+    """Replace a BigQuery table with the result rows in one load job."""
+    try:
+        from pandas_gbq import to_gbq
+    except ImportError:
+        raise SystemExit("Uploading to BigQuery requires pandas-gbq: poetry install --extras bigquery")
+    to_gbq(frame, table, project_id=project, if_exists="replace")
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Retrieve the products matching each facet of a facets file.")
+    parser.add_argument("--input", required=True, type=Path, help="Facets CSV with SearchPhrase,FacetDisplayName columns")
+    parser.add_argument("--output", required=True, type=Path, help="Output file (.csv, .jsonl or .parquet)")
+    parser.add_argument("--endpoint", default=os.environ.get("FACET_RETRIEVAL_ENDPOINT", DEFAULT_ENDPOINT),
+                        help="Retrieval model predict URL (default: FACET_RETRIEVAL_ENDPOINT or the production endpoint)")
+    parser.add_argument("--no-auth", action="store_true", help="Send no access token, e.g. to a local stand-in")
+    parser.add_argument("--threshold", type=float, default=0.65, help="Minimum score of a kept product (default: 0.65)")
+    parser.add_argument("--max-results", type=int, default=1000, help="Products retrieved per facet (default: 1000)")
+    parser.add_argument("--batch-size", type=int, default=50, help="Facets per request (default: 50)")
+    parser.add_argument("--concurrency", type=int, default=4, help="Requests in flight (default: 4)")
+    parser.add_argument("--bigquery-table", default=None, help="Also replace this dataset.table in BigQuery")
+    parser.add_argument("--project", default=None, help="BigQuery project ID (default: from the environment)")
+    return parser.parse_args(argv)
+
+
+async def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+    if pd is None:
+        raise SystemExit("Facet retrieval requires pandas: poetry install --extras offline")
+
+    pairs = read_facets(args.input)
+    logger.info(f"Read {len(pairs)} facet pairs from {args.input}")
+
+    client = FacetRetrievalClient(
+        args.endpoint,
+        None if args.no_auth else AccessTokenProvider(),
+        max_results=args.max_results,
+        batch_size=max(1, args.batch_size),
+        concurrency=max(1, args.concurrency)
+    )
+    started_at = time.monotonic()
+    await client.start()
+    try:
+        retrieved = await client.retrieve((facet for _, facet in pairs), args.threshold)
+    finally:
+        await client.close()
+
+    frame = build_frame(pairs, retrieved)
+    write_results(frame, args.output)
+    if args.bigquery_table:
+        upload_to_bigquery(frame, args.bigquery_table, args.project)
+    logger.info(
+        f"Wrote {len(frame)} rows for {len(retrieved)} facets to {args.output} "
+        f"in {time.monotonic() - started_at:.1f}s ({client.requests} requests)"
+    )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        sys.exit(130)
@@ -0,0 +1,296 @@
+"""Local equivalent of sql/final_output.sql.
+
+Pivots the PIES attribute-value table into per-article product details and
+joins them onto the facet to product table (the output of
+facet_retrieval.py), from Parquet or CSV exports instead of BigQuery.
+
+The attribute-value table is streamed in record batches (Parquet row groups
+or CSV blocks), so memory stays bounded however many attribute rows there
+are: each batch is filtered, restricted to the articles of the facet to
+product table and reduced to the per-article maximum of each pivoted
+attribute with vectorized Arrow compute before the next batch is read.
+
+Usage:
+    python final_output.py --facet-products facet_products.parquet \\
+        --attribute-values pies_smkt_attribute_value.parquet \\
+        --attribute-metadata pies_smkt_attribute_metadata.csv \\
+        --output final_output.parquet
+"""
+import argparse
+import logging
+import sys
+import time
+from pathlib import Path
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pacsv
+    import pyarrow.parquet as pq
+except ImportError:  # Only this offline tool needs it, not the API
+    pa = pc = pacsv = pq = None
+
+logger = logging.getLogger("final_output")
+
+# Attribute metadata IDs the details are pivoted from
+ATTRIBUTE_IDS = (1088, 835, 1002, 1003, 735, 976, 427, 1087, 50, 897)
+# Attribute flagging B2B articles, which are included when its value is "True"
+B2B_ATTRIBUTE_ID = 3753
+SALES_ORGANISATION_ID = 1005
+
+
+class PivotColumn(NamedTuple):
+    """A details column pivoted from one attribute."""
+    attribute: str      # metadata name of the attribute
+    use_override: bool  # whether attributevalueoverride takes precedence
+
+
+PIVOT_COLUMNS: Dict[str, PivotColumn] = {
+    "name": PivotColumn("name", True),
+    "product_name": PivotColumn("ProductName", True),
+    "online_product_name": PivotColumn("Online Product Name", True),
+    "text_description": PivotColumn("PlainTextDescription", True),
+    "description": PivotColumn("description", True),
+    "short_description": PivotColumn("ShortDescription", True),
+    "brand": PivotColumn("Brand", False),
+    "sub_brand": PivotColumn("Sub-Brand", False),
+}
+# Details columns the final SELECT adds to the facet to product rows
+OUTPUT_COLUMNS = ("online_product_name", "description", "brand")
+
+VALUE_COLUMNS = {
+    "articlenumber": "string",
+    "attributemetadataid": "int64",
+    "attributevalue": "string",
+    "attributevalueoverride": "string",
+    "salesorganisationid": "int64",
+    "isactive": "string",
+}
+
+
+def read_table(path: Path, column_types: Optional[Dict[str, str]] = None) -> "pa.Table":
+    """Read a whole (small) Parquet or CSV table."""
+    if path.suffix.lower() == ".parquet":
+        return pq.read_table(path)
+    if path.suffix.lower() == ".csv":
+        types = {name: pa.type_for_alias(alias) for name, alias in (column_types or {}).items()}
+        return pacsv.read_csv(path, convert_options=pacsv.ConvertOptions(column_types=types))
+    raise SystemExit(f"Unsupported input format: {path.suffix} (expected .csv or .parquet)")
+
+
+def iter_batches(path: Path, columns: Dict[str, str], batch_size: int) -> Iterator["pa.RecordBatch"]:
+    """Stream the given columns of a Parquet or CSV file in record batches.
+
+    CSV columns are read with fixed types, since the streaming reader would
+    otherwise infer them from the first block only.
+    """
+    suffix = path.suffix.lower()
+    if suffix == ".parquet":
+        yield from pq.ParquetFile(path).iter_batches(batch_size=batch_size, columns=list(columns))
+    elif suffix == ".csv":
+        reader = pacsv.open_csv(
+            path,
+            read_options=pacsv.ReadOptions(block_size=16 * 1024 * 1024),
+            convert_options=pacsv.ConvertOptions(
+                include_columns=list(columns),
+                column_types={name: pa.type_for_alias(alias) for name, alias in columns.items()}
+            )
+        )
+        yield from reader
+    else:
+        raise SystemExit(f"Unsupported input format: {path.suffix} (expected .csv or .parquet)")
+
+
+def _truthy(values: "pa.Array") -> "pa.Array":
+    """Boolean view of a BOOL column, or of a string column holding "true"/"1"."""
+    if pa.types.is_boolean(values.type):
+        return values
+    return pc.is_in(pc.utf8_lower(pc.cast(values, pa.string())), value_set=pa.array(["true", "1"]))
+
+
+class AttributePivot:
+    """Streaming per-article pivot of attribute rows into details columns.
+
+    Each batch is reduced to (article, slot, max value) rows, where a slot
+    is one of the pivoted columns. Partial results are merged whenever they
+    grow past `compact_rows`, so memory is bounded by the number of distinct
+    (article, column) pairs rather than by the number of attribute rows.
+    """
+
+    def __init__(self,
+                 metadata: "pa.Table",
+                 columns: Tuple[str, ...],
+                 articles: Optional["pa.Array"] = None,
+                 compact_rows: int = 1_000_000):
+        """Initialize the pivot.
+
+        Args:
+            metadata: Attribute metadata with `id` and `name` columns
+            columns: Names of the PIVOT_COLUMNS to compute
+            articles: Only pivot these article numbers (all if omitted)
+            compact_rows: Partial result rows that trigger a merge
+        """
+        self.columns = columns
+        self.articles = articles
+        self.compact_rows = compact_rows
+
+        slot_of_name = {PIVOT_COLUMNS[column].attribute: slot for slot, column in enumerate(columns)}
+        slot_ids, slots = [], []
+        for attribute_id, name in zip(metadata.column("id").to_pylist(), metadata.column("name").to_pylist()):
+            if attribute_id in ATTRIBUTE_IDS and name in slot_of_name:
+                slot_ids.append(attribute_id)
+                slots.append(slot_of_name[name])
+        self._slot_ids = pa.array(slot_ids, type=pa.int64())
+        self._slots = pa.array(slots, type=pa.int32())
+        self._use_override = pa.array([PIVOT_COLUMNS[column].use_override for column in columns], type=pa.bool_())
+
+        self._partials: List["pa.Table"] = []
+        self._partial_rows = 0
+        self._b2b: List["pa.Array"] = []
+        self.rows_read = 0
+
+    def add(self, batch: "pa.RecordBatch") -> None:
+        """Fold one batch of attribute-value rows into the pivot."""
+        self.rows_read += batch.num_rows
+        articles = pc.cast(batch.column("articlenumber"), pa.string())
+        attribute_ids = pc.cast(batch.column("attributemetadataid"), pa.int64())
+        values = pc.cast(batch.column("attributevalue"), pa.string())
+
+        keep = pc.and_(
+            pc.equal(pc.cast(batch.column("salesorganisationid"), pa.int64()), SALES_ORGANISATION_ID),
+            _truthy(batch.column("isactive"))
+        )
+        if self.articles is not None:
+            keep = pc.and_(keep, pc.is_in(articles, value_set=self.articles))
+        keep = pc.fill_null(keep, False)
+
+        b2b = pc.and_(keep, pc.and_(pc.equal(attribute_ids, B2B_ATTRIBUTE_ID),
+                                    pc.equal(pc.utf8_upper(values), "TRUE")))
+        b2b_articles = pc.filter(articles, pc.fill_null(b2b, False))
+        if len(b2b_articles):
+            self._b2b.append(pc.unique(b2b_articles))
+
+        slot_index = pc.index_in(attribute_ids, value_set=self._slot_ids)
+        keep = pc.and_(keep, pc.is_valid(slot_index))
+        if not pc.any(keep).as_py():
+            return
+        slot_index = pc.filter(slot_index, keep)
+        slots = pc.take(self._slots, slot_index)
+        values = pc.filter(values, keep)
+        overrides = pc.cast(pc.filter(batch.column("attributevalueoverride"), keep), pa.string())
+        values = pc.if_else(pc.take(self._use_override, slots), pc.coalesce(overrides, values), values)
+
+        partial = pa.table({
+            "article": pc.filter(articles, keep),
+            "slot": slots,
+            "value": values,
+        }).group_by(["article", "slot"]).aggregate([("value", "max")])
+        self._partials.append(partial)
+        self._partial_rows += partial.num_rows
+        if self._partial_rows > self.compact_rows:
+            self._compact()
+
+    def _compact(self) -> None:
+        merged = pa.concat_tables(self._partials).group_by(["article", "slot"]).aggregate([("value_max", "max")])
+        merged = pa.table({
+            "article": merged.column("article"),
+            "slot": merged.column("slot"),
+            "value_max": merged.column("value_max_max"),
+        })
+        self._partials = [merged]
+        self._partial_rows = merged.num_rows
+
+    def lookup(self, articles: "pa.Array") -> Dict[str, "pa.Array"]:
+        """Return each pivoted column (and `is_b2b`) aligned with `articles`.
+
+        Articles without details get nulls, like a LEFT JOIN.
+        """
+        if self._partials:
+            self._compact()
+            details = self._partials[0]
+        else:
+            details = pa.table({"article": pa.array([], pa.string()), "slot": pa.array([], pa.int32()),
+                                "value_max": pa.array([], pa.string())})
+        articles = pc.cast(articles, pa.string())
+
+        result = {}
+        for slot, column in enumerate(self.columns):
+            found = details.filter(pc.equal(details.column("slot"), slot))
+            positions = pc.index_in(articles, value_set=found.column("article"))
+            result[column] = pc.take(found.column("value_max"), positions)
+
+        b2b = pc.unique(pa.chunked_array(self._b2b, pa.string()).combine_chunks()) if self._b2b \
+            else pa.array([], pa.string())
+        result["is_b2b"] = pc.is_in(articles, value_set=b2b)
+        return result
+
+
+def build_final_output(facet_products: "pa.Table",
+                       attribute_values: Path,
+                       metadata: "pa.Table",
+                       batch_size: int = 1_000_000,
+                       b2b_flag: bool = False) -> "pa.Table":
+    """Join the pivoted details onto the facet to product rows.
+
+    Args:
+        facet_products: Facet to product rows with a `product_nbr` column
+        attribute_values: Parquet or CSV export of the attribute-value table
+        metadata: Attribute metadata with `id` and `name` columns
+        batch_size: Attribute rows per streamed Parquet batch
+        b2b_flag: Also add an `is_b2b` column
+
+    Returns:
+        The facet to product columns plus OUTPUT_COLUMNS, ordered by
+        `original_term, kw` with nulls first, as BigQuery orders them
+    """
+    product_numbers = pc.cast(facet_products.column("product_nbr"), pa.string()).combine_chunks()
+    pivot = AttributePivot(metadata, OUTPUT_COLUMNS, articles=pc.unique(product_numbers))
+    for batch in iter_batches(attribute_values, VALUE_COLUMNS, batch_size):
+        pivot.add(batch)
+    logger.info(f"Pivoted {pivot.rows_read} attribute rows")
+
+    details = pivot.lookup(product_numbers)
+    table = facet_products
+    for column in OUTPUT_COLUMNS + (("is_b2b",) if b2b_flag else ()):
+        table = table.append_column(column, details[column])
+    return table.sort_by([("original_term", "ascending", "at_start"), ("kw", "ascending", "at_start")])
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Run sql/final_output.sql locally on Parquet or CSV exports.")
+    parser.add_argument("--facet-products", required=True, type=Path,
+                        help="Facet to product table (output of facet_retrieval.py)")
+    parser.add_argument("--attribute-values", required=True, type=Path,
+                        help="pies_smkt_attribute_value_v export")
+    parser.add_argument("--attribute-metadata", required=True, type=Path,
+                        help="pies_smkt_attribute_metadata_v export (id and name columns)")
+    parser.add_argument("--output", required=True, type=Path, help="Output Parquet file")
+    parser.add_argument("--batch-size", type=int, default=1_000_000,
+                        help="Attribute rows per streamed Parquet batch (default: 1000000)")
+    parser.add_argument("--b2b-flag", action="store_true", help="Add an is_b2b column")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+    if pa is None:
+        raise SystemExit("final_output.py requires pyarrow: poetry install --extras offline")
+
+    started_at = time.monotonic()
+    facet_products = read_table(args.facet_products, {"product_nbr": "string"})
+    metadata = read_table(args.attribute_metadata, {"id": "int64", "name": "string"}).select(["id", "name"])
+    metadata = metadata.cast(pa.schema([("id", pa.int64()), ("name", pa.string())]))
+    table = build_final_output(facet_products, args.attribute_values, metadata, max(1, args.batch_size), args.b2b_flag)
+
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    pq.write_table(table, args.output)
+    logger.info(f"Wrote {table.num_rows} rows to {args.output} in {time.monotonic() - started_at:.1f}s")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    try:
+        main()
+    except KeyboardInterrupt:
+        sys.exit(130)
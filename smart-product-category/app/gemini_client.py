@@ -1,13 +1,22 @@
 from langchain.prompts import ChatPromptTemplate
 from langchain.schema import StrOutputParser
+from langchain_core.language_models import BaseChatModel
 from langchain_google_genai import ChatGoogleGenerativeAI
-from typing import Dict, Any, Optional
+from pydantic import BaseModel, ValidationError
+from typing import Dict, Any, Optional, List, Tuple, Type, Union
+import asyncio
+import hashlib
 import json
-import backoff
 import logging
+from admission import AdmissionController, AdmissionRejected
 from config import settings
+from json_repair import repair_json, JSONRepairError
+from deadline import deadline_retry
+from metrics import timed_stage, LLM_OUTPUT_PARSES, UPSTREAM_IN_FLIGHT
+from rate_limiter import AdaptiveTokenBucket, create_rate_limiter, is_rate_limit_error
 from schema import ModelResponse
-from templates import ENHANCED_JSON_RESPONSE_TEMPLATE
+from single_flight import SingleFlight
+from templates import ENHANCED_JSON_RESPONSE_TEMPLATE, PACKED_JSON_RESPONSE_TEMPLATE, PACKED_PRODUCT_TEMPLATE
 
 logger = logging.getLogger(__name__)
 
@@ -18,7 +27,10 @@ class GeminiClient:
                  model_name: Optional[str] = None, 
                  temperature: Optional[float] = None,
                  max_output_tokens: Optional[int] = None,
-                 api_key: Optional[str] = None):
+                 api_key: Optional[str] = None,
+                 rate_limiter: Optional[AdaptiveTokenBucket] = None,
+                 admission: Optional[AdmissionController] = None,
+                 llm: Optional[BaseChatModel] = None):
         """Initialize the Gemini client.
         
         Args:
@@ -26,22 +38,95 @@ class GeminiClient:
             temperature: Temperature setting for generation (defaults to config setting)
             max_output_tokens: Max tokens to generate (defaults to config setting)
             api_key: Google API key (defaults to config setting)
+            rate_limiter: Token bucket pacing model calls (defaults to one
+                built from the RATE_LIMIT_* settings)
+            admission: Admission controller bounding concurrent model calls,
+                usually shared with other clients (no limit if omitted)
+            llm: Chat model to use instead of Gemini, e.g. a local stand-in
+                for benchmarks
         
         Raises:
             ValueError: If API key is not provided and not in settings
         """
+        self.model_name = model_name or settings.model_name
+        self.temperature = temperature or settings.temperature
+        self.max_output_tokens = max_output_tokens or settings.max_output_tokens
+        self.rate_limiter = rate_limiter or create_rate_limiter(
+            f"Gemini ({self.model_name})",
+            settings.rate_limit_enabled,
+            settings.rate_limit_requests,
+            settings.rate_limit_timeframe,
+            settings.rate_limit_burst,
+            settings.rate_limit_db_path if settings.multi_worker else None
+        )
+        self.admission = admission
+        
         try:
-            self.llm = ChatGoogleGenerativeAI(
-                model=model_name or settings.model_name,
-                temperature=temperature or settings.temperature,
-                max_output_tokens=max_output_tokens or settings.max_output_tokens,
+            self.llm = llm or ChatGoogleGenerativeAI(
+                model=self.model_name,
+                temperature=self.temperature,
+                max_output_tokens=self.max_output_tokens,
                 google_api_key=api_key or settings.google_api_key
             )
             self.json_parser = StrOutputParser()
+            self.prompt_flights = SingleFlight("gemini prompt")
+            self._schema_cache: Dict[int, Tuple[Dict[str, Any], str]] = {}
+            self._build_chains()
         except Exception as e:
             logger.error(f"Error initializing Gemini client: {str(e)}")
             raise ValueError(f"Failed to initialize Gemini client: {str(e)}")
     
+    def _build_chains(self) -> None:
+        """Build the prompt -> model -> parser chains once for all requests."""
+        self.chain = (
+            ChatPromptTemplate.from_template(ENHANCED_JSON_RESPONSE_TEMPLATE)
+            | self.llm
+            | StrOutputParser()
+        )
+        self.packed_chain = (
+            ChatPromptTemplate.from_template(PACKED_JSON_RESPONSE_TEMPLATE)
+            | self.llm
+            | StrOutputParser()
+        )
+    
+    async def _invoke(self, chain, inputs: Dict[str, Any]) -> str:
+        """Invoke a chain within an admission slot, if any.
+        
+        Raises:
+            AdmissionRejected: If the admission controller sheds the call
+        """
+        if self.admission is None:
+            return await self._invoke_paced(chain, inputs)
+        async with self.admission.slot():
+            return await self._invoke_paced(chain, inputs)
+    
+    async def _invoke_paced(self, chain, inputs: Dict[str, Any]) -> str:
+        """Invoke a chain, paced by the rate limiter and feeding back throttling."""
+        if self.rate_limiter is not None:
+            await self.rate_limiter.acquire()
+        try:
+            with timed_stage("llm_call"), UPSTREAM_IN_FLIGHT.labels("gemini").track_inprogress():
+                result = await chain.ainvoke(inputs)
+        except Exception as e:
+            if self.rate_limiter is not None and is_rate_limit_error(e):
+                await self.rate_limiter.on_throttle()
+            raise
+        if self.rate_limiter is not None:
+            await self.rate_limiter.on_success()
+        return result
+    
+    def _serialize_schema(self, json_structure: Dict[str, Any]) -> str:
+        """Return the prompt serialization of a JSON structure, cached per object.
+        
+        JSON structures are module-level constants, so they are cached by
+        identity; the structure itself is kept to pin its id.
+        """
+        cached = self._schema_cache.get(id(json_structure))
+        if cached is None or cached[0] is not json_structure:
+            cached = (json_structure, json.dumps(json_structure))
+            self._schema_cache[id(json_structure)] = cached
+        return cached[1]
+    
     @staticmethod
     def _clean_json_response(result: str) -> str:
         """Clean the model response to ensure it's valid JSON.
@@ -65,17 +150,49 @@ class GeminiClient:
             
         return result.strip()
     
-    @backoff.on_exception(
-        backoff.expo,
-        (ValueError, ConnectionError, TimeoutError),
-        max_tries=3
-    )
-    async def process_prompt(self, prompt: str, json_structure: Dict[str, Any]) -> ModelResponse:
+    @staticmethod
+    def _parse_json_response(cleaned_result: str, expected: type) -> Any:
+        """Parse a cleaned model response, repairing malformed JSON locally.
+        
+        Args:
+            cleaned_result: Model response with markdown fences removed
+            expected: `dict` or `list`, the kind of JSON value expected
+            
+        Returns:
+            The parsed JSON value
+            
+        Raises:
+            ValueError: If no JSON value of the expected kind can be recovered
+        """
+        try:
+            parsed, repaired = repair_json(cleaned_result, expected)
+        except JSONRepairError as je:
+            LLM_OUTPUT_PARSES.labels("failed").inc()
+            logger.error(f"JSON parsing error: {str(je)}\nCleaned response: {cleaned_result}")
+            raise ValueError(f"Failed to parse LLM response as JSON: {str(je)}")
+        
+        LLM_OUTPUT_PARSES.labels("repaired" if repaired else "clean").inc()
+        if repaired:
+            logger.warning(f"Repaired malformed JSON in LLM response: {cleaned_result[:200]}")
+        return parsed
+    
+    async def process_prompt(self,
+                             prompt: str,
+                             json_structure: Dict[str, Any],
+                             response_model: Optional[Type[BaseModel]] = None) -> ModelResponse:
         """Process a prompt with the Gemini model and return structured response.
         
+        Concurrent calls with an identical prompt and JSON structure share a
+        single model call and receive the same response or error.
+        
+        Malformed JSON is repaired locally; the model is only called again
+        when nothing usable can be recovered or, given `response_model`, when
+        the recovered response does not validate against it.
+        
         Args:
             prompt: The input prompt to process
             json_structure: Expected JSON structure for the response
+            response_model: Model the response must validate against
             
         Returns:
             ModelResponse containing parsed response and raw response
@@ -83,37 +200,195 @@ class GeminiClient:
         Raises:
             ValueError: If the model fails to generate a valid JSON response
         """
-        prompt_template = ChatPromptTemplate.from_template(ENHANCED_JSON_RESPONSE_TEMPLATE)
-        
-        chain = (
-            prompt_template 
-            | self.llm 
-            | StrOutputParser()
+        key = hashlib.sha256(
+            f"{self._serialize_schema(json_structure)}\0{prompt}".encode("utf-8")
+        ).hexdigest()
+        return await self.prompt_flights.do(
+            key, lambda: self._process_prompt(prompt, json_structure, response_model)
         )
+    
+    @deadline_retry("gemini", (ValueError, ConnectionError, TimeoutError))
+    async def _process_prompt(self,
+                              prompt: str,
+                              json_structure: Dict[str, Any],
+                              response_model: Optional[Type[BaseModel]] = None) -> ModelResponse:
+        """Process a prompt with the Gemini model and return structured response.
         
+        Args:
+            prompt: The input prompt to process
+            json_structure: Expected JSON structure for the response
+            response_model: Model the response must validate against
+            
+        Returns:
+            ModelResponse containing parsed response and raw response
+            
+        Raises:
+            ValueError: If the model fails to generate a valid JSON response
+        """
         try:
             logger.debug(f"Sending prompt to Gemini: {prompt[:100]}...")
-            result = await chain.ainvoke({
+            result = await self._invoke(self.chain, {
                 "prompt": prompt,
-                "json_structure": json.dumps(json_structure, indent=2)
+                "json_structure": self._serialize_schema(json_structure)
             })
             
-            # Clean the response to ensure it only contains JSON
-            cleaned_result = self._clean_json_response(result)
-            
-            try:
-                parsed_response = json.loads(cleaned_result)
+            with timed_stage("json_parse"):
+                # Clean the response to ensure it only contains JSON
+                cleaned_result = self._clean_json_response(result)
+                parsed_response = self._parse_json_response(cleaned_result, dict)
+                
+                if response_model is not None:
+                    try:
+                        response_model(**parsed_response)
+                    except ValidationError as ve:
+                        logger.error(f"LLM response failed validation: {str(ve)}\nCleaned response: {cleaned_result}")
+                        raise ValueError(f"LLM response does not match {response_model.__name__}: {str(ve)}")
                 logger.debug("Successfully parsed JSON response from Gemini")
-            except json.JSONDecodeError as je:
-                logger.error(f"JSON parsing error: {str(je)}\nCleaned response: {cleaned_result}")
-                raise ValueError(f"Failed to parse LLM response as JSON: {str(je)}")
             
             return ModelResponse(
                 response=parsed_response,
                 raw_response=cleaned_result
             )
         except Exception as e:
-            if isinstance(e, ValueError):
+            if isinstance(e, (ValueError, AdmissionRejected)):
                 raise
             logger.error(f"Error in process_prompt: {str(e)}")
-            raise ValueError(f"Failed to process prompt: {str(e)}")
\ No newline at end of file
+            raise ValueError(f"Failed to process prompt: {str(e)}")
+    
+    def pack_size(self, output_tokens_per_item: int) -> int:
+        """Number of products that fit in one packed prompt.
+        
+        Leaves 20% of `max_output_tokens` as headroom for the JSON envelope and
+        for results that run longer than the estimate.
+        
+        Args:
+            output_tokens_per_item: Estimated output tokens per product result
+            
+        Returns:
+            Pack size between 1 and the PACK_MAX_ITEMS setting
+        """
+        budget = int(self.max_output_tokens * 0.8)
+        return max(1, min(settings.pack_max_items, budget // max(1, output_tokens_per_item)))
+    
+    @deadline_retry("gemini", (ValueError, ConnectionError, TimeoutError))
+    async def _process_pack(self,
+                            instructions: str,
+                            pack: Dict[str, str],
+                            json_structure: Dict[str, Any],
+                            response_model: Type[BaseModel]) -> Dict[str, BaseModel]:
+        """Send one packed prompt and validate the keyed results it returns.
+        
+        Args:
+            instructions: Instructions shared by every product in the pack
+            pack: Product text keyed by product id
+            json_structure: Expected JSON structure of each product result
+            response_model: Model each product result is validated against
+            
+        Returns:
+            Validated results keyed by product id; ids missing from the
+            response or with invalid results are left out
+            
+        Raises:
+            ValueError: If the response is not a JSON array at all
+        """
+        products = "\n\n".join(
+            PACKED_PRODUCT_TEMPLATE.format(product_id=product_id, product=product)
+            for product_id, product in pack.items()
+        )
+        
+        try:
+            logger.debug(f"Sending packed prompt with {len(pack)} products to Gemini")
+            result = await self._invoke(self.packed_chain, {
+                "prompt": instructions,
+                "products": products,
+                "json_structure": self._serialize_schema(json_structure)
+            })
+        except AdmissionRejected:
+            raise
+        except Exception as e:
+            logger.error(f"Error in _process_pack: {str(e)}")
+            raise ValueError(f"Failed to process packed prompt: {str(e)}")
+        
+        with timed_stage("json_parse"):
+            cleaned_result = self._clean_json_response(result)
+            parsed_response = self._parse_json_response(cleaned_result, list)
+        
+        results = {}
+        for element in parsed_response:
+            if not isinstance(element, dict):
+                continue
+            product_id = str(element.get("id", ""))
+            if product_id not in pack or not isinstance(element.get("result"), dict):
+                continue
+            try:
+                results[product_id] = response_model(**element["result"])
+            except ValidationError as ve:
+                logger.warning(f"Invalid packed result for product {product_id}: {str(ve)}")
+        
+        return results
+    
+    async def process_packed_prompts(self,
+                                     instructions: str,
+                                     items: Dict[str, str],
+                                     json_structure: Dict[str, Any],
+                                     response_model: Type[BaseModel],
+                                     output_tokens_per_item: int) -> Dict[str, Union[BaseModel, Exception]]:
+        """Process many products with few model calls by packing them together.
+        
+        Products are split into packs sized to the output token budget and the
+        packs are sent concurrently. Products missing from a pack's response,
+        or whose result fails validation, are put back into the next round of
+        packs, up to the PACK_MAX_ATTEMPTS setting.
+        
+        Args:
+            instructions: Instructions shared by every product
+            items: Product text keyed by product id
+            json_structure: Expected JSON structure of each product result
+            response_model: Model each product result is validated against
+            output_tokens_per_item: Estimated output tokens per product result
+            
+        Returns:
+            For every product id, either its validated result or the
+            exception explaining why it could not be categorized
+        """
+        results: Dict[str, Union[BaseModel, Exception]] = {}
+        pending = list(items)
+        size = self.pack_size(output_tokens_per_item)
+        semaphore = asyncio.Semaphore(settings.pack_concurrency)
+        
+        async def run_pack(pack: Dict[str, str]) -> Union[Dict[str, BaseModel], Exception]:
+            async with semaphore:
+                try:
+                    return await self._process_pack(instructions, pack, json_structure, response_model)
+                except Exception as e:
+                    return e
+        
+        for attempt in range(settings.pack_max_attempts):
+            if not pending:
+                break
+            
+            packs = [
+                {product_id: items[product_id] for product_id in pending[i:i + size]}
+                for i in range(0, len(pending), size)
+            ]
+            logger.info(f"Sending {len(pending)} products in {len(packs)} packs of up to {size} (attempt {attempt + 1})")
+            
+            pending = []
+            for pack, outcome in zip(packs, await asyncio.gather(*(run_pack(pack) for pack in packs))):
+                for product_id in pack:
+                    if isinstance(outcome, AdmissionRejected):
+                        # Shed under load; sending it again now would be too
+                        results[product_id] = outcome
+                    elif isinstance(outcome, Exception):
+                        results[product_id] = outcome
+                        pending.append(product_id)
+                    elif product_id in outcome:
+                        results[product_id] = outcome[product_id]
+                    else:
+                        pending.append(product_id)
+        
+        for product_id in pending:
+            if not isinstance(results.get(product_id), Exception):
+                results[product_id] = ValueError(f"No valid result for product {product_id} in packed LLM response")
+        
+        return results
@@ -0,0 +1,423 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional
+
+from admission import AdmissionRejected, Priority, set_priority
+
+logger = logging.getLogger(__name__)
+
+# Job statuses
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+
+# Item statuses
+PENDING = "pending"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+
+class JobItem(NamedTuple):
+    """One product of a job, claimed by a worker."""
+    job_id: str
+    position: int
+    product_id: str
+    mode: str
+    fields: Optional[List[str]]
+
+
+class JobStore:
+    """Durable job queue stored in a SQLite database in WAL mode.
+
+    Every product of a job is a row that moves from pending to running to
+    succeeded or failed, and its result is written as soon as it is known,
+    so progress survives restarts and results are never held in memory.
+    Finished items are numbered in completion order, which gives stable
+    pages while a job is still running.
+
+    Several processes can share a store. Each claims items under its own
+    owner ID and records a heartbeat, so items are only returned to the
+    queue once the process running them has stopped.
+    """
+
+    def __init__(self, path: str, owner: Optional[str] = None):
+        """Initialize the job store and create its tables if needed.
+
+        Args:
+            path: Path of the SQLite database file
+            owner: ID recorded on the items this process claims (defaults
+                to a random one)
+        """
+        self.path = Path(path)
+        self.owner = owner or uuid.uuid4().hex
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY,"
+            " mode TEXT NOT NULL,"
+            " fields TEXT,"
+            " status TEXT NOT NULL,"
+            " total INTEGER NOT NULL,"
+            " succeeded INTEGER NOT NULL DEFAULT 0,"
+            " failed INTEGER NOT NULL DEFAULT 0,"
+            " created_at REAL NOT NULL,"
+            " updated_at REAL NOT NULL,"
+            " finished_at REAL);"
+            "CREATE TABLE IF NOT EXISTS job_items ("
+            " job_id TEXT NOT NULL,"
+            " position INTEGER NOT NULL,"
+            " product_id TEXT NOT NULL,"
+            " status TEXT NOT NULL,"
+            " seq INTEGER,"
+            " result TEXT,"
+            " error TEXT,"
+            " owner TEXT,"
+            " PRIMARY KEY (job_id, position));"
+            "CREATE INDEX IF NOT EXISTS job_items_status ON job_items (status, job_id, position);"
+            "CREATE INDEX IF NOT EXISTS job_items_seq ON job_items (job_id, seq);"
+            "CREATE TABLE IF NOT EXISTS job_owners ("
+            " owner TEXT PRIMARY KEY,"
+            " heartbeat_at REAL NOT NULL);"
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(job_items)")}
+        if "owner" not in columns:
+            self._conn.execute("ALTER TABLE job_items ADD COLUMN owner TEXT")
+
+    @staticmethod
+    def _job(row: sqlite3.Row) -> Dict[str, Any]:
+        job_id, mode, fields, status, total, succeeded, failed, created_at, updated_at, finished_at = row
+        return {
+            "job_id": job_id,
+            "mode": mode,
+            "fields": json.loads(fields) if fields is not None else None,
+            "status": status,
+            "total": total,
+            "succeeded": succeeded,
+            "failed": failed,
+            "created_at": created_at,
+            "updated_at": updated_at,
+            "finished_at": finished_at,
+        }
+
+    def create(self, product_ids: List[str], mode: str, fields: Optional[List[str]] = None) -> Dict[str, Any]:
+        """Queue a job categorizing `product_ids` and return it."""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "INSERT INTO jobs (id, mode, fields, status, total, created_at, updated_at)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (job_id, mode, json.dumps(fields) if fields is not None else None, QUEUED,
+                     len(product_ids), now, now)
+                )
+                self._conn.executemany(
+                    "INSERT INTO job_items (job_id, position, product_id, status) VALUES (?, ?, ?, ?)",
+                    ((job_id, position, product_id, PENDING) for position, product_id in enumerate(product_ids))
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, mode, fields, status, total, succeeded, failed, created_at, updated_at, finished_at"
+                " FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        return None if row is None else self._job(row)
+
+    def claim(self) -> Optional[JobItem]:
+        """Mark the next pending item of the oldest unfinished job as running and return it."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                item = None
+                jobs = self._conn.execute(
+                    "SELECT id, mode, fields FROM jobs WHERE status != ? ORDER BY created_at", (COMPLETED,)
+                ).fetchall()
+                for job_id, mode, fields in jobs:
+                    row = self._conn.execute(
+                        "SELECT position, product_id FROM job_items"
+                        " WHERE status = ? AND job_id = ? ORDER BY position LIMIT 1", (PENDING, job_id)
+                    ).fetchone()
+                    if row is None:
+                        continue
+                    item = JobItem(job_id, row[0], row[1], mode, json.loads(fields) if fields is not None else None)
+                    self._conn.execute(
+                        "UPDATE job_items SET status = ?, owner = ? WHERE job_id = ? AND position = ?",
+                        (RUNNING, self.owner, job_id, item.position)
+                    )
+                    self._conn.execute(
+                        "UPDATE jobs SET status = ?, updated_at = ? WHERE id = ? AND status = ?",
+                        (RUNNING, time.time(), job_id, QUEUED)
+                    )
+                    break
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return item
+
+    def release(self, item: JobItem) -> None:
+        """Put a claimed item back in the queue without recording an outcome."""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE job_items SET status = ?, owner = NULL"
+                " WHERE job_id = ? AND position = ? AND status = ? AND owner = ?",
+                (PENDING, item.job_id, item.position, RUNNING, self.owner)
+            )
+
+    def complete(self,
+                 item: JobItem,
+                 result: Optional[Dict[str, Any]] = None,
+                 error: Optional[Dict[str, Any]] = None) -> bool:
+        """Record a claimed item's result or error.
+
+        Nothing is recorded if the item is no longer running under this
+        store's owner, e.g. because it was requeued after missed heartbeats
+        and claimed again, so every item is counted once.
+
+        Returns:
+            Whether this was the job's last unfinished item
+        """
+        outcome = FAILED if error is not None else SUCCEEDED
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                claimed = self._conn.execute(
+                    "UPDATE job_items SET status = ?, result = ?, error = ?,"
+                    " seq = (SELECT succeeded + failed + 1 FROM jobs WHERE id = ?)"
+                    " WHERE job_id = ? AND position = ? AND status = ? AND owner = ?",
+                    (outcome, json.dumps(result) if result is not None else None,
+                     json.dumps(error) if error is not None else None, item.job_id, item.job_id, item.position,
+                     RUNNING, self.owner)
+                ).rowcount == 1
+                if not claimed:
+                    self._conn.execute("ROLLBACK")
+                    logger.warning(f"Job {item.job_id} item {item.position} was reclaimed; dropping its outcome")
+                    return False
+                self._conn.execute(
+                    f"UPDATE jobs SET {outcome} = {outcome} + 1, updated_at = ? WHERE id = ?", (now, item.job_id)
+                )
+                finished = self._conn.execute(
+                    "UPDATE jobs SET status = ?, finished_at = ? WHERE id = ? AND succeeded + failed = total",
+                    (COMPLETED, now, item.job_id)
+                ).rowcount > 0
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return finished
+
+    def results(self, job_id: str, offset: int = 0, limit: int = 100) -> List[Dict[str, Any]]:
+        """Return finished items of a job in completion order.
+
+        Args:
+            job_id: The job
+            offset: Number of finished items to skip
+            limit: Maximum number of items to return
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT position, product_id, result, error FROM job_items"
+                " WHERE job_id = ? AND seq > ? ORDER BY seq LIMIT ?", (job_id, offset, limit)
+            ).fetchall()
+        items = []
+        for position, product_id, result, error in rows:
+            item: Dict[str, Any] = {"index": position, "product_id": product_id}
+            if error is not None:
+                item["error"] = json.loads(error)
+            else:
+                item["result"] = json.loads(result)
+            items.append(item)
+        return items
+
+    def heartbeat(self) -> None:
+        """Record that this process is alive and still running the items it claimed."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO job_owners (owner, heartbeat_at) VALUES (?, ?)", (self.owner, time.time())
+            )
+
+    def retire(self) -> None:
+        """Drop this process's heartbeat, so the items it left running are requeued at once."""
+        with self._lock:
+            self._conn.execute("DELETE FROM job_owners WHERE owner = ?", (self.owner,))
+
+    def requeue_interrupted(self, stale_after: float) -> int:
+        """Return items left running by stopped processes to the queue.
+
+        Args:
+            stale_after: Seconds without a heartbeat after which a process
+                is considered stopped
+        """
+        cutoff = time.time() - stale_after
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute("DELETE FROM job_owners WHERE heartbeat_at <= ?", (cutoff,))
+                cursor = self._conn.execute(
+                    "UPDATE job_items SET status = ?, owner = NULL WHERE status = ?"
+                    " AND (owner IS NULL OR owner NOT IN (SELECT owner FROM job_owners))",
+                    (PENDING, RUNNING)
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return cursor.rowcount
+
+    def pending_items(self) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM job_items WHERE status IN (?, ?)", (PENDING, RUNNING)
+            ).fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class JobWorkers:
+    """Pool of asyncio workers processing queued job items.
+
+    Each worker claims one item at a time from the store, categorizes it and
+    records the outcome. Workers run at bulk priority, and items shed by
+    admission control go back to the queue rather than failing. The pool
+    keeps a heartbeat in the store and requeues items of other processes
+    that stopped heartbeating.
+    """
+
+    def __init__(self,
+                 store: JobStore,
+                 process: Callable[[JobItem], Awaitable[Dict[str, Any]]],
+                 describe_error: Callable[[Exception], Dict[str, Any]],
+                 workers: int,
+                 poll_interval: float = 1.0,
+                 lease: float = 30.0):
+        """Initialize the worker pool.
+
+        Args:
+            store: Store to claim items from and record outcomes in
+            process: Categorizes an item and returns its result
+            describe_error: Builds the recorded error of a failed item
+            workers: Number of items processed concurrently
+            poll_interval: Seconds between checks for work when idle
+            lease: Seconds without a heartbeat after which another
+                process's running items are requeued
+        """
+        self.store = store
+        self.process = process
+        self.describe_error = describe_error
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self._wakeup = asyncio.Event()
+        self._tasks: List["asyncio.Task[None]"] = []
+        self.busy = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.requeued = 0
+
+    def start(self) -> None:
+        """Requeue items interrupted by a restart and start the workers."""
+        self.store.heartbeat()
+        requeued = self.store.requeue_interrupted(self.lease)
+        if requeued:
+            logger.info(f"Resuming {requeued} job items interrupted by a restart")
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._keep_lease()))
+
+    async def stop(self) -> None:
+        """Stop the workers; items they were processing are resumed by the next process to start or check."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self.store.retire()
+
+    async def _keep_lease(self) -> None:
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            try:
+                await asyncio.to_thread(self.store.heartbeat)
+                requeued = await asyncio.to_thread(self.store.requeue_interrupted, self.lease)
+            except sqlite3.Error as e:
+                logger.error(f"Failed to renew the job lease: {str(e)}")
+                continue
+            if requeued:
+                logger.info(f"Requeued {requeued} job items of a stopped process")
+                self.notify()
+
+    def notify(self) -> None:
+        """Wake idle workers, e.g. after a job was queued."""
+        self._wakeup.set()
+
+    async def _worker(self) -> None:
+        set_priority(Priority.BULK)
+        while True:
+            self._wakeup.clear()
+            try:
+                item = await asyncio.to_thread(self.store.claim)
+            except sqlite3.Error as e:
+                logger.error(f"Failed to claim a job item: {str(e)}")
+                item = None
+            if item is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            self.busy += 1
+            try:
+                await self._run(item)
+            finally:
+                self.busy -= 1
+
+    async def _run(self, item: JobItem) -> None:
+        try:
+            result = await self.process(item)
+        except AdmissionRejected as e:
+            self.requeued += 1
+            await asyncio.to_thread(self.store.release, item)
+            await asyncio.sleep(e.retry_after)
+            return
+        except asyncio.CancelledError:
+            # Left running in the store, so it is picked up again after a restart
+            raise
+        except Exception as e:
+            logger.warning(f"Job {item.job_id} item {item.position} ({item.product_id}) failed: {str(e)}")
+            self.failed += 1
+            finished = await asyncio.to_thread(self.store.complete, item, None, self.describe_error(e))
+        else:
+            self.succeeded += 1
+            finished = await asyncio.to_thread(self.store.complete, item, result)
+        if finished:
+            logger.info(f"Job {item.job_id} completed")
+
+    def stats(self) -> Dict[str, Any]:
+        """Return worker usage, queue length and item counters."""
+        return {
+            "workers": self.workers,
+            "busy": self.busy,
+            "pending_items": self.store.pending_items(),
+            "items_succeeded": self.succeeded,
+            "items_failed": self.failed,
+            "items_requeued": self.requeued,
+        }
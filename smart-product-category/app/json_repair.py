@@ -0,0 +1,225 @@
+import json
+import logging
+import re
+from typing import Any, Dict, List, Optional, Tuple, Type
+
+logger = logging.getLogger(__name__)
+
+# Characters that can open a string outside of a string, and what closes it
+_STRING_DELIMITERS = {
+    '"': ('"',),
+    "'": ("'",),
+    "“": ("”", "“"),  # “ ... ” (models sometimes close with “ too)
+    "”": ("”", "“"),
+}
+_SMART_QUOTES = "“”"
+_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+_NUMBER = re.compile(r"-?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?")
+_WORD = re.compile(r"[A-Za-z_][A-Za-z0-9_\-]*")
+_LITERALS = {"true": True, "false": False, "null": None, "True": True, "False": False, "None": None}
+
+
+class JSONRepairError(ValueError):
+    """Raised when model output cannot be turned into JSON."""
+
+
+class _Truncated(Exception):
+    """The input ended inside a value; `partial` is what could be kept.
+
+    For arrays, `complete` counts the leading elements that were not cut off.
+    """
+
+    def __init__(self, partial: Any = None, complete: int = 0):
+        self.partial = partial
+        self.complete = complete
+
+
+class _TolerantParser:
+    """Recursive-descent JSON parser that accepts the mistakes models make.
+
+    Accepts smart and single quotes around strings, trailing or missing
+    commas, Python literals and bare keys. Input that ends early raises
+    `_Truncated` carrying the containers closed at their last complete
+    element.
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        self.pos = 0
+
+    def _skip(self, separators: str = "") -> None:
+        while self.pos < len(self.text) and (self.text[self.pos].isspace() or self.text[self.pos] in separators):
+            self.pos += 1
+
+    def _eof(self) -> bool:
+        return self.pos >= len(self.text)
+
+    def parse_value(self) -> Any:
+        self._skip()
+        if self._eof():
+            raise _Truncated()
+        char = self.text[self.pos]
+        if char == "{":
+            return self.parse_object()
+        if char == "[":
+            return self.parse_array()
+        if char in _STRING_DELIMITERS:
+            return self.parse_string()
+
+        match = _NUMBER.match(self.text, self.pos)
+        if match:
+            self.pos = match.end()
+            if self._eof():
+                # The number may have been cut off mid-digit
+                raise _Truncated()
+            number = match.group()
+            return float(number) if any(c in number for c in ".eE") else int(number)
+
+        match = _WORD.match(self.text, self.pos)
+        if match and match.group() in _LITERALS:
+            self.pos = match.end()
+            return _LITERALS[match.group()]
+        if match and match.end() == len(self.text):
+            raise _Truncated()
+        raise JSONRepairError(f"Unexpected character {char!r} at position {self.pos}")
+
+    def _ends_value(self, pos: int) -> bool:
+        """Whether only whitespace stands between `pos` and a separator."""
+        while pos < len(self.text) and self.text[pos].isspace():
+            pos += 1
+        return pos >= len(self.text) or self.text[pos] in ",:]}"
+
+    def parse_string(self) -> str:
+        opener = self.text[self.pos]
+        closers = _STRING_DELIMITERS[opener]
+        self.pos += 1
+        chars: List[str] = []
+        while not self._eof():
+            char = self.text[self.pos]
+            if char in closers or (opener == '"' and char in _SMART_QUOTES and self._ends_value(self.pos + 1)):
+                # A smart quote can close a plain string, as in "Firm“, but
+                # only where the value plausibly ends
+                self.pos += 1
+                return "".join(chars)
+            if char == "\\":
+                if self.pos + 1 >= len(self.text):
+                    break
+                escaped = self.text[self.pos + 1]
+                if escaped == "u":
+                    code = self.text[self.pos + 2:self.pos + 6]
+                    if len(code) < 4:
+                        break
+                    try:
+                        chars.append(chr(int(code, 16)))
+                    except ValueError:
+                        raise JSONRepairError(f"Invalid unicode escape at position {self.pos}")
+                    self.pos += 6
+                    continue
+                chars.append(_ESCAPES.get(escaped, escaped))
+                self.pos += 2
+                continue
+            chars.append(char)
+            self.pos += 1
+        raise _Truncated()
+
+    def _parse_key(self) -> str:
+        if self.text[self.pos] in _STRING_DELIMITERS:
+            return self.parse_string()
+        match = _WORD.match(self.text, self.pos)
+        if not match:
+            raise JSONRepairError(f"Expected an object key at position {self.pos}")
+        self.pos = match.end()
+        if self._eof():
+            raise _Truncated()
+        return match.group()
+
+    def parse_object(self) -> Dict[str, Any]:
+        self.pos += 1
+        result: Dict[str, Any] = {}
+        while True:
+            self._skip(",")
+            if self._eof():
+                raise _Truncated(result)
+            if self.text[self.pos] == "}":
+                self.pos += 1
+                return result
+            if self.text[self.pos] == "]":
+                raise JSONRepairError(f"Mismatched ']' at position {self.pos}")
+
+            try:
+                key = self._parse_key()
+                self._skip()
+                if self._eof():
+                    raise _Truncated()
+                if self.text[self.pos] != ":":
+                    raise JSONRepairError(f"Expected ':' at position {self.pos}")
+                self.pos += 1
+                result[key] = self.parse_value()
+            except _Truncated as e:
+                # Keep a cut-off container; drop a cut-off scalar or key
+                if isinstance(e.partial, (dict, list)):
+                    result[key] = e.partial
+                raise _Truncated(result)
+
+    def parse_array(self) -> List[Any]:
+        self.pos += 1
+        result: List[Any] = []
+        while True:
+            self._skip(",")
+            if self._eof():
+                raise _Truncated(result)
+            if self.text[self.pos] == "]":
+                self.pos += 1
+                return result
+            if self.text[self.pos] == "}":
+                raise JSONRepairError(f"Mismatched '}}' at position {self.pos}")
+
+            try:
+                result.append(self.parse_value())
+            except _Truncated as e:
+                complete = len(result)
+                if isinstance(e.partial, (dict, list)):
+                    result.append(e.partial)
+                raise _Truncated(result, complete)
+
+
+def repair_json(text: str, expected: Optional[Type] = None) -> Tuple[Any, bool]:
+    """Parse model output as JSON, repairing common mistakes.
+
+    Strict JSON is parsed directly. Otherwise the first object or array in
+    the text is parsed tolerantly: prose around it, smart or single quotes,
+    trailing commas and Python literals are accepted, and output that was
+    cut off is closed at its last complete element. A top-level array keeps
+    only its complete elements, since each is a separate record.
+
+    Args:
+        text: Model output, with markdown fences already removed
+        expected: `dict` or `list` to look only for that kind of container
+
+    Returns:
+        The parsed value and whether it had to be repaired
+
+    Raises:
+        JSONRepairError: If no JSON value can be recovered
+    """
+    try:
+        value = json.loads(text)
+        if expected is None or isinstance(value, expected):
+            return value, False
+    except json.JSONDecodeError:
+        pass
+
+    openers = {dict: "{", list: "["}.get(expected, "{[")
+    start = next((i for i, char in enumerate(text) if char in openers), None)
+    if start is None:
+        raise JSONRepairError("No JSON object or array found in response")
+
+    parser = _TolerantParser(text[start:])
+    try:
+        value = parser.parse_value()
+    except _Truncated as e:
+        if not isinstance(e.partial, (dict, list)):
+            raise JSONRepairError("Response was truncated before any complete value")
+        logger.debug("Closed truncated JSON response at its last complete element")
+        value = e.partial[:e.complete] if isinstance(e.partial, list) else e.partial
+    return value, True
@@ -1,15 +1,47 @@
-from fastapi import FastAPI, HTTPException, Depends, Response, status
+from fastapi import FastAPI, HTTPException, Depends, Header, Query, Request, Response, status
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
-from api_models import ProductRequest, ProductResponse, HealthResponse, EnhancedProductResponse
+from fastapi.responses import StreamingResponse
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from starlette.routing import Match
+from admission import AdmissionController, AdmissionRejected, Priority, set_priority
+from api_models import (
+    ProductRequest, ProductResponse, HealthResponse, EnhancedProductResponse,
+    BatchProductRequest, BatchProductResponse, EnhancedBatchProductResponse,
+    EnhancedField, EnhancedProductRequest, EnhancedBatchProductRequest,
+    JobMode, JobRequest, JobResponse, JobResultsResponse
+)
+from categorizer import ProductCategorizer, ProductNotFoundError, PROMPT_EXAMPLES, PROMPT_VARIABLES
+from config import settings
+from deadline import Deadline, DeadlineExceeded, item_deadline, start_deadline
+from facet_matcher import FacetMatcher
 from gemini_client import GeminiClient
+from jobs import COMPLETED, JobItem, JobStore, JobWorkers
+from model_router import ModelRouter
+from metrics import (
+    MULTIPROC_DIR_ENV, REQUEST_LATENCY, REQUESTS_IN_FLIGHT, exposition_registry, mark_worker_stopped, register_stats,
+    server_timing_header, start_request_timings
+)
+from prompt_builder import PromptBuilder
 from prompt_loader import PromptLoader
 from woolworths_client import WoolworthsClient
+from product_store import ProductSnapshotStore
 from product_utils import ProductDataExtractor
+from result_cache import ResultCache, CacheMode, cache_status
+from similarity_cache import SimilarityCache
+import asyncio
+import json
 import logging
+import math
+import os
+import shutil
+import tempfile
+from contextlib import asynccontextmanager
 from functools import lru_cache
+from pathlib import Path
 import uvicorn
 import time
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, List, Callable, Awaitable, AsyncIterator, TypeVar
 
 # Configure logging
 logging.basicConfig(
@@ -18,10 +50,42 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Preload prompts, open shared upstream connections and start job workers on startup."""
+    get_prompt_loader().preload(PROMPT_VARIABLES)
+    get_prompt_builder().preload()
+    get_facet_matcher()
+    woolworths_client = get_woolworths_client()
+    await woolworths_client.start()
+    job_workers = get_job_workers()
+    if job_workers is not None:
+        job_workers.start()
+    register_component_metrics()
+    try:
+        yield
+    finally:
+        if job_workers is not None:
+            await job_workers.stop()
+            job_workers.store.close()
+        await woolworths_client.close()
+        if woolworths_client.snapshots is not None:
+            woolworths_client.snapshots.close()
+        result_cache = get_result_cache()
+        if result_cache is not None:
+            result_cache.close()
+        similarity_cache = get_similarity_cache()
+        if similarity_cache is not None:
+            similarity_cache.close()
+        mark_worker_stopped()
+
 app = FastAPI(
     title="Product Categorization API",
     description="API for categorizing Woolworths products using Gemini AI",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Add CORS middleware for API access
@@ -33,61 +97,463 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# JSON structure for the response
-JSON_STRUCTURE = {
-    "type": "string",
-    "variety": ["string"]
-}
-
-# JSON structure for enhanced response
-ENHANCED_JSON_STRUCTURE = {
-    "type": "string",
-    "variety": ["string"],
-    "dietary_attributes": ["string"],
-    "flavor_profile": ["string"],
-    "usage_occasions": ["string"],
-    "health_benefits": ["string"],
-    "certifications": ["string"],
-    "texture": ["string"],
-    "ingredients_highlight": ["string"],
-    "serving_suggestions": ["string"],
-    "pairings": ["string"]
-}
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Record request latency and in-flight metrics and add a Server-Timing header."""
+    endpoint = "unmatched"
+    for route in request.app.router.routes:
+        if route.matches(request.scope)[0] == Match.FULL:
+            endpoint = route.path
+            break
+    
+    timings = start_request_timings()
+    start_time = time.perf_counter()
+    status_code = 500
+    try:
+        with REQUESTS_IN_FLIGHT.labels(endpoint).track_inprogress():
+            response = await call_next(request)
+        status_code = response.status_code
+    finally:
+        elapsed = time.perf_counter() - start_time
+        REQUEST_LATENCY.labels(endpoint, str(status_code)).observe(elapsed)
+    
+    response.headers["Server-Timing"] = server_timing_header(timings, elapsed)
+    return response
 
 # Dependency injection for shared components
 @lru_cache(maxsize=1)
 def get_prompt_loader():
-    return PromptLoader()
+    return PromptLoader(reload_interval=settings.prompt_reload_interval)
+
+@lru_cache(maxsize=1)
+def get_prompt_builder():
+    return PromptBuilder(get_prompt_loader(), PROMPT_EXAMPLES, settings.prompt_token_budget)
+
+@lru_cache(maxsize=1)
+def get_admission_controller() -> Optional[AdmissionController]:
+    if not settings.admission_control_enabled:
+        return None
+    # The limits are for the whole service, so each worker process gets its share
+    return AdmissionController(
+        max(1, math.ceil(settings.llm_max_in_flight / settings.web_concurrency)),
+        math.ceil(settings.llm_max_queue / settings.web_concurrency)
+    )
 
 @lru_cache(maxsize=1)
 def get_gemini_client():
-    return GeminiClient()
+    return GeminiClient(admission=get_admission_controller())
+
+@lru_cache(maxsize=1)
+def get_fast_gemini_client() -> Optional[GeminiClient]:
+    if settings.model_routing_policy != "escalate":
+        return None
+    return GeminiClient(model_name=settings.fast_model_name, admission=get_admission_controller())
+
+def get_model_router(
+    gemini_client: GeminiClient = Depends(get_gemini_client),
+    fast_gemini_client: Optional[GeminiClient] = Depends(get_fast_gemini_client)
+) -> ModelRouter:
+    tiers = [gemini_client] if fast_gemini_client is None else [fast_gemini_client, gemini_client]
+    return ModelRouter(tiers, settings.escalation_min_confidence)
+
+@lru_cache(maxsize=1)
+def get_product_store() -> Optional[ProductSnapshotStore]:
+    if not settings.product_store_enabled:
+        return None
+    return ProductSnapshotStore(settings.product_store_db_path)
 
 @lru_cache(maxsize=1)
 def get_woolworths_client():
-    return WoolworthsClient()
+    return WoolworthsClient(snapshots=get_product_store())
 
 # Additional dependency for product data extractor
 @lru_cache(maxsize=1)
 def get_product_data_extractor():
     return ProductDataExtractor()
 
-@app.post("/categorize", response_model=ProductResponse)
+@lru_cache(maxsize=1)
+def get_result_cache() -> Optional[ResultCache]:
+    if not settings.cache_enabled:
+        return None
+    return ResultCache(
+        memory_max_entries=settings.cache_memory_max_entries,
+        memory_ttl=settings.cache_memory_ttl,
+        db_path=settings.cache_db_path,
+        disk_ttl=settings.cache_disk_ttl,
+        fingerprint_ttl=settings.cache_fingerprint_ttl
+    )
+
+@lru_cache(maxsize=1)
+def get_similarity_cache() -> Optional[SimilarityCache]:
+    if not settings.similarity_cache_enabled:
+        return None
+    return SimilarityCache(
+        threshold=settings.similarity_threshold,
+        max_entries=settings.similarity_max_entries,
+        db_path=settings.similarity_db_path,
+        ttl=settings.cache_disk_ttl,
+        sync_interval=settings.similarity_sync_interval if settings.multi_worker else 0.0
+    )
+
+@lru_cache(maxsize=1)
+def get_facet_matcher() -> Optional[FacetMatcher]:
+    if not settings.facet_fast_path_enabled:
+        return None
+    facets_path = Path(__file__).parent / settings.facets_path
+    if not facets_path.exists():
+        logger.warning(f"Facets file not found: {facets_path}; facet fast path disabled")
+        return None
+    return FacetMatcher.from_csv(facets_path)
+
+@lru_cache(maxsize=1)
+def get_job_store() -> Optional[JobStore]:
+    if not settings.jobs_enabled:
+        return None
+    return JobStore(settings.jobs_db_path)
+
+@lru_cache(maxsize=1)
+def get_job_workers() -> Optional[JobWorkers]:
+    job_store = get_job_store()
+    if job_store is None:
+        return None
+    return JobWorkers(job_store, categorize_job_item, item_error, settings.job_workers)
+
+def register_component_metrics() -> None:
+    """Export the counters of the shared components on /metrics."""
+    woolworths_client = get_woolworths_client()
+    gemini_client = get_gemini_client()
+    
+    register_stats("woolworths_single_flight", woolworths_client.product_flights.stats,
+                   counters=["executed", "coalesced"])
+    register_stats("gemini_single_flight", gemini_client.prompt_flights.stats,
+                   counters=["executed", "coalesced"])
+    if woolworths_client.rate_limiter is not None:
+        register_stats("woolworths_rate_limiter", woolworths_client.rate_limiter.stats,
+                       counters=["throttles", "wait_seconds"])
+    if gemini_client.rate_limiter is not None:
+        register_stats("gemini_rate_limiter", gemini_client.rate_limiter.stats,
+                       counters=["throttles", "wait_seconds"])
+    if woolworths_client.snapshots is not None:
+        register_stats("product_store", woolworths_client.snapshot_stats,
+                       counters=["writes", "unchanged_refreshes", "hits", "stale_hits", "misses", "refreshes",
+                                 "refresh_failures"])
+    
+    fast_gemini_client = get_fast_gemini_client()
+    if fast_gemini_client is not None:
+        register_stats("gemini_fast_single_flight", fast_gemini_client.prompt_flights.stats,
+                       counters=["executed", "coalesced"])
+        if fast_gemini_client.rate_limiter is not None:
+            register_stats("gemini_fast_rate_limiter", fast_gemini_client.rate_limiter.stats,
+                           counters=["throttles", "wait_seconds"])
+    
+    admission_controller = get_admission_controller()
+    if admission_controller is not None:
+        register_stats("llm_admission", admission_controller.stats,
+                       counters=[f"{kind}_{priority.name.lower()}"
+                                 for kind in ("admitted", "rejected") for priority in Priority] + ["shed"])
+    
+    job_workers = get_job_workers()
+    if job_workers is not None:
+        register_stats("jobs", job_workers.stats, counters=["items_succeeded", "items_failed", "items_requeued"])
+    
+    result_cache = get_result_cache()
+    if result_cache is not None:
+        register_stats("result_cache", result_cache.stats,
+                       counters=["memory_hits", "disk_hits", "misses", "memory_evictions", "memory_expirations",
+                                 "revalidated_unchanged", "revalidated_changed", "revalidated_new"])
+    
+    similarity_cache = get_similarity_cache()
+    if similarity_cache is not None:
+        register_stats("similarity_cache", similarity_cache.stats,
+                       counters=["lookups", "hits", "evictions", "synced"])
+    
+    facet_matcher = get_facet_matcher()
+    if facet_matcher is not None:
+        register_stats("facet_fast_path", facet_matcher.stats, counters=["lookups", "hits"])
+
+def get_product_categorizer(
+    woolworths_client: WoolworthsClient = Depends(get_woolworths_client),
+    model_router: ModelRouter = Depends(get_model_router),
+    prompt_loader: PromptLoader = Depends(get_prompt_loader),
+    product_extractor: ProductDataExtractor = Depends(get_product_data_extractor),
+    result_cache: Optional[ResultCache] = Depends(get_result_cache),
+    facet_matcher: Optional[FacetMatcher] = Depends(get_facet_matcher),
+    similarity_cache: Optional[SimilarityCache] = Depends(get_similarity_cache),
+    prompt_builder: PromptBuilder = Depends(get_prompt_builder)
+) -> ProductCategorizer:
+    return ProductCategorizer(woolworths_client, model_router, prompt_loader, product_extractor, result_cache,
+                              facet_matcher, similarity_cache, prompt_builder)
+
+def get_cache_mode(x_cache_control: Optional[str] = Header(
+    None, description="Set to 'bypass' to skip the result cache, 'refresh' to recompute and store the result, "
+                      "or 'revalidate' to reuse a cached result only if the product data it was computed from is unchanged"
+)) -> CacheMode:
+    if x_cache_control is None:
+        return CacheMode.USE
+    try:
+        return CacheMode(x_cache_control.strip().lower())
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid X-Cache-Control header: {x_cache_control}"
+        )
+
+def request_deadline_dependency(default_timeout: float) -> Callable[..., Awaitable[Optional[Deadline]]]:
+    """Build a dependency that starts the request's deadline and retry budget.
+    
+    Args:
+        default_timeout: Deadline in seconds when the client sends no
+            X-Request-Timeout header; 0 means no deadline
+    """
+    async def start_request_deadline(x_request_timeout: Optional[float] = Header(
+        None, description="Seconds the client will wait for the response; work stops once they have passed"
+    )) -> Optional[Deadline]:
+        if x_request_timeout is not None and x_request_timeout <= 0:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Invalid X-Request-Timeout header: {x_request_timeout}"
+            )
+        timeout = default_timeout if x_request_timeout is None else x_request_timeout
+        if settings.request_deadline_max > 0:
+            timeout = min(timeout, settings.request_deadline_max)
+        deadline = Deadline(timeout, settings.retry_budget) if timeout > 0 else None
+        start_deadline(deadline)
+        return deadline
+    
+    return start_request_deadline
+
+get_request_deadline = request_deadline_dependency(settings.request_deadline)
+get_batch_request_deadline = request_deadline_dependency(settings.batch_request_deadline)
+
+async def use_bulk_priority() -> None:
+    """Admit the request's LLM calls after those of interactive requests."""
+    set_priority(Priority.BULK)
+
+def requested_fields(fields: Optional[List[EnhancedField]]) -> Optional[List[str]]:
+    """Names of the enhanced fields a request asks for; None means all of them."""
+    return None if fields is None else [field.value for field in fields]
+
+def to_http_exception(e: Exception) -> HTTPException:
+    """Map an exception raised while categorizing to an HTTPException."""
+    if isinstance(e, HTTPException):
+        return e
+    if isinstance(e, ProductNotFoundError):
+        return HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+    if isinstance(e, DeadlineExceeded):
+        return HTTPException(status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail=str(e))
+    if isinstance(e, AdmissionRejected):
+        return HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    if isinstance(e, TypeError):
+        return HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+    if isinstance(e, ValueError):
+        return HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    return HTTPException(
+        status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+        detail=f"Internal server error: {str(e)}"
+    )
+
+def check_batch_size(product_ids: List[str]) -> None:
+    """Reject batches larger than the configured maximum size."""
+    if len(product_ids) > settings.batch_max_size:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Batch size {len(product_ids)} exceeds maximum of {settings.batch_max_size}"
+        )
+
+def item_error(e: Exception) -> Dict[str, Any]:
+    """Describe the failure of one item of a batch or job."""
+    http_error = to_http_exception(e)
+    return {"status_code": http_error.status_code, "detail": str(http_error.detail)}
+
+def batch_item(product_id: str, outcome: Any) -> Dict[str, Any]:
+    """Build a batch result entry from a result or the exception raised."""
+    if not isinstance(outcome, Exception):
+        return {"product_id": product_id, "result": outcome}
+    
+    error = item_error(outcome)
+    logger.warning(f"Batch item {product_id} failed with {error['status_code']}: {error['detail']}")
+    return {"product_id": product_id, "error": error}
+
+async def categorize_item(categorize: Callable[[str], Awaitable[Any]], product_id: str) -> Any:
+    """Categorize one item of a batch with its own retry budget."""
+    with item_deadline():
+        return await categorize(product_id)
+
+async def run_batch(product_ids: List[str], categorize: Callable[[str], Awaitable[Any]]) -> List[Dict[str, Any]]:
+    """Categorize many products concurrently with a bounded number in flight.
+    
+    Args:
+        product_ids: Product IDs to categorize
+        categorize: Coroutine function categorizing a single product ID
+        
+    Returns:
+        Per-item result dictionaries in request order; failures are recorded
+        as errors instead of failing the whole batch
+        
+    Raises:
+        HTTPException: If the batch exceeds the configured maximum size
+    """
+    check_batch_size(product_ids)
+    semaphore = asyncio.Semaphore(settings.batch_concurrency)
+    
+    async def run_one(product_id: str) -> Dict[str, Any]:
+        async with semaphore:
+            try:
+                return batch_item(product_id, await categorize_item(categorize, product_id))
+            except Exception as e:
+                return batch_item(product_id, e)
+    
+    return await asyncio.gather(*(run_one(product_id) for product_id in product_ids))
+
+async def run_packed_batch(product_ids: List[str],
+                           categorizer: ProductCategorizer,
+                           enhanced: bool,
+                           cache_mode: CacheMode,
+                           fields: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    """Categorize many products using packed multi-product LLM prompts.
+    
+    Args:
+        product_ids: Product IDs to categorize
+        categorizer: Product categorizer to use
+        enhanced: Produce enhanced rather than basic categorizations
+        cache_mode: How the batch interacts with the result cache
+        fields: Enhanced fields to return besides type and variety
+            (defaults to all of them)
+        
+    Returns:
+        Per-item result dictionaries in request order
+        
+    Raises:
+        HTTPException: If the batch exceeds the configured maximum size
+    """
+    check_batch_size(product_ids)
+    outcomes = await categorizer.categorize_packed(product_ids, enhanced, cache_mode, fields)
+    return [batch_item(product_id, outcomes[product_id]) for product_id in product_ids]
+
+async def stream_batch(product_ids: List[str],
+                       categorize: Callable[[str], Awaitable[Any]]) -> AsyncIterator[Dict[str, Any]]:
+    """Categorize products concurrently, yielding each result as it completes.
+    
+    At most BATCH_CONCURRENCY products are in flight, and new products are
+    only started once the consumer has taken a finished result, so a slow
+    client throttles the upstream work and memory stays flat. If the
+    consumer stops iterating (e.g. the client disconnected), all outstanding
+    work is cancelled.
+    
+    Args:
+        product_ids: Product IDs to categorize
+        categorize: Coroutine function categorizing a single product ID
+        
+    Yields:
+        Per-item result dictionaries, with the item's request index, in
+        completion order
+    """
+    remaining = iter(enumerate(product_ids))
+    in_flight: Dict["asyncio.Task[Any]", int] = {}
+    
+    def start_next() -> None:
+        while len(in_flight) < settings.batch_concurrency:
+            try:
+                index, product_id = next(remaining)
+            except StopIteration:
+                return
+            in_flight[asyncio.ensure_future(categorize_item(categorize, product_id))] = index
+    
+    try:
+        start_next()
+        while in_flight:
+            done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                index = in_flight.pop(task)
+                outcome = task.exception() or task.result()
+                yield {"index": index, **batch_item(product_ids[index], outcome)}
+            start_next()
+    finally:
+        for task in in_flight:
+            task.cancel()
+        if in_flight:
+            logger.info(f"Cancelled {len(in_flight)} outstanding items of an abandoned stream")
+
+def streaming_response(request: Request, items: AsyncIterator[Dict[str, Any]]) -> StreamingResponse:
+    """Encode streamed batch items as NDJSON, or as SSE if the client asks for it."""
+    if "text/event-stream" in request.headers.get("accept", ""):
+        async def events() -> AsyncIterator[str]:
+            succeeded = failed = 0
+            async for item in items:
+                if "error" in item:
+                    failed += 1
+                else:
+                    succeeded += 1
+                yield f"event: result\ndata: {json.dumps(jsonable_encoder(item))}\n\n"
+            yield f"event: done\ndata: {json.dumps({'succeeded': succeeded, 'failed': failed})}\n\n"
+        
+        return StreamingResponse(events(), media_type="text/event-stream",
+                                 headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    
+    async def lines() -> AsyncIterator[str]:
+        async for item in items:
+            yield json.dumps(jsonable_encoder(item)) + "\n"
+    
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+def shared(factory: Callable[[], T]) -> T:
+    """Return a shared component outside of a request, honouring dependency overrides."""
+    return app.dependency_overrides.get(factory, factory)()
+
+async def categorize_job_item(item: JobItem) -> Dict[str, Any]:
+    """Categorize one product of a job with the shared components.
+    
+    Each item gets its own REQUEST_DEADLINE and retry budget.
+    """
+    timeout = settings.request_deadline
+    start_deadline(Deadline(timeout, settings.retry_budget) if timeout > 0 else None)
+    categorizer = get_product_categorizer(
+        shared(get_woolworths_client),
+        get_model_router(shared(get_gemini_client), shared(get_fast_gemini_client)),
+        shared(get_prompt_loader),
+        shared(get_product_data_extractor),
+        shared(get_result_cache),
+        shared(get_facet_matcher),
+        shared(get_similarity_cache),
+        shared(get_prompt_builder)
+    )
+    if item.mode == JobMode.enhanced.value:
+        result = await categorizer.categorize_enhanced(item.product_id, CacheMode.USE, item.fields)
+    else:
+        result = await categorizer.categorize(item.product_id, CacheMode.USE)
+    return result.model_dump()
+
+def require_job_store(job_store: Optional[JobStore] = Depends(get_job_store)) -> JobStore:
+    if job_store is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Jobs are disabled")
+    return job_store
+
+async def find_job(job_id: str, job_store: JobStore) -> Dict[str, Any]:
+    """Look up a job, raising 404 if it doesn't exist."""
+    job = await asyncio.to_thread(job_store.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Job not found: {job_id}")
+    return job
+
+@app.post("/categorize", response_model=ProductResponse,
+          dependencies=[Depends(get_request_deadline)])
 async def categorize_product(
     request: ProductRequest,
     response: Response,
-    woolworths_client: WoolworthsClient = Depends(get_woolworths_client),
-    gemini_client: GeminiClient = Depends(get_gemini_client),
-    prompt_loader: PromptLoader = Depends(get_prompt_loader)
+    categorizer: ProductCategorizer = Depends(get_product_categorizer),
+    cache_mode: CacheMode = Depends(get_cache_mode)
 ):
     """Categorize a Woolworths product using Gemini AI.
     
     Args:
         request: Product request containing product_id
         response: FastAPI response object
-        woolworths_client: Injected Woolworths client
-        gemini_client: Injected Gemini client
-        prompt_loader: Injected prompt loader
+        categorizer: Injected product categorizer
+        cache_mode: Result cache behaviour from the X-Cache-Control header
         
     Returns:
         ProductResponse with categorization information
@@ -95,123 +561,286 @@ async def categorize_product(
     Raises:
         HTTPException: For various error conditions
     """
-    start_time = time.time()
+    start_time = time.perf_counter()
     logger.info(f"Received categorization request for product ID: {request.product_id}")
     
     try:
-        # Fetch product details from Woolworths
-        product_details = await woolworths_client.get_product_details(request.product_id)
+        result = await categorizer.categorize(request.product_id, cache_mode)
+        response.headers["X-Cache"] = cache_status.get() or "MISS"
         
-        # Handle the Product wrapper
-        if isinstance(product_details, dict):
-            product_data = product_details.get("Product", {})
-            display_name = product_data.get("DisplayName")
-            
-            if not display_name:
-                logger.error(f"Missing DisplayName in product data: {product_data}")
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND,
-                    detail="Product not found or missing display name"
-                )
-            
-            # Load and format prompt
-            prompt = prompt_loader.load_prompt(
-                "category_prompt",
-                variables={"product_name": display_name}
-            )
-            
-            # Process with Gemini
-            model_response = await gemini_client.process_prompt(prompt, JSON_STRUCTURE)
-            
-            # Add processing time header
-            processing_time = time.time() - start_time
-            response.headers["X-Processing-Time"] = f"{processing_time:.3f}"
-            logger.info(f"Request completed in {processing_time:.3f}s")
-            
-            return ProductResponse(**model_response.response)
-        else:
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Unexpected response format from Woolworths API"
-            )
+        # Add processing time header
+        processing_time = time.perf_counter() - start_time
+        response.headers["X-Processing-Time"] = f"{processing_time:.3f}"
+        logger.info(f"Request completed in {processing_time:.3f}s")
+        
+        return result
     
-    except ValueError as e:
-        logger.error(f"Validation error: {str(e)}")
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=str(e)
-        )
     except Exception as e:
         logger.error(f"Error processing request: {str(e)}")
-        if isinstance(e, HTTPException):
-            raise e
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, 
-            detail=f"Internal server error: {str(e)}"
-        )
+        raise to_http_exception(e)
 
 @app.post("/categorize/enhanced", response_model=EnhancedProductResponse, 
           summary="Enhanced product categorization",
-          description="Categorize a product with rich attributes for improved search relevance")
+          description="Categorize a product with rich attributes for improved search relevance",
+          dependencies=[Depends(get_request_deadline)])
 async def enhanced_categorize_product(
-    request: ProductRequest,
+    request: EnhancedProductRequest,
     response: Response,
-    woolworths_client: WoolworthsClient = Depends(get_woolworths_client),
-    gemini_client: GeminiClient = Depends(get_gemini_client),
-    prompt_loader: PromptLoader = Depends(get_prompt_loader),
-    product_extractor: ProductDataExtractor = Depends(get_product_data_extractor)
+    categorizer: ProductCategorizer = Depends(get_product_categorizer),
+    cache_mode: CacheMode = Depends(get_cache_mode)
 ):
     """Enhanced categorization of a Woolworths product using Gemini AI.
     
     Returns rich product attributes including type, variety, dietary attributes,
     flavor profile, usage occasions, health benefits, certifications, texture,
-    ingredients highlight, serving suggestions, and food/drink pairings.
+    ingredients highlight, serving suggestions, and food/drink pairings. Set
+    `fields` to generate and return only some of them besides type and variety.
     """
-    start_time = time.time()
+    start_time = time.perf_counter()
     logger.info(f"Received enhanced categorization request for product ID: {request.product_id}")
     
     try:
-        # Fetch product details from Woolworths
-        product_details = await woolworths_client.get_product_details(request.product_id)
-        
-        # Extract product data for enhanced prompt
-        extracted_data = product_extractor.extract_product_data(product_details)
-        
-        if not extracted_data:
-            raise ValueError(f"Could not extract data for product ID: {request.product_id}")
-            
-        logger.debug(f"Extracted product data: {extracted_data}")
-        
-        # Load and format prompt with extracted data
-        prompt = prompt_loader.load_prompt(
-            "enhanced_category_prompt",
-            variables=extracted_data
-        )
-        
-        # Process with Gemini
-        model_response = await gemini_client.process_prompt(prompt, ENHANCED_JSON_STRUCTURE)
+        result = await categorizer.categorize_enhanced(request.product_id, cache_mode, requested_fields(request.fields))
+        response.headers["X-Cache"] = cache_status.get() or "MISS"
         
         # Add processing time header
-        processing_time = time.time() - start_time
+        processing_time = time.perf_counter() - start_time
         response.headers["X-Processing-Time"] = f"{processing_time:.3f}"
         logger.info(f"Enhanced categorization completed in {processing_time:.3f}s")
         
-        return EnhancedProductResponse(**model_response.response)
+        return result
+    
+    except Exception as e:
+        logger.error(f"Error in enhanced categorization: {str(e)}")
+        raise to_http_exception(e)
+
+@app.post("/categorize/batch", response_model=BatchProductResponse,
+          summary="Batch product categorization",
+          description="Categorize many products in one call; failures are reported per item",
+          dependencies=[Depends(get_batch_request_deadline), Depends(use_bulk_priority)])
+async def batch_categorize_products(
+    request: BatchProductRequest,
+    response: Response,
+    categorizer: ProductCategorizer = Depends(get_product_categorizer),
+    cache_mode: CacheMode = Depends(get_cache_mode)
+):
+    """Categorize a batch of Woolworths products using Gemini AI.
+    
+    Products are processed concurrently, bounded by the BATCH_CONCURRENCY
+    setting. A failing product is reported in its own result entry and does
+    not fail the rest of the batch. With `packed` set, several products are
+    categorized per LLM call.
+    """
+    start_time = time.perf_counter()
+    logger.info(f"Received batch categorization request for {len(request.product_ids)} products")
+    
+    if request.packed:
+        results = await run_packed_batch(request.product_ids, categorizer, False, cache_mode)
+    else:
+        results = await run_batch(
+            request.product_ids,
+            lambda product_id: categorizer.categorize(product_id, cache_mode)
+        )
+    failed = sum(1 for item in results if "error" in item)
+    
+    processing_time = time.perf_counter() - start_time
+    response.headers["X-Processing-Time"] = f"{processing_time:.3f}"
+    logger.info(f"Batch of {len(results)} completed in {processing_time:.3f}s ({failed} failed)")
     
-    except ValueError as e:
-        logger.error(f"Validation error in enhanced categorization: {str(e)}")
+    return BatchProductResponse(
+        results=results,
+        succeeded=len(results) - failed,
+        failed=failed
+    )
+
+@app.post("/categorize/enhanced/batch", response_model=EnhancedBatchProductResponse,
+          summary="Batch enhanced product categorization",
+          description="Categorize many products with rich attributes; failures are reported per item",
+          dependencies=[Depends(get_batch_request_deadline), Depends(use_bulk_priority)])
+async def batch_enhanced_categorize_products(
+    request: EnhancedBatchProductRequest,
+    response: Response,
+    categorizer: ProductCategorizer = Depends(get_product_categorizer),
+    cache_mode: CacheMode = Depends(get_cache_mode)
+):
+    """Enhanced categorization of a batch of Woolworths products using Gemini AI.
+    
+    Products are processed concurrently, bounded by the BATCH_CONCURRENCY
+    setting. A failing product is reported in its own result entry and does
+    not fail the rest of the batch. With `packed` set, several products are
+    categorized per LLM call.
+    """
+    start_time = time.perf_counter()
+    logger.info(f"Received batch enhanced categorization request for {len(request.product_ids)} products")
+    fields = requested_fields(request.fields)
+    
+    if request.packed:
+        results = await run_packed_batch(request.product_ids, categorizer, True, cache_mode, fields)
+    else:
+        results = await run_batch(
+            request.product_ids,
+            lambda product_id: categorizer.categorize_enhanced(product_id, cache_mode, fields)
+        )
+    failed = sum(1 for item in results if "error" in item)
+    
+    processing_time = time.perf_counter() - start_time
+    response.headers["X-Processing-Time"] = f"{processing_time:.3f}"
+    logger.info(f"Enhanced batch of {len(results)} completed in {processing_time:.3f}s ({failed} failed)")
+    
+    return EnhancedBatchProductResponse(
+        results=results,
+        succeeded=len(results) - failed,
+        failed=failed
+    )
+
+@app.post("/categorize/stream",
+          summary="Streaming batch product categorization",
+          description="Stream each product's categorization as NDJSON lines (or SSE events) as soon as it completes",
+          dependencies=[Depends(get_batch_request_deadline), Depends(use_bulk_priority)])
+async def stream_categorize_products(
+    request: BatchProductRequest,
+    http_request: Request,
+    categorizer: ProductCategorizer = Depends(get_product_categorizer),
+    cache_mode: CacheMode = Depends(get_cache_mode)
+):
+    """Categorize a batch of products, streaming results as they complete.
+    
+    Each line (or SSE `result` event) has the shape of a `/categorize/batch`
+    result entry plus the item's `index` in the request. Results arrive in
+    completion order. Send `Accept: text/event-stream` for SSE.
+    """
+    check_batch_size(request.product_ids)
+    if request.packed:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail=str(e)
+            detail="Packed categorization is not supported for streaming requests"
         )
-    except Exception as e:
-        logger.error(f"Error in enhanced categorization: {str(e)}")
-        if isinstance(e, HTTPException):
-            raise e
+    
+    logger.info(f"Received streaming categorization request for {len(request.product_ids)} products")
+    items = stream_batch(
+        request.product_ids,
+        lambda product_id: categorizer.categorize(product_id, cache_mode)
+    )
+    return streaming_response(http_request, items)
+
+@app.post("/categorize/enhanced/stream",
+          summary="Streaming batch enhanced product categorization",
+          description="Stream each product's enhanced categorization as NDJSON lines (or SSE events) as soon as it completes",
+          dependencies=[Depends(get_batch_request_deadline), Depends(use_bulk_priority)])
+async def stream_enhanced_categorize_products(
+    request: EnhancedBatchProductRequest,
+    http_request: Request,
+    categorizer: ProductCategorizer = Depends(get_product_categorizer),
+    cache_mode: CacheMode = Depends(get_cache_mode)
+):
+    """Enhanced categorization of a batch of products, streaming results as they complete.
+    
+    Each line (or SSE `result` event) has the shape of a
+    `/categorize/enhanced/batch` result entry plus the item's `index` in the
+    request. Results arrive in completion order. Send
+    `Accept: text/event-stream` for SSE.
+    """
+    check_batch_size(request.product_ids)
+    if request.packed:
         raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, 
-            detail=f"Internal server error: {str(e)}"
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Packed categorization is not supported for streaming requests"
         )
+    
+    logger.info(f"Received streaming enhanced categorization request for {len(request.product_ids)} products")
+    fields = requested_fields(request.fields)
+    items = stream_batch(
+        request.product_ids,
+        lambda product_id: categorizer.categorize_enhanced(product_id, cache_mode, fields)
+    )
+    return streaming_response(http_request, items)
+
+@app.post("/jobs", response_model=JobResponse, status_code=status.HTTP_202_ACCEPTED,
+          summary="Queue a categorization job",
+          description="Categorize many products in the background; poll the job for progress and page through its results")
+async def create_job(
+    request: JobRequest,
+    response: Response,
+    job_store: JobStore = Depends(require_job_store),
+    job_workers: Optional[JobWorkers] = Depends(get_job_workers)
+):
+    """Queue an asynchronous categorization job.
+    
+    The job is stored durably and processed by the in-process worker pool
+    (JOB_WORKERS products at a time) at bulk priority. Jobs interrupted by a
+    restart resume where they stopped.
+    """
+    if len(request.product_ids) > settings.job_max_size:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Job size {len(request.product_ids)} exceeds maximum of {settings.job_max_size}"
+        )
+    
+    job = await asyncio.to_thread(
+        job_store.create, request.product_ids, request.mode.value, requested_fields(request.fields)
+    )
+    if job_workers is not None:
+        job_workers.notify()
+    logger.info(f"Queued job {job['job_id']} with {job['total']} products ({request.mode.value})")
+    response.headers["Location"] = f"/jobs/{job['job_id']}"
+    return job
+
+@app.get("/jobs/{job_id}", response_model=JobResponse)
+async def get_job(job_id: str, job_store: JobStore = Depends(require_job_store)):
+    """Status and progress of a job."""
+    return await find_job(job_id, job_store)
+
+@app.get("/jobs/{job_id}/results", response_model=JobResultsResponse)
+async def get_job_results(
+    job_id: str,
+    http_request: Request,
+    offset: int = Query(0, ge=0, description="Number of finished products to skip"),
+    limit: int = Query(100, ge=1, le=1000, description="Maximum number of products to return"),
+    stream: bool = Query(False, description="Stream all results from `offset` until the job completes"),
+    job_store: JobStore = Depends(require_job_store)
+):
+    """Results of a job's finished products, in completion order.
+    
+    Pages are stable while the job runs: request the next page from
+    `next_offset` until the job is completed and a page comes back empty.
+    With `stream=true` the results are streamed as NDJSON lines (or SSE
+    events with `Accept: text/event-stream`) as products finish, until the
+    job completes. Each result has the shape of a batch result entry plus
+    the product's `index` in the job request.
+    """
+    job = await find_job(job_id, job_store)
+    if not stream:
+        results = await asyncio.to_thread(job_store.results, job_id, offset, limit)
+        return {"job_id": job_id, "status": job["status"], "results": results, "next_offset": offset + len(results)}
+    
+    async def follow() -> AsyncIterator[Dict[str, Any]]:
+        position = offset
+        while True:
+            finished = (await asyncio.to_thread(job_store.get, job_id))["status"] == COMPLETED
+            results = await asyncio.to_thread(job_store.results, job_id, position, limit)
+            for result in results:
+                yield result
+            position += len(results)
+            if not results:
+                if finished:
+                    return
+                await asyncio.sleep(1.0)
+    
+    return streaming_response(http_request, follow())
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus metrics: per-stage latencies, retries, cache stats and in-flight gauges."""
+    # Component stats read SQLite, so collect them off the event loop
+    output = await asyncio.to_thread(generate_latest, exposition_registry())
+    return Response(output, media_type=CONTENT_TYPE_LATEST)
+
+@app.get("/cache/stats")
+async def cache_stats(result_cache: Optional[ResultCache] = Depends(get_result_cache)) -> Dict[str, Any]:
+    """Hit, miss and eviction counters of the result cache."""
+    if result_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **(await asyncio.to_thread(result_cache.stats))}
 
 @app.get("/health", response_model=HealthResponse)
 async def health_check():
@@ -222,5 +851,37 @@ async def health_check():
         timestamp=int(time.time())
     )
 
+def prepare_multiprocess_metrics() -> Optional[str]:
+    """Point worker processes at an empty directory for their metric files.
+
+    Returns:
+        The directory, if a temporary one was created
+    """
+    metrics_dir = os.environ.get(MULTIPROC_DIR_ENV)
+    if metrics_dir is None:
+        metrics_dir = tempfile.mkdtemp(prefix="prometheus-")
+        os.environ[MULTIPROC_DIR_ENV] = metrics_dir
+        return metrics_dir
+    # Files left by a previous run would be added to this run's metrics
+    Path(metrics_dir).mkdir(parents=True, exist_ok=True)
+    for stale in Path(metrics_dir).glob("*.db"):
+        stale.unlink()
+    return None
+
 if __name__ == "__main__":
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=False)
+    temporary_metrics_dir = None
+    if settings.multi_worker:
+        temporary_metrics_dir = prepare_multiprocess_metrics()
+        logger.info(f"Starting {settings.web_concurrency} worker processes")
+    try:
+        uvicorn.run(
+            "main:app",
+            host="0.0.0.0",
+            port=settings.port,
+            workers=settings.web_concurrency,
+            timeout_graceful_shutdown=settings.graceful_shutdown_timeout,
+            reload=False
+        )
+    finally:
+        if temporary_metrics_dir is not None:
+            shutil.rmtree(temporary_metrics_dir, ignore_errors=True)
@@ -0,0 +1,208 @@
+import logging
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Any, Iterable, Iterator, List, Optional, Tuple
+
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, multiprocess
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from prometheus_client.registry import Collector
+
+logger = logging.getLogger(__name__)
+
+# Set when several worker processes serve the API. Each process then writes
+# its metric values to files in this directory, and a scrape of any worker
+# reports the sum over all of them.
+MULTIPROC_DIR_ENV = "PROMETHEUS_MULTIPROC_DIR"
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+REQUEST_LATENCY = Histogram(
+    "categorization_request_seconds",
+    "End-to-end latency of API requests",
+    ["endpoint", "status"],
+    buckets=LATENCY_BUCKETS
+)
+STAGE_LATENCY = Histogram(
+    "categorization_stage_seconds",
+    "Latency of each categorization pipeline stage",
+    ["stage"],
+    buckets=LATENCY_BUCKETS
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    "categorization_requests_in_flight",
+    "API requests currently being processed",
+    ["endpoint"],
+    multiprocess_mode="livesum"
+)
+UPSTREAM_IN_FLIGHT = Gauge(
+    "categorization_upstream_in_flight",
+    "Upstream calls currently in progress",
+    ["upstream"],
+    multiprocess_mode="livesum"
+)
+UPSTREAM_RETRIES = Counter(
+    "categorization_upstream_retries_total",
+    "Retries of failed upstream calls",
+    ["upstream"]
+)
+UPSTREAM_RETRY_GIVEUPS = Counter(
+    "categorization_upstream_retry_giveups_total",
+    "Retries skipped because the request's deadline or retry budget could not cover them",
+    ["upstream", "reason"]
+)
+UPSTREAM_HEDGES = Counter(
+    "categorization_upstream_hedges_total",
+    "Duplicate requests sent after an upstream call was slow, by which request answered first",
+    ["upstream", "winner"]
+)
+PROMPT_TOKENS = Histogram(
+    "categorization_prompt_tokens",
+    "Estimated input tokens of each formatted prompt",
+    ["prompt"],
+    buckets=(50, 100, 200, 400, 600, 800, 1000, 1500, 2000, 3000, 5000, 10000)
+)
+LLM_OUTPUT_PARSES = Counter(
+    "categorization_llm_output_parses_total",
+    "Parses of LLM output by outcome: clean, repaired or failed",
+    ["outcome"]
+)
+MODEL_ROUTES = Counter(
+    "categorization_model_routes_total",
+    "Prompts (or packed products) handled by each model tier, by outcome: accepted, failed, "
+    "or the escalation reason (invalid, empty_type, low_confidence, error)",
+    ["model", "outcome"]
+)
+ADMISSION_WAIT = Histogram(
+    "categorization_admission_wait_seconds",
+    "Time LLM calls waited in the admission queue before running",
+    ["priority"],
+    buckets=LATENCY_BUCKETS
+)
+
+# Stage timings of the current request, reported in the Server-Timing header
+_request_timings: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar("request_timings", default=None)
+
+
+def start_request_timings() -> List[Tuple[str, float]]:
+    """Start collecting stage timings for the current request."""
+    timings: List[Tuple[str, float]] = []
+    _request_timings.set(timings)
+    return timings
+
+
+def server_timing_header(timings: List[Tuple[str, float]], total: float) -> str:
+    """Format collected stage timings as a Server-Timing header value."""
+    durations: Dict[str, float] = {}
+    for stage, duration in timings:
+        durations[stage] = durations.get(stage, 0.0) + duration
+    parts = [f"{stage};dur={duration * 1000:.1f}" for stage, duration in durations.items()]
+    parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
+
+
+@contextmanager
+def timed_stage(stage: str) -> Iterator[None]:
+    """Time a pipeline stage with a monotonic clock.
+
+    The duration is recorded in the stage histogram and, when called within
+    a request, added to that request's Server-Timing header.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        STAGE_LATENCY.labels(stage).observe(duration)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings.append((stage, duration))
+
+
+def record_retry(upstream: str) -> Callable[[Dict[str, Any]], None]:
+    """Build a backoff `on_backoff` handler that counts retries of an upstream."""
+    def handler(details: Dict[str, Any]) -> None:
+        UPSTREAM_RETRIES.labels(upstream).inc()
+        logger.warning(
+            f"Retrying {upstream} call {details['target'].__name__} "
+            f"(attempt {details['tries']}) in {details['wait']:.2f}s"
+        )
+    return handler
+
+
+def multiprocess_mode() -> bool:
+    return MULTIPROC_DIR_ENV in os.environ
+
+
+class StatsCollector(Collector):
+    """Exports the counters of a long-lived component, read at scrape time.
+
+    With several worker processes, a scrape only reaches one of them, so
+    its stats are labelled with the worker's PID.
+    """
+
+    def __init__(self, prefix: str, stats: Callable[[], Dict[str, Any]], counters: Iterable[str] = ()):
+        """Initialize the collector.
+
+        Args:
+            prefix: Metric name prefix
+            stats: Returns a flat dict of numeric stats
+            counters: Keys exported as counters; all others are gauges
+        """
+        self.prefix = prefix
+        self.stats = stats
+        self.counters = frozenset(counters)
+        self.labels = {"worker": str(os.getpid())} if multiprocess_mode() else {}
+
+    def collect(self):
+        try:
+            stats = self.stats()
+        except Exception as e:
+            logger.warning(f"Failed to collect {self.prefix} metrics: {str(e)}")
+            return
+        for key, value in stats.items():
+            if not isinstance(value, (int, float)) or isinstance(value, bool):
+                continue
+            name = f"{self.prefix}_{key}"
+            family = CounterMetricFamily if key in self.counters else GaugeMetricFamily
+            metric = family(name, f"{self.prefix} {key.replace('_', ' ')}", labels=list(self.labels))
+            metric.add_metric(list(self.labels.values()), value)
+            yield metric
+
+
+_stats_collectors: Dict[str, StatsCollector] = {}
+
+
+def register_stats(prefix: str, stats: Callable[[], Dict[str, Any]], counters: Iterable[str] = ()) -> None:
+    """Export a component's stats dict under `prefix` on /metrics.
+
+    Registering the same prefix again replaces the previous source.
+    """
+    previous = _stats_collectors.pop(prefix, None)
+    if previous is not None:
+        REGISTRY.unregister(previous)
+    collector = StatsCollector(prefix, stats, counters)
+    REGISTRY.register(collector)
+    _stats_collectors[prefix] = collector
+
+
+def exposition_registry() -> CollectorRegistry:
+    """Return the registry to expose on /metrics.
+
+    In multiprocess mode this combines the metrics of all worker processes
+    with the component stats of this one.
+    """
+    if not multiprocess_mode():
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    for collector in _stats_collectors.values():
+        registry.register(collector)
+    return registry
+
+
+def mark_worker_stopped() -> None:
+    """Drop the in-flight gauges of this process from the combined metrics."""
+    if multiprocess_mode():
+        multiprocess.mark_process_dead(os.getpid())
@@ -0,0 +1,245 @@
+import json
+import logging
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Type, Union
+
+from pydantic import BaseModel, ValidationError, create_model
+
+from admission import AdmissionRejected
+from deadline import DeadlineExceeded
+from gemini_client import GeminiClient
+from metrics import MODEL_ROUTES
+from schema import ModelResponse
+
+logger = logging.getLogger(__name__)
+
+# Schema entry asking lower tiers to report how sure they are of a result
+CONFIDENCE_FIELD = "confidence"
+CONFIDENCE_STRUCTURE = "number between 0 and 1: how certain you are of this categorization"
+CONFIDENCE_OUTPUT_TOKENS = 6
+
+# Types a model falls back to when it cannot tell what a product is
+GENERIC_TYPES = frozenset({
+    "product", "products", "item", "items", "other", "others", "unknown", "misc", "miscellaneous",
+    "general", "n/a", "none", "food", "grocery", "groceries"
+})
+
+def heuristic_confidence(values: Dict[str, Any]) -> float:
+    """Estimate how usable a categorization is from its content alone.
+
+    An empty type scores 0, a generic type such as "product" 0.3 and a
+    result without any variety 0.5; anything else scores 1.
+    """
+    product_type = " ".join(str(values.get("type") or "").lower().split())
+    if not product_type:
+        return 0.0
+    if product_type in GENERIC_TYPES:
+        return 0.3
+    if not any(str(variety).strip() for variety in values.get("variety") or []):
+        return 0.5
+    return 1.0
+
+
+def with_confidence(json_structure: Dict[str, Any]) -> Dict[str, Any]:
+    """Return the JSON structure extended with a self-reported confidence.
+
+    Extended structures are cached by content, so the same object is returned
+    for equal structures and GeminiClient's per-object schema serialization
+    cache keeps working.
+    """
+    return _confidence_structure(json.dumps(json_structure))
+
+
+@lru_cache(maxsize=64)
+def _confidence_structure(serialized: str) -> Dict[str, Any]:
+    return {**json.loads(serialized), CONFIDENCE_FIELD: CONFIDENCE_STRUCTURE}
+
+
+@lru_cache(maxsize=None)
+def with_confidence_model(response_model: Type[BaseModel]) -> Type[BaseModel]:
+    """Return a subclass of a response model that keeps a reported confidence."""
+    return create_model(
+        response_model.__name__,
+        __base__=response_model,
+        confidence=(Optional[float], None)
+    )
+
+
+class ModelRouter:
+    """Routes prompts through model tiers, cheapest first.
+
+    Every tier but the last is asked to also report its confidence. A tier's
+    answer is accepted unless it fails schema validation, has an empty type,
+    or its confidence falls below `min_confidence`; the confidence is the
+    lower of the self-reported value and `heuristic_confidence`. Rejected
+    answers, and prompts whose call fails, escalate to the next tier. The
+    last tier's answer is always used.
+
+    Outcomes per tier are counted in the `categorization_model_routes_total`
+    metric.
+    """
+
+    def __init__(self, tiers: List[GeminiClient], min_confidence: float = 0.7):
+        """Initialize the router.
+
+        Args:
+            tiers: Clients to try in order, from the fastest to the strongest
+            min_confidence: Confidence (0-1) below which an answer escalates
+
+        Raises:
+            ValueError: If no tiers are given
+        """
+        if not tiers:
+            raise ValueError("ModelRouter needs at least one model tier")
+        self.tiers = tiers
+        self.min_confidence = min_confidence
+
+    @property
+    def model_name(self) -> str:
+        """Name identifying the routing, used to scope cached results."""
+        if len(self.tiers) == 1:
+            return self.tiers[0].model_name
+        return ">".join(tier.model_name for tier in self.tiers) + f"@{self.min_confidence}"
+
+    @property
+    def temperature(self) -> float:
+        return self.tiers[-1].temperature
+
+    def _escalation_reason(self, values: Dict[str, Any], response_model: Type[BaseModel]) -> Optional[str]:
+        """Why an answer should escalate, or None to accept it.
+
+        Removes the self-reported confidence from `values`.
+        """
+        reported = values.pop(CONFIDENCE_FIELD, None)
+        try:
+            response_model(**values)
+        except (TypeError, ValidationError):
+            return "invalid"
+        if not str(values.get("type") or "").strip():
+            return "empty_type"
+
+        confidence = heuristic_confidence(values)
+        if isinstance(reported, (int, float)) and not isinstance(reported, bool):
+            confidence = min(confidence, float(reported))
+        if confidence < self.min_confidence:
+            return "low_confidence"
+        return None
+
+    def _escalate(self, tier: GeminiClient, reason: str, count: int = 1) -> None:
+        MODEL_ROUTES.labels(tier.model_name, reason).inc(count)
+        logger.info(f"Escalating {count} prompt(s) from {tier.model_name}: {reason}")
+
+    async def process_prompt(self,
+                             prompt: str,
+                             json_structure: Dict[str, Any],
+                             response_model: Optional[Type[BaseModel]] = None) -> ModelResponse:
+        """Process a prompt with the first tier that answers it acceptably.
+
+        Args:
+            prompt: The input prompt to process
+            json_structure: Expected JSON structure for the response
+            response_model: Model the response must validate against
+
+        Returns:
+            ModelResponse of the accepting tier
+
+        Raises:
+            ValueError: If the last tier fails to generate a valid JSON response
+        """
+        for tier in self.tiers[:-1]:
+            try:
+                model_response = await tier.process_prompt(prompt, with_confidence(json_structure))
+            except (DeadlineExceeded, AdmissionRejected):
+                raise
+            except Exception as e:
+                self._escalate(tier, "invalid" if isinstance(e, ValueError) else "error")
+                continue
+
+            # Responses are shared between coalesced callers, so work on a copy
+            values = dict(model_response.response)
+            reason = self._escalation_reason(values, response_model or BaseModel)
+            if reason is not None:
+                self._escalate(tier, reason)
+                continue
+
+            MODEL_ROUTES.labels(tier.model_name, "accepted").inc()
+            return ModelResponse(response=values, raw_response=model_response.raw_response)
+
+        tier = self.tiers[-1]
+        try:
+            model_response = await tier.process_prompt(prompt, json_structure, response_model)
+        except Exception:
+            MODEL_ROUTES.labels(tier.model_name, "failed").inc()
+            raise
+        MODEL_ROUTES.labels(tier.model_name, "accepted").inc()
+        return model_response
+
+    async def process_packed_prompts(self,
+                                     instructions: str,
+                                     items: Dict[str, str],
+                                     json_structure: Dict[str, Any],
+                                     response_model: Type[BaseModel],
+                                     output_tokens_per_item: int) -> Dict[str, Union[BaseModel, Exception]]:
+        """Process many products in packed prompts, escalating products individually.
+
+        Products a tier does not answer acceptably are packed again for the
+        next tier.
+
+        Args:
+            instructions: Instructions shared by every product
+            items: Product text keyed by product id
+            json_structure: Expected JSON structure of each product result
+            response_model: Model each product result is validated against
+            output_tokens_per_item: Estimated output tokens per product result
+
+        Returns:
+            For every product id, either its validated result or the
+            exception explaining why it could not be categorized
+        """
+        results: Dict[str, Union[BaseModel, Exception]] = {}
+        pending = dict(items)
+        for tier in self.tiers[:-1]:
+            outcomes = await tier.process_packed_prompts(
+                instructions, pending, with_confidence(json_structure), with_confidence_model(response_model),
+                output_tokens_per_item + CONFIDENCE_OUTPUT_TOKENS
+            )
+
+            escalated: Dict[str, str] = {}
+            reasons: Dict[str, int] = {}
+            accepted = 0
+            for product_id, outcome in outcomes.items():
+                if isinstance(outcome, (DeadlineExceeded, AdmissionRejected)):
+                    # No time left for another tier, or no capacity for it
+                    results[product_id] = outcome
+                    continue
+                if isinstance(outcome, Exception):
+                    reason = "invalid" if isinstance(outcome, ValueError) else "error"
+                else:
+                    values = outcome.model_dump()
+                    reason = self._escalation_reason(values, response_model)
+                if reason is None:
+                    results[product_id] = response_model(**values)
+                    accepted += 1
+                else:
+                    escalated[product_id] = pending[product_id]
+                    reasons[reason] = reasons.get(reason, 0) + 1
+
+            if accepted:
+                MODEL_ROUTES.labels(tier.model_name, "accepted").inc(accepted)
+            for reason, count in reasons.items():
+                self._escalate(tier, reason, count)
+            pending = escalated
+            if not pending:
+                return results
+
+        tier = self.tiers[-1]
+        outcomes = await tier.process_packed_prompts(
+            instructions, pending, json_structure, response_model, output_tokens_per_item
+        )
+        failed = sum(1 for outcome in outcomes.values() if isinstance(outcome, Exception))
+        if failed:
+            MODEL_ROUTES.labels(tier.model_name, "failed").inc(failed)
+        if len(outcomes) > failed:
+            MODEL_ROUTES.labels(tier.model_name, "accepted").inc(len(outcomes) - failed)
+        results.update(outcomes)
+        return results
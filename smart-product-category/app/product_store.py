@@ -0,0 +1,314 @@
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+import zlib
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+try:
+    import zstandard
+except ImportError:  # Snapshots are compressed with zlib instead
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+ZSTD = "zstd"
+ZLIB = "zlib"
+
+# zlib only looks back 32 KiB, so a longer preset dictionary is wasted
+ZLIB_DICTIONARY_SIZE = 32 * 1024
+
+
+class ProductSnapshot(NamedTuple):
+    """A stored product detail payload."""
+    data: Dict[str, Any]
+    content_hash: str
+    fetched_at: float
+    changed_at: float
+
+
+def content_hash(raw: bytes) -> str:
+    return hashlib.sha256(raw).hexdigest()
+
+
+def serialize(data: Dict[str, Any]) -> bytes:
+    """Encode a payload canonically, so equal content hashes the same."""
+    return json.dumps(data, sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+class _Codec:
+    """Compresses payloads with one dictionary (or none)."""
+
+    def __init__(self, codec: str, dictionary: Optional[bytes] = None, level: int = 3):
+        self.codec = codec
+        self.dictionary = dictionary
+        self.level = level
+        if codec == ZSTD:
+            if zstandard is None:
+                raise ValueError("zstd snapshots require the zstandard package")
+            dict_data = zstandard.ZstdCompressionDict(dictionary) if dictionary else None
+            self._compressor = zstandard.ZstdCompressor(level=level, dict_data=dict_data)
+            self._decompressor = zstandard.ZstdDecompressor(dict_data=dict_data)
+        elif codec != ZLIB:
+            raise ValueError(f"Unknown snapshot codec: {codec}")
+
+    def compress(self, raw: bytes) -> bytes:
+        if self.codec == ZSTD:
+            return self._compressor.compress(raw)
+        if self.dictionary:
+            compressor = zlib.compressobj(self.level, zdict=self.dictionary)
+        else:
+            compressor = zlib.compressobj(self.level)
+        return compressor.compress(raw) + compressor.flush()
+
+    def decompress(self, payload: bytes) -> bytes:
+        if self.codec == ZSTD:
+            return self._decompressor.decompress(payload)
+        decompressor = zlib.decompressobj(zdict=self.dictionary) if self.dictionary else zlib.decompressobj()
+        return decompressor.decompress(payload) + decompressor.flush()
+
+
+class ProductSnapshotStore:
+    """Persistent store of Woolworths product detail payloads.
+
+    Payloads are kept as canonical JSON, compressed with zstd (or zlib when
+    the zstandard package is not installed). Product detail responses share
+    most of their keys and boilerplate, so once `train_after` snapshots are
+    stored a compression dictionary is trained from them; later snapshots are
+    compressed with it and the earlier ones are recompressed. Every snapshot
+    records a content hash, when it was last fetched and when its content
+    last changed, so refreshing an unchanged product only touches its
+    timestamp. Stale products are claimed when handed out for refresh, so
+    processes sharing the store don't refresh the same ones.
+    """
+
+    def __init__(self, path: str, train_after: int = 200, dictionary_size: int = 16 * 1024, level: int = 3):
+        """Initialize the store and create its tables if needed.
+
+        Args:
+            path: Path of the SQLite database file
+            train_after: Snapshots stored before a dictionary is trained
+            dictionary_size: Target size of a trained zstd dictionary in bytes
+            level: Compression level
+        """
+        self.path = Path(path)
+        self.train_after = train_after
+        self.dictionary_size = dictionary_size
+        self.level = level
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS dictionaries ("
+            " id INTEGER PRIMARY KEY,"
+            " codec TEXT NOT NULL,"
+            " data BLOB NOT NULL,"
+            " created_at REAL NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS products ("
+            " product_id TEXT PRIMARY KEY,"
+            " payload BLOB NOT NULL,"
+            " codec TEXT NOT NULL,"
+            " dictionary_id INTEGER,"
+            " raw_size INTEGER NOT NULL,"
+            " content_hash TEXT NOT NULL,"
+            " fetched_at REAL NOT NULL,"
+            " changed_at REAL NOT NULL,"
+            " refresh_claimed_at REAL);"
+            "CREATE INDEX IF NOT EXISTS products_fetched_at ON products (fetched_at);"
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(products)")}
+        if "refresh_claimed_at" not in columns:
+            self._conn.execute("ALTER TABLE products ADD COLUMN refresh_claimed_at REAL")
+        self._codecs: Dict[Tuple[str, Optional[int]], _Codec] = {}
+        self._dictionary_id: Optional[int] = None
+        codec = ZSTD if zstandard is not None else ZLIB
+        row = self._conn.execute(
+            "SELECT id FROM dictionaries WHERE codec = ? ORDER BY id DESC LIMIT 1", (codec,)
+        ).fetchone()
+        if row is not None:
+            self._dictionary_id = row[0]
+        self._codec = self._get_codec(codec, self._dictionary_id)
+        self._train_at = train_after
+        self._untrained = 0
+        if self._dictionary_id is None:
+            self._untrained = self._conn.execute("SELECT COUNT(*) FROM products").fetchone()[0]
+        # Size totals are counted once here and kept up to date by writes,
+        # so stats() doesn't scan the table; writes by other processes
+        # sharing the store are picked up on the next start
+        self._count_totals()
+        self.writes = 0
+        self.unchanged = 0
+
+    def _count_totals(self) -> None:
+        self.entries, self.stored_bytes, self.raw_bytes = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(payload)), 0), COALESCE(SUM(raw_size), 0) FROM products"
+        ).fetchone()
+
+    def _get_codec(self, codec: str, dictionary_id: Optional[int]) -> _Codec:
+        key = (codec, dictionary_id)
+        if key not in self._codecs:
+            dictionary = None
+            if dictionary_id is not None:
+                row = self._conn.execute("SELECT data FROM dictionaries WHERE id = ?", (dictionary_id,)).fetchone()
+                if row is None:
+                    raise ValueError(f"Snapshot dictionary {dictionary_id} is missing")
+                dictionary = row[0]
+            self._codecs[key] = _Codec(codec, dictionary, self.level)
+        return self._codecs[key]
+
+    def get(self, product_id: str) -> Optional[ProductSnapshot]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT payload, codec, dictionary_id, content_hash, fetched_at, changed_at"
+                " FROM products WHERE product_id = ?", (product_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            payload, codec, dictionary_id, digest, fetched_at, changed_at = row
+            try:
+                raw = self._get_codec(codec, dictionary_id).decompress(payload)
+            except Exception as e:
+                logger.warning(f"Unreadable snapshot of product {product_id}: {str(e)}")
+                return None
+        return ProductSnapshot(json.loads(raw), digest, fetched_at, changed_at)
+
+    def put(self, product_id: str, data: Dict[str, Any]) -> bool:
+        """Store a freshly fetched payload.
+
+        Returns:
+            Whether the content is new or differs from the stored snapshot
+        """
+        raw = serialize(data)
+        digest = content_hash(raw)
+        now = time.time()
+        with self._lock:
+            updated = self._conn.execute(
+                "UPDATE products SET fetched_at = ? WHERE product_id = ? AND content_hash = ?",
+                (now, product_id, digest)
+            ).rowcount
+            if updated:
+                self.unchanged += 1
+                return False
+
+            previous = self._conn.execute(
+                "SELECT LENGTH(payload), raw_size FROM products WHERE product_id = ?", (product_id,)
+            ).fetchone()
+            payload = self._codec.compress(raw)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO products"
+                " (product_id, payload, codec, dictionary_id, raw_size, content_hash, fetched_at, changed_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (product_id, payload, self._codec.codec, self._dictionary_id, len(raw), digest, now, now)
+            )
+            if previous is None:
+                self.entries += 1
+            else:
+                self.stored_bytes -= previous[0]
+                self.raw_bytes -= previous[1]
+            self.stored_bytes += len(payload)
+            self.raw_bytes += len(raw)
+            self.writes += 1
+            if self._dictionary_id is None:
+                self._untrained += 1
+                if self._untrained >= self._train_at:
+                    self._train()
+        return True
+
+    def _train(self) -> None:
+        """Train a dictionary on stored snapshots and recompress them with it."""
+        # Try again after twice as many snapshots if this attempt fails
+        self._train_at = self._untrained * 2
+        rows = self._conn.execute(
+            "SELECT payload, codec, dictionary_id FROM products ORDER BY changed_at DESC LIMIT ?",
+            (self.train_after * 5,)
+        ).fetchall()
+        samples = [self._get_codec(codec, dictionary_id).decompress(payload)
+                   for payload, codec, dictionary_id in rows]
+
+        codec = self._codec.codec
+        if codec == ZSTD:
+            try:
+                dictionary = zstandard.train_dictionary(self.dictionary_size, samples, level=self.level).as_bytes()
+            except zstandard.ZstdError as e:
+                logger.warning(f"Failed to train a snapshot dictionary from {len(samples)} samples: {str(e)}")
+                return
+        else:
+            # zlib matches against the end of its preset dictionary, so put
+            # the most recent snapshots last
+            dictionary = b"".join(reversed(samples))[-ZLIB_DICTIONARY_SIZE:]
+
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            dictionary_id = self._conn.execute(
+                "INSERT INTO dictionaries (codec, data, created_at) VALUES (?, ?, ?)", (codec, dictionary, time.time())
+            ).lastrowid
+            new_codec = self._get_codec(codec, dictionary_id)
+            pending = self._conn.execute(
+                "SELECT product_id, payload, codec, dictionary_id FROM products WHERE dictionary_id IS NULL"
+            ).fetchall()
+            self._conn.executemany(
+                "UPDATE products SET payload = ?, codec = ?, dictionary_id = ? WHERE product_id = ?",
+                ((new_codec.compress(self._get_codec(old_codec, old_dictionary_id).decompress(payload)),
+                  codec, dictionary_id, product_id)
+                 for product_id, payload, old_codec, old_dictionary_id in pending)
+            )
+            self._conn.execute("COMMIT")
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._dictionary_id = dictionary_id
+        self._codec = new_codec
+        self._count_totals()
+        logger.info(
+            f"Trained a {len(dictionary)} byte {codec} snapshot dictionary from {len(samples)} samples "
+            f"and recompressed {len(pending)} snapshots"
+        )
+
+    def stale(self, older_than: float, limit: int) -> List[str]:
+        """Claim up to `limit` products last fetched more than `older_than` seconds ago, oldest first.
+
+        A claimed product is not returned again for another `older_than`
+        seconds, unless it is refreshed and goes stale first.
+        """
+        now = time.time()
+        cutoff = now - older_than
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    "SELECT product_id FROM products"
+                    " WHERE fetched_at < ? AND COALESCE(refresh_claimed_at, 0) < ?"
+                    " ORDER BY fetched_at LIMIT ?",
+                    (cutoff, cutoff, limit)
+                ).fetchall()
+                self._conn.executemany(
+                    "UPDATE products SET refresh_claimed_at = ? WHERE product_id = ?",
+                    ((now, product_id) for product_id, in rows)
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return [product_id for product_id, in rows]
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the number of snapshots, their size and write counters."""
+        return {
+            "codec": self._codec.codec,
+            "dictionary_bytes": len(self._codec.dictionary or b""),
+            "entries": self.entries,
+            "stored_bytes": self.stored_bytes,
+            "raw_bytes": self.raw_bytes,
+            "compression_ratio": self.raw_bytes / self.stored_bytes if self.stored_bytes else 0.0,
+            "writes": self.writes,
+            "unchanged_refreshes": self.unchanged,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
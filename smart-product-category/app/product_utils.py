@@ -9,6 +9,16 @@ logger = logging.getLogger(__name__)
 class ProductDataExtractor:
     """Utility class to extract and format product data from Woolworths API response."""
     
+    # Common package size formats like "500g", "1kg", "750ml", "2L" etc.
+    PACKAGE_SIZE_PATTERNS = [
+        re.compile(r'(\d+(?:\.\d+)?\s*(?:kg|g|ml|l|oz|lb))\b', re.IGNORECASE),  # Regular formats like 500g, 1.5kg, 750ml
+        re.compile(r'(\d+(?:\.\d+)?\s*(?:KG|G|ML|L|OZ|LB))\b', re.IGNORECASE),  # Uppercase formats
+        re.compile(r'(\d+(?:\.\d+)?\s*(?:kilogram|gram|milliliter|liter))[s]?\b', re.IGNORECASE),  # Full word formats
+        re.compile(r'(\d+\s*(?:pk|pack|piece|pcs))s?\b', re.IGNORECASE),  # Pack quantities
+    ]
+    # Multipack counts left behind once sizes are removed, e.g. "24 x" in "24 x 375ml"
+    MULTIPACK_PATTERN = re.compile(r'\b\d+\s*x\b|\bx\s*\d+\b', re.IGNORECASE)
+    
     @staticmethod
     def clean_html(text: str) -> str:
         """Remove HTML tags and decode HTML entities from text."""
@@ -57,21 +67,25 @@ class ProductDataExtractor:
             return product["PackageSize"]
             
         # If not found, try to extract from the display name
-        # Look for common patterns like "500g", "1kg", "750ml", "2L" etc.
-        patterns = [
-            r'(\d+(?:\.\d+)?\s*(?:kg|g|ml|l|oz|lb))\b',  # Regular formats like 500g, 1.5kg, 750ml
-            r'(\d+(?:\.\d+)?\s*(?:KG|G|ML|L|OZ|LB))\b',  # Uppercase formats
-            r'(\d+(?:\.\d+)?\s*(?:kilogram|gram|milliliter|liter))[s]?\b',  # Full word formats
-            r'(\d+\s*(?:pk|pack|piece|pcs))s?\b',  # Pack quantities
-        ]
-        
-        for pattern in patterns:
-            match = re.search(pattern, display_name, re.IGNORECASE)
+        for pattern in ProductDataExtractor.PACKAGE_SIZE_PATTERNS:
+            match = pattern.search(display_name)
             if match:
                 return match.group(1)
                 
         return ""
     
+    @staticmethod
+    def strip_package_size(display_name: str) -> str:
+        """Remove package sizes and pack counts from a product name.
+        
+        Size variants of a product ("... Full Cream Milk 2L" and "... 3L")
+        reduce to the same name.
+        """
+        for pattern in ProductDataExtractor.PACKAGE_SIZE_PATTERNS:
+            display_name = pattern.sub(" ", display_name)
+        display_name = ProductDataExtractor.MULTIPACK_PATTERN.sub(" ", display_name)
+        return " ".join(display_name.split())
+    
     def extract_product_data(self, product_details: Dict[str, Any]) -> Dict[str, Any]:
         """Extract relevant product data from Woolworths API response.
         
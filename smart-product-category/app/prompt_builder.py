@@ -0,0 +1,266 @@
+import hashlib
+import json
+import logging
+import re
+import time
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+from metrics import PROMPT_TOKENS
+from prompt_loader import PromptLoader
+
+logger = logging.getLogger(__name__)
+
+# Gemini tokenizes English product text at roughly four characters per token
+CHARS_PER_TOKEN = 4
+
+# Default token budget of each product field, applied before formatting
+FIELD_TOKEN_BUDGETS = {
+    "product_name": 40,
+    "product_description": 120,
+    "ingredients": 80,
+    "package_size": 10,
+    "dietary_info": 50,
+    "department_category": 50,
+}
+
+# Placeholder values the Woolworths API uses for missing attributes
+_EMPTY_VALUES = {"", "null", "none", "n/a", "na", "nil"}
+_SENTENCE_END = re.compile(r"[.!?][\"'”)]?\s")
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the number of tokens in a text without calling the model."""
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+def normalize_whitespace(text: Any) -> str:
+    return " ".join(str(text).split())
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Shorten a text to about `max_tokens`, preferring a sentence boundary.
+
+    Text cut mid-sentence ends in an ellipsis so the model can tell it is
+    incomplete.
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return text
+
+    limit = max(1, max_tokens * CHARS_PER_TOKEN - 1)
+    cut = text[:limit + 1]
+    sentence_ends = [match.end() for match in _SENTENCE_END.finditer(cut)]
+    if sentence_ends and sentence_ends[-1] >= limit // 2:
+        return cut[:sentence_ends[-1]].rstrip()
+
+    cut = text[:limit]
+    if " " in cut:
+        cut = cut.rsplit(" ", 1)[0]
+    return cut.rstrip(" ,;:") + "…"
+
+
+def dedupe_statements(text: str) -> str:
+    """Drop repeated and empty items from "|"-separated, comma-listed text.
+
+    Dietary and allergy statements often repeat the same claims ("Gluten
+    Free" in both), and missing statements come through as "NULL". A
+    segment label such as "Allergy info:" is kept with its remaining items.
+    """
+    seen = set()
+    segments = []
+    for segment in text.split("|"):
+        label, separator, body = segment.partition(":")
+        if not separator or ">" in label or "," in label:
+            label, body = "", segment
+
+        items = []
+        for item in re.split(r"[,;]", body):
+            item = normalize_whitespace(item).rstrip(".")
+            key = item.lower()
+            if key in _EMPTY_VALUES or key in seen:
+                continue
+            seen.add(key)
+            items.append(item)
+        if items:
+            segments.append(f"{label.strip()}: {', '.join(items)}" if label.strip() else ", ".join(items))
+    return " | ".join(segments)
+
+
+def compact_category_path(text: str) -> str:
+    """Drop empty levels and repeated segments from department/category text.
+
+    Products missing lower SAP category levels come through as
+    "GROCERIES > PANTRY >  > ".
+    """
+    segments = []
+    for segment in text.split("|"):
+        levels = [normalize_whitespace(level) for level in segment.split(">")]
+        segment = " > ".join(level for level in levels if level.lower() not in _EMPTY_VALUES)
+        if segment and segment not in segments:
+            segments.append(segment)
+    return " | ".join(segments)
+
+
+class PromptBuilder:
+    """Formats prompts within a token budget.
+
+    Product fields are whitespace-normalized and capped to a per-field token
+    budget; dietary statements and category paths are de-duplicated. Prompts with an
+    `{examples}` variable get as many few-shot examples, in file order, as
+    fit in the remaining budget. Examples are read from a JSON list of
+    {"input": ..., "output": {...}} objects in the prompts directory and,
+    like prompts, reloaded when the file changes. Example outputs can be cut
+    down to the fields a request asks for; each variant is rendered once.
+    """
+
+    def __init__(self,
+                 prompt_loader: PromptLoader,
+                 prompt_examples: Optional[Dict[str, str]] = None,
+                 token_budget: int = 1000,
+                 field_budgets: Optional[Dict[str, int]] = None):
+        """Initialize the prompt builder.
+
+        Args:
+            prompt_loader: Loader for the prompt templates
+            prompt_examples: Name of the examples file (without extension)
+                of each prompt that takes examples
+            token_budget: Estimated tokens a formatted prompt may use,
+                including its examples
+            field_budgets: Token budget of each product field (defaults to
+                FIELD_TOKEN_BUDGETS)
+        """
+        self.prompt_loader = prompt_loader
+        self.prompt_examples = prompt_examples or {}
+        self.token_budget = token_budget
+        self.field_budgets = field_budgets or FIELD_TOKEN_BUDGETS
+        self._examples: Dict[str, Tuple[float, float, List[Tuple[str, Dict[str, Any]]], str]] = {}
+        self._rendered: Dict[Tuple[str, FrozenSet[str]], List[str]] = {}
+
+    def _load_examples(self, examples_name: str) -> Tuple[List[Tuple[str, Dict[str, Any]]], str]:
+        """Return the (input, output) examples and their hash, re-reading a changed file."""
+        cached = self._examples.get(examples_name)
+        now = time.monotonic()
+        reload_interval = self.prompt_loader.reload_interval
+        if cached is not None and (reload_interval < 0 or now - cached[1] < reload_interval):
+            return cached[2], cached[3]
+
+        path = self.prompt_loader.prompts_dir / f"{examples_name}.json"
+        try:
+            mtime = path.stat().st_mtime
+            if cached is not None and mtime == cached[0]:
+                self._examples[examples_name] = (mtime, now, cached[2], cached[3])
+                return cached[2], cached[3]
+            with open(path, "r", encoding="utf-8") as f:
+                raw = f.read()
+            examples = [(normalize_whitespace(example["input"]), example["output"]) for example in json.loads(raw)]
+        except Exception as e:
+            if cached is None:
+                logger.error(f"Failed to load prompt examples '{examples_name}': {str(e)}")
+                raise ValueError(f"Failed to load prompt examples '{examples_name}': {str(e)}")
+            logger.error(f"Failed to reload prompt examples '{examples_name}', keeping previous version: {str(e)}")
+            self._examples[examples_name] = (cached[0], now, cached[2], cached[3])
+            return cached[2], cached[3]
+
+        examples_hash = hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+        if cached is not None:
+            logger.info(f"Reloaded prompt examples '{examples_name}' (hash {examples_hash})")
+            for key in [key for key in self._rendered if key[0] == examples_name]:
+                del self._rendered[key]
+        self._examples[examples_name] = (mtime, now, examples, examples_hash)
+        return examples, examples_hash
+
+    def _render_examples(self, examples_name: str, omit_output_keys: FrozenSet[str]) -> List[str]:
+        examples, _ = self._load_examples(examples_name)
+        key = (examples_name, omit_output_keys)
+        rendered = self._rendered.get(key)
+        if rendered is None:
+            rendered = []
+            for example_input, output in examples:
+                output = {name: value for name, value in output.items() if name not in omit_output_keys}
+                rendered.append(f"Example Input:\n{example_input}\nExample Output:\n{json.dumps(output, ensure_ascii=False)}")
+            self._rendered[key] = rendered
+        return rendered
+
+    def preload(self) -> None:
+        """Load every examples file up front.
+
+        Raises:
+            ValueError: If an examples file cannot be loaded
+        """
+        for examples_name in sorted(set(self.prompt_examples.values())):
+            examples, examples_hash = self._load_examples(examples_name)
+            logger.info(f"Loaded {len(examples)} prompt examples '{examples_name}' (hash {examples_hash})")
+
+    def template_hash(self, prompt_name: str) -> str:
+        """Return a short hash of everything besides the product that shapes a prompt.
+
+        Covers the template, its examples and the budgets, so changing any
+        of them invalidates cached results.
+        """
+        template_hash = self.prompt_loader.template_hash(prompt_name)
+        examples_name = self.prompt_examples.get(prompt_name)
+        if examples_name is None:
+            return template_hash
+
+        _, examples_hash = self._load_examples(examples_name)
+        raw = json.dumps([template_hash, examples_hash, self.token_budget, sorted(self.field_budgets.items())])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+    def compact_fields(self, variables: Dict[str, Any]) -> Dict[str, Any]:
+        """Normalize product fields and cap each to its token budget."""
+        compacted = dict(variables)
+        for field, budget in self.field_budgets.items():
+            if field not in compacted:
+                continue
+            value = normalize_whitespace(compacted[field])
+            if field == "dietary_info":
+                value = dedupe_statements(value)
+            elif field == "department_category":
+                value = compact_category_path(value)
+            elif value.lower() in _EMPTY_VALUES:
+                value = ""
+            compacted[field] = truncate_to_tokens(value, budget)
+        return compacted
+
+    def build(self,
+              prompt_name: str,
+              variables: Optional[Dict[str, Any]] = None,
+              omit_output_keys: Iterable[str] = ()) -> str:
+        """Format a prompt with compacted fields and the examples that fit.
+
+        Args:
+            prompt_name: Name of the prompt file (without extension)
+            variables: Variables to format into the prompt, not including
+                `examples`
+            omit_output_keys: Fields to leave out of the example outputs
+
+        Returns:
+            Formatted prompt string
+
+        Raises:
+            FileNotFoundError: If the prompt file is not found
+            KeyError: If a required variable is missing
+            ValueError: If the prompt's examples cannot be loaded
+        """
+        variables = self.compact_fields(variables or {})
+        examples_name = self.prompt_examples.get(prompt_name)
+        if examples_name is None:
+            prompt = self.prompt_loader.load_prompt(prompt_name, variables=variables)
+            PROMPT_TOKENS.labels(prompt_name).observe(estimate_tokens(prompt))
+            return prompt
+
+        examples = self._render_examples(examples_name, frozenset(omit_output_keys))
+        prompt = self.prompt_loader.load_prompt(prompt_name, variables={**variables, "examples": ""})
+        tokens = estimate_tokens(prompt)
+        selected = []
+        for example in examples:
+            cost = estimate_tokens(example) + 1
+            if tokens + cost > self.token_budget:
+                break
+            selected.append(example)
+            tokens += cost
+
+        if selected:
+            prompt = self.prompt_loader.load_prompt(prompt_name, variables={**variables, "examples": "\n".join(selected)})
+        logger.debug(f"Built prompt '{prompt_name}' with {len(selected)}/{len(examples)} examples, ~{tokens} tokens")
+        PROMPT_TOKENS.labels(prompt_name).observe(tokens)
+        return prompt
@@ -1,63 +1,224 @@
 from pathlib import Path
+from string import Formatter
+import hashlib
 import logging
-from typing import Dict, Any, Optional
+import time
+from typing import Dict, Any, Optional, Iterable, List, Tuple, FrozenSet
 import os
 
 logger = logging.getLogger(__name__)
 
+class PreparedPrompt:
+    """A prompt template parsed once and kept in memory for fast formatting."""
+
+    def __init__(self, name: str, path: Path, template: str, mtime: float):
+        """Parse a prompt template.
+
+        Args:
+            name: Name of the prompt
+            path: Path of the prompt file
+            template: Raw prompt template text
+            mtime: Modification time of the prompt file when it was read
+
+        Raises:
+            ValueError: If the template is not a valid format string
+        """
+        self.name = name
+        self.path = path
+        self.template = template
+        self.mtime = mtime
+        self.hash = hashlib.sha256(template.encode("utf-8")).hexdigest()[:16]
+
+        # (literal text, field name) pairs; literal text has {{ }} escapes resolved
+        self.segments: List[Tuple[str, Optional[str]]] = []
+        self.simple = True
+        for literal, field_name, format_spec, conversion in Formatter().parse(template):
+            if format_spec or conversion or (field_name is not None and not field_name.isidentifier()):
+                self.simple = False
+            self.segments.append((literal, field_name))
+        self.variables: FrozenSet[str] = frozenset(
+            field_name for _, field_name in self.segments if field_name is not None
+        )
+        self.text = "".join(literal for literal, _ in self.segments) if not self.variables else None
+
+    def format(self, variables: Dict[str, Any]) -> str:
+        """Substitute variables into the template.
+
+        Raises:
+            KeyError: If a variable used by the template is missing
+        """
+        if self.text is not None:
+            return self.text
+        if not self.simple:
+            return self.template.format(**variables)
+        return "".join(
+            literal if field_name is None else literal + str(variables[field_name])
+            for literal, field_name in self.segments
+        )
+
+
 class PromptLoader:
-    """Utility class to load prompts from text files."""
-    
-    def __init__(self, prompts_dir: str = "prompts"):
+    """Utility class to load prompts from text files.
+
+    Prompt files are read and parsed once and kept in memory. At most every
+    `reload_interval` seconds a prompt's file modification time is checked and
+    the prompt is re-read if it changed, so prompts can be edited without a
+    restart.
+    """
+
+    def __init__(self, prompts_dir: str = "prompts", reload_interval: float = 5.0):
         """Initialize the prompt loader.
-        
+
         Args:
             prompts_dir: Directory containing prompt files
+            reload_interval: Minimum seconds between checks for changed
+                prompt files; 0 checks on every load, a negative value
+                disables hot reloading
         """
         base_path = Path(__file__).parent
         self.prompts_dir = base_path / prompts_dir
-        
+        self.reload_interval = reload_interval
+        self._prompts: Dict[str, PreparedPrompt] = {}
+        self._checked_at: Dict[str, float] = {}
+
         # Ensure the prompts directory exists
         if not self.prompts_dir.exists():
             logger.warning(f"Prompts directory not found: {self.prompts_dir}")
             self.prompts_dir.mkdir(parents=True, exist_ok=True)
             logger.info(f"Created prompts directory: {self.prompts_dir}")
-    
+
+    def _read_prompt(self, prompt_name: str) -> PreparedPrompt:
+        """Read and parse a prompt file from disk.
+
+        Raises:
+            FileNotFoundError: If prompt file is not found
+        """
+        prompt_path = self.prompts_dir / f"{prompt_name}.txt"
+
+        try:
+            mtime = prompt_path.stat().st_mtime
+        except FileNotFoundError:
+            logger.error(f"Prompt file not found: {prompt_path}")
+            raise FileNotFoundError(f"Prompt '{prompt_name}' not found at {prompt_path}")
+
+        with open(prompt_path, 'r') as f:
+            prompt_template = f.read()
+
+        return PreparedPrompt(prompt_name, prompt_path, prompt_template, mtime)
+
+    def get_prompt(self, prompt_name: str) -> PreparedPrompt:
+        """Return the prepared prompt, reloading it if its file changed.
+
+        If a changed file fails to load, the previously loaded version keeps
+        being served.
+
+        Args:
+            prompt_name: Name of the prompt file (without extension)
+
+        Returns:
+            PreparedPrompt for the prompt
+
+        Raises:
+            FileNotFoundError: If the prompt was never loaded and its file is
+                not found
+        """
+        prepared = self._prompts.get(prompt_name)
+        if prepared is None:
+            prepared = self._read_prompt(prompt_name)
+            self._prompts[prompt_name] = prepared
+            self._checked_at[prompt_name] = time.monotonic()
+            return prepared
+
+        if self.reload_interval < 0:
+            return prepared
+
+        now = time.monotonic()
+        if now - self._checked_at[prompt_name] < self.reload_interval:
+            return prepared
+        self._checked_at[prompt_name] = now
+
+        try:
+            if prepared.path.stat().st_mtime == prepared.mtime:
+                return prepared
+            reloaded = self._read_prompt(prompt_name)
+        except Exception as e:
+            logger.error(f"Failed to reload prompt '{prompt_name}', keeping previous version: {str(e)}")
+            return prepared
+
+        if reloaded.variables != prepared.variables:
+            logger.warning(
+                f"Prompt '{prompt_name}' variables changed from {sorted(prepared.variables)} "
+                f"to {sorted(reloaded.variables)}"
+            )
+        logger.info(f"Reloaded prompt '{prompt_name}' (hash {reloaded.hash})")
+        self._prompts[prompt_name] = reloaded
+        return reloaded
+
+    def preload(self, prompt_variables: Dict[str, Iterable[str]]) -> None:
+        """Load prompts up front and check they use exactly the given variables.
+
+        Args:
+            prompt_variables: Variables each prompt will be formatted with,
+                keyed by prompt name
+
+        Raises:
+            FileNotFoundError: If a prompt file is not found
+            ValueError: If a prompt's variables do not match
+        """
+        for prompt_name, variables in prompt_variables.items():
+            prepared = self.get_prompt(prompt_name)
+            expected = frozenset(variables)
+            unknown = prepared.variables - expected
+            unused = expected - prepared.variables
+            if unknown or unused:
+                raise ValueError(
+                    f"Prompt '{prompt_name}' variables do not match: "
+                    f"unknown {sorted(unknown)}, unused {sorted(unused)}"
+                )
+            logger.info(f"Loaded prompt '{prompt_name}' (hash {prepared.hash})")
+
     def load_prompt(self, prompt_name: str, variables: Optional[Dict[str, Any]] = None) -> str:
-        """Load a prompt from file and inject variables if provided.
-        
+        """Load a prompt and inject variables if provided.
+
         Args:
             prompt_name: Name of the prompt file (without extension)
             variables: Dictionary of variables to format into the prompt
-            
+
         Returns:
             Formatted prompt string
-            
+
         Raises:
             FileNotFoundError: If prompt file is not found
             KeyError: If a required variable is missing
         """
         try:
-            prompt_path = self.prompts_dir / f"{prompt_name}.txt"
-            
-            if not prompt_path.exists():
-                logger.error(f"Prompt file not found: {prompt_path}")
-                raise FileNotFoundError(f"Prompt '{prompt_name}' not found at {prompt_path}")
-                
-            with open(prompt_path, 'r') as f:
-                prompt_template = f.read()
-            
-            if variables:
+            prepared = self.get_prompt(prompt_name)
+
+            if variables is not None:
                 try:
-                    return prompt_template.format(**variables)
+                    return prepared.format(variables)
                 except KeyError as e:
                     logger.error(f"Missing required variable in prompt '{prompt_name}': {e}")
                     raise KeyError(f"Missing required variable in prompt '{prompt_name}': {e}")
-            
-            return prompt_template
-            
+
+            return prepared.template
+
         except Exception as e:
             if isinstance(e, (FileNotFoundError, KeyError)):
                 raise
             logger.error(f"Error loading prompt '{prompt_name}': {str(e)}")
-            raise ValueError(f"Failed to load prompt '{prompt_name}': {str(e)}")
\ No newline at end of file
+            raise ValueError(f"Failed to load prompt '{prompt_name}': {str(e)}")
+
+    def template_hash(self, prompt_name: str) -> str:
+        """Return a short hash of a prompt template's contents.
+
+        Used to version cached results so that editing a prompt invalidates
+        the results produced by the old one.
+
+        Args:
+            prompt_name: Name of the prompt file (without extension)
+
+        Returns:
+            Hex digest of the unformatted prompt template
+        """
+        return self.get_prompt(prompt_name).hash
@@ -0,0 +1,226 @@
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def is_rate_limit_error(e: BaseException) -> bool:
+    """Whether an exception signals that an upstream quota was exceeded."""
+    status = getattr(e, "status", None) or getattr(e, "code", None)
+    if status == 429:
+        return True
+    if type(e).__name__ in ("ResourceExhausted", "TooManyRequests"):
+        return True
+    message = str(e).lower()
+    return "429" in message or "quota" in message or "rate limit" in message or "resource exhausted" in message
+
+
+class AdaptiveTokenBucket:
+    """Async token bucket whose rate adapts to upstream throttling (AIMD).
+
+    Callers `acquire` a token before each upstream call, which paces calls at
+    the current rate instead of bursting into the quota. When the upstream
+    signals throttling the rate is cut multiplicatively; every successful call
+    then adds back a small fixed step until the configured rate is reached.
+    """
+
+    def __init__(self,
+                 name: str,
+                 requests: int,
+                 timeframe: float,
+                 burst: int = 1,
+                 decrease_factor: float = 0.5,
+                 recovery_calls: int = 50,
+                 min_rate_fraction: float = 0.05,
+                 clock: Callable[[], float] = time.monotonic):
+        """Initialize the token bucket.
+
+        Args:
+            name: Name used in log messages
+            requests: Requests allowed per timeframe
+            timeframe: Length of the timeframe in seconds
+            burst: Maximum number of tokens that can accumulate
+            decrease_factor: Rate multiplier applied on throttling
+            recovery_calls: Successful calls needed to grow from the minimum
+                back to the configured rate
+            min_rate_fraction: Lowest rate, as a fraction of the configured rate
+            clock: Returns the current time in seconds
+        """
+        self.name = name
+        self._clock = clock
+        self.max_rate = requests / timeframe
+        self.min_rate = self.max_rate * min_rate_fraction
+        self.rate = self.max_rate
+        self.capacity = max(1.0, float(burst))
+        self.decrease_factor = decrease_factor
+        self.increase_step = (self.max_rate - self.min_rate) / max(1, recovery_calls)
+
+        self._tokens = self.capacity
+        self._updated_at = clock()
+        self._lock = asyncio.Lock()
+
+        self.throttles = 0
+        self.wait_seconds = 0.0
+
+    def _refill(self) -> None:
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    async def acquire(self) -> None:
+        """Wait until a token is available and take it.
+
+        Waiters are served one at a time, in arrival order.
+        """
+        async with self._lock:
+            self._refill()
+            while self._tokens < 1:
+                delay = (1 - self._tokens) / self.rate
+                self.wait_seconds += delay
+                await asyncio.sleep(delay)
+                self._refill()
+            self._tokens -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the current rate and throttling counters."""
+        return {
+            "rate_per_second": self.rate,
+            "max_rate_per_second": self.max_rate,
+            "throttles": self.throttles,
+            "wait_seconds": self.wait_seconds,
+        }
+
+    async def on_success(self) -> None:
+        """Additively grow the rate back towards the configured maximum."""
+        if self.rate < self.max_rate:
+            self._refill()
+            self.rate = min(self.max_rate, self.rate + self.increase_step)
+
+    async def on_throttle(self) -> None:
+        """Multiplicatively cut the rate after the upstream throttled a call."""
+        self._refill()
+        self.throttles += 1
+        self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+        # Drain the bucket so the next call waits at the reduced rate
+        self._tokens = min(self._tokens, 0.0)
+        logger.warning(f"{self.name} throttled upstream; reducing rate to {self.rate * 60:.1f} requests/min")
+
+
+class SharedTokenBucket(AdaptiveTokenBucket):
+    """Adaptive token bucket whose state is shared by processes through SQLite.
+
+    Worker processes of one server pace their calls against the same rate
+    instead of each getting the full quota. The bucket is kept as a
+    theoretical arrival time (GCRA): every `acquire` reserves the next free
+    slot in one short transaction and then sleeps until it, so waiters are
+    served in reservation order across processes without polling. Throttling
+    and recovery adjust the shared rate.
+    """
+
+    def __init__(self, name: str, requests: int, timeframe: float, burst: int = 1, path: str = "",
+                 clock: Callable[[], float] = time.time, **kwargs: Any):
+        """Initialize the token bucket.
+
+        Args:
+            name: Name used in log messages and as the bucket's key
+            requests: Requests allowed per timeframe
+            timeframe: Length of the timeframe in seconds
+            burst: Maximum number of calls that can be made back to back
+            path: Path of the SQLite database file holding the bucket
+            clock: Returns the current time in seconds, the same in every
+                process sharing the bucket
+            **kwargs: Passed to AdaptiveTokenBucket
+        """
+        super().__init__(name, requests, timeframe, burst, clock=clock, **kwargs)
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._db_lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS rate_limits ("
+            " name TEXT PRIMARY KEY,"
+            " rate REAL NOT NULL,"
+            " arrival_at REAL NOT NULL)"
+        )
+        # Keep the rate if another process has already backed off
+        self._conn.execute(
+            "INSERT INTO rate_limits (name, rate, arrival_at) VALUES (?, ?, ?)"
+            " ON CONFLICT (name) DO UPDATE SET rate = MIN(rate, excluded.rate)",
+            (name, self.max_rate, clock())
+        )
+
+    def _transaction(self, update: Callable[[float, float, float], Tuple[float, float, Any]]) -> Any:
+        """Apply `update(rate, arrival_at, now)` to the shared state and return its result."""
+        with self._db_lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rate, arrival_at = self._conn.execute(
+                    "SELECT rate, arrival_at FROM rate_limits WHERE name = ?", (self.name,)
+                ).fetchone()
+                rate, arrival_at, result = update(rate, arrival_at, self._clock())
+                self._conn.execute(
+                    "UPDATE rate_limits SET rate = ?, arrival_at = ? WHERE name = ?", (rate, arrival_at, self.name)
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        self.rate = rate
+        return result
+
+    def _reserve(self) -> float:
+        """Reserve the next free slot and return how long to wait for it."""
+        def update(rate: float, arrival_at: float, now: float) -> Tuple[float, float, float]:
+            interval = 1 / rate
+            start = max(now, arrival_at - (self.capacity - 1) * interval)
+            return rate, max(arrival_at, start) + interval, start - now
+        return self._transaction(update)
+
+    async def acquire(self) -> None:
+        """Wait until the next slot reserved for this call."""
+        delay = await asyncio.to_thread(self._reserve)
+        if delay > 0:
+            self.wait_seconds += delay
+            await asyncio.sleep(delay)
+
+    async def on_success(self) -> None:
+        """Additively grow the shared rate back towards the configured maximum."""
+        if self.rate < self.max_rate:
+            await asyncio.to_thread(self._transaction, lambda rate, arrival_at, now: (
+                min(self.max_rate, rate + self.increase_step), arrival_at, None
+            ))
+
+    async def on_throttle(self) -> None:
+        """Multiplicatively cut the shared rate after the upstream throttled a call."""
+        def update(rate: float, arrival_at: float, now: float) -> Tuple[float, float, None]:
+            rate = max(self.min_rate, rate * self.decrease_factor)
+            # Push back the next free slot so the next call waits at the reduced rate
+            return rate, max(arrival_at, now + 1 / rate), None
+        await asyncio.to_thread(self._transaction, update)
+        self.throttles += 1
+        logger.warning(f"{self.name} throttled upstream; reducing rate to {self.rate * 60:.1f} requests/min")
+
+    def close(self) -> None:
+        with self._db_lock:
+            self._conn.close()
+
+
+def create_rate_limiter(name: str, enabled: bool, requests: int, timeframe: float,
+                        burst: int, shared_path: Optional[str] = None) -> Optional[AdaptiveTokenBucket]:
+    """Build a token bucket from settings, or None when rate limiting is disabled.
+
+    With `shared_path`, the bucket is shared through that SQLite database
+    with every process using the same name.
+    """
+    if not enabled:
+        return None
+    if shared_path is not None:
+        return SharedTokenBucket(name, requests, timeframe, burst, path=shared_path)
+    return AdaptiveTokenBucket(name, requests, timeframe, burst)
@@ -0,0 +1,318 @@
+import asyncio
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+from enum import Enum
+from pathlib import Path
+from typing import Dict, Any, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Outcome of the most recent cache lookup in the current request context
+# ("HIT", "MISS" or "BYPASS"), used to populate the X-Cache response header.
+cache_status: ContextVar[Optional[str]] = ContextVar("cache_status", default=None)
+
+# Whether the most recently revalidated product changed since its stored
+# result was computed ("UNCHANGED", "CHANGED" or "NEW")
+change_status: ContextVar[Optional[str]] = ContextVar("change_status", default=None)
+
+
+class CacheMode(str, Enum):
+    """How a request interacts with the result cache."""
+    USE = "use"          # read from and write to the cache
+    REFRESH = "refresh"  # skip the read, but store the fresh result
+    REVALIDATE = "revalidate"  # reuse a stored result only if the product's fingerprint is unchanged
+    BYPASS = "bypass"    # neither read from nor write to the cache
+
+
+class MemoryLRUCache:
+    """Bounded in-process LRU cache with a per-entry TTL."""
+
+    def __init__(self, max_entries: int, ttl: float):
+        """Initialize the memory cache.
+
+        Args:
+            max_entries: Maximum number of entries kept before evicting
+            ttl: Time-to-live of each entry in seconds
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        expires_at, value = entry
+        if time.monotonic() >= expires_at:
+            del self._entries[key]
+            self.expirations += 1
+            return None
+
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Dict[str, Any]) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def delete(self, key: str) -> None:
+        self._entries.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SQLiteCache:
+    """Persistent cache tier stored in a SQLite database in WAL mode."""
+
+    def __init__(self, path: str, ttl: float, fingerprint_ttl: Optional[float] = None):
+        """Initialize the SQLite cache and create its table if needed.
+
+        Args:
+            path: Path of the SQLite database file
+            ttl: Time-to-live of each entry in seconds
+            fingerprint_ttl: How long entries with a fingerprint are kept
+                for revalidation, in seconds (defaults to `ttl`)
+        """
+        self.path = Path(path)
+        self.ttl = ttl
+        self.fingerprint_ttl = fingerprint_ttl if fingerprint_ttl is not None else ttl
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " fingerprint TEXT)"
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(results)")}
+        if "fingerprint" not in columns:
+            self._conn.execute("ALTER TABLE results ADD COLUMN fingerprint TEXT")
+        # Counted once here and kept up to date by writes and purges, so
+        # count() doesn't scan the table; writes by other processes sharing
+        # the cache are picked up on the next start
+        self.entries = self._conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM results WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+
+        value, created_at = row
+        if time.time() - created_at >= self.ttl:
+            return None
+        return json.loads(value)
+
+    def get_fingerprinted(self, key: str) -> Optional[Tuple[Optional[str], Dict[str, Any]]]:
+        """Return an entry and the fingerprint stored with it, even if it has expired."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT fingerprint, value FROM results WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        fingerprint, value = row
+        return fingerprint, json.loads(value)
+
+    def set(self, key: str, value: Dict[str, Any], fingerprint: Optional[str] = None) -> None:
+        with self._lock:
+            exists = self._conn.execute("SELECT 1 FROM results WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results (key, value, created_at, fingerprint) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), time.time(), fingerprint)
+            )
+            if exists is None:
+                self.entries += 1
+
+    def purge_expired(self) -> int:
+        """Delete expired entries and return how many were removed.
+
+        Entries with a fingerprint can still be revalidated after they
+        expire, so they are kept until `fingerprint_ttl` has passed.
+        """
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM results WHERE created_at <= ?"
+                " AND (fingerprint IS NULL OR created_at <= ?)",
+                (now - self.ttl, now - self.fingerprint_ttl)
+            )
+            self.entries = max(0, self.entries - cursor.rowcount)
+        return cursor.rowcount
+
+    def count(self) -> int:
+        return self.entries
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class ResultCache:
+    """Two-tier categorization result cache.
+
+    Lookups go to a bounded in-memory LRU first and fall back to a persistent
+    SQLite tier that survives restarts. Hits from the SQLite tier are promoted
+    into memory.
+
+    The SQLite tier also stores a fingerprint of each result's inputs, so a
+    result can be revalidated against the product's current data: when the
+    fingerprint is unchanged the result is reused, however old it is.
+    """
+
+    def __init__(self,
+                 memory_max_entries: int,
+                 memory_ttl: float,
+                 db_path: str,
+                 disk_ttl: float,
+                 fingerprint_ttl: Optional[float] = None):
+        """Initialize both cache tiers.
+
+        Args:
+            memory_max_entries: Maximum number of entries in the memory tier
+            memory_ttl: Time-to-live of memory entries in seconds
+            db_path: Path of the SQLite database file
+            disk_ttl: Time-to-live of SQLite entries in seconds
+            fingerprint_ttl: How long SQLite entries with a fingerprint are
+                kept for revalidation after their last use, in seconds
+                (defaults to `disk_ttl`)
+        """
+        self.memory = MemoryLRUCache(memory_max_entries, memory_ttl)
+        self.disk = SQLiteCache(db_path, disk_ttl, fingerprint_ttl)
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.unchanged = 0
+        self.changed = 0
+        self.new = 0
+
+        purged = self.disk.purge_expired()
+        if purged:
+            logger.info(f"Purged {purged} expired entries from result cache")
+
+    @staticmethod
+    def make_key(product_id: str, endpoint: str, prompt_hash: str, model_name: str, temperature: float) -> str:
+        """Build a cache key from everything that influences a result.
+
+        Args:
+            product_id: The Woolworths product ID
+            endpoint: Name of the categorization endpoint
+            prompt_hash: Hash of the prompt template used
+            model_name: Name of the model used
+            temperature: Sampling temperature used
+
+        Returns:
+            Hex digest identifying the cached result
+        """
+        raw = json.dumps([product_id, endpoint, prompt_hash, model_name, temperature])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def make_fingerprint(variables: Dict[str, Any], prompt_hash: str, model_name: str, temperature: float) -> str:
+        """Fingerprint everything a result was computed from.
+
+        Args:
+            variables: Product data the prompt is formatted with
+            prompt_hash: Hash of the prompt template used
+            model_name: Name of the model used
+            temperature: Sampling temperature used
+
+        Returns:
+            Hex digest that changes whenever any input changes
+        """
+        raw = json.dumps([variables, prompt_hash, model_name, temperature], sort_keys=True)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    async def revalidate(self, key: str, fingerprint: str) -> Optional[Dict[str, Any]]:
+        """Return the stored result if it was computed from the same inputs.
+
+        Sets the `change_status` context variable to UNCHANGED, CHANGED or NEW.
+
+        Args:
+            key: Cache key of the result
+            fingerprint: Fingerprint of the product's current inputs
+
+        Returns:
+            The stored result when its fingerprint matches, otherwise None
+        """
+        try:
+            stored = await asyncio.to_thread(self.disk.get_fingerprinted, key)
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to read cache entry: {str(e)}")
+            stored = None
+
+        if stored is None:
+            self.new += 1
+            change_status.set("NEW")
+            return None
+        stored_fingerprint, value = stored
+        if stored_fingerprint != fingerprint:
+            self.changed += 1
+            change_status.set("CHANGED")
+            return None
+        self.unchanged += 1
+        change_status.set("UNCHANGED")
+        return value
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Look up a cached result, checking memory before SQLite."""
+        value = self.memory.get(key)
+        if value is not None:
+            self.memory_hits += 1
+            return value
+
+        value = await asyncio.to_thread(self.disk.get, key)
+        if value is not None:
+            self.disk_hits += 1
+            self.memory.set(key, value)
+            return value
+
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, value: Dict[str, Any], fingerprint: Optional[str] = None) -> None:
+        """Store a result in both tiers, with the fingerprint of its inputs in SQLite."""
+        self.memory.set(key, value)
+        try:
+            await asyncio.to_thread(self.disk.set, key, value, fingerprint)
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to persist cache entry: {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss/eviction counters for both tiers."""
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_ratio": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+            "memory_entries": len(self.memory),
+            "memory_evictions": self.memory.evictions,
+            "memory_expirations": self.memory.expirations,
+            "disk_entries": self.disk.count(),
+            "revalidated_unchanged": self.unchanged,
+            "revalidated_changed": self.changed,
+            "revalidated_new": self.new,
+        }
+
+    def close(self) -> None:
+        self.disk.close()
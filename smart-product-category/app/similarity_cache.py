@@ -0,0 +1,343 @@
+import array
+import asyncio
+import hashlib
+import json
+import logging
+import random
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from product_utils import ProductDataExtractor
+
+logger = logging.getLogger(__name__)
+
+_NON_ALNUM = re.compile(r"[^a-z0-9]+")
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+# Seconds re-read before the newest synced entry, see SimilarityCache._sync
+SYNC_OVERLAP = 5.0
+
+
+def normalize_name(name: str) -> str:
+    """Lower-case a product name and drop its package size and punctuation.
+
+    "Woolworths Full Cream Milk 2L" and "Woolworths Full Cream Milk 3L"
+    both become "woolworths full cream milk".
+    """
+    name = ProductDataExtractor.strip_package_size(name).lower().replace("&", " and ")
+    return " ".join(_NON_ALNUM.sub(" ", name).split())
+
+
+def shingles(name: str, size: int = 3) -> Set[str]:
+    """Character n-grams of a normalized name, padded so short words count."""
+    padded = f" {name} "
+    if len(padded) <= size:
+        return {padded}
+    return {padded[i:i + size] for i in range(len(padded) - size + 1)}
+
+
+def jaccard(a: Set[str], b: Set[str]) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+class SimilarMatch(NamedTuple):
+    """A previously categorized near-duplicate of a looked-up name."""
+    value: Dict[str, Any]
+    similarity: float
+    name: str
+
+
+class _Entry(NamedTuple):
+    value: Dict[str, Any]
+    bands: Tuple[int, ...]
+    created_at: float
+
+
+class MinHashLSH:
+    """MinHash signatures over character n-grams, banded for LSH lookups.
+
+    Names whose n-gram sets have Jaccard similarity s share at least one band
+    with probability 1 - (1 - s^rows)^bands, so near-duplicates are found by
+    looking in a handful of buckets instead of comparing against every entry.
+    """
+
+    def __init__(self, num_perm: int = 64, bands: int = 16, seed: int = 1):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        rng = random.Random(seed)
+        self._perms = [(rng.randrange(1, _MERSENNE_PRIME), rng.randrange(0, _MERSENNE_PRIME))
+                       for _ in range(num_perm)]
+
+    def signature(self, grams: Set[str]) -> List[int]:
+        hashes = [zlib.crc32(gram.encode("utf-8")) for gram in grams]
+        return [min(((a * h + b) % _MERSENNE_PRIME) & _MAX_HASH for h in hashes) for a, b in self._perms]
+
+    def band_keys(self, namespace: str, grams: Set[str]) -> Tuple[int, ...]:
+        """Bucket key of each band, salted with the namespace."""
+        signature = self.signature(grams)
+        salt = zlib.crc32(namespace.encode("utf-8"))
+        keys = []
+        for band in range(self.bands):
+            rows = array.array("I", signature[band * self.rows:(band + 1) * self.rows]).tobytes()
+            keys.append((band << 32) | zlib.crc32(rows, salt))
+        return tuple(keys)
+
+
+class SimilarityCache:
+    """Reuses categorizations across near-duplicate product names.
+
+    Many products differ only in size or pack count ("... Milk 2L" and
+    "... Milk 3L") and categorize the same way. Names are normalized with
+    their sizes removed and indexed with MinHash LSH. A lookup returns the
+    result of the most similar previously categorized name, if its character
+    trigram Jaccard similarity reaches the threshold.
+
+    Entries are scoped to a namespace (endpoint, prompt, model) so results
+    are only reused where the exact-match result cache would reuse them.
+    The index is bounded to `max_entries` names, evicting the least recently
+    used, and persisted to SQLite so it survives restarts. When several
+    processes share the database, `sync_interval` makes each one pick up
+    entries the others added.
+    """
+
+    def __init__(self,
+                 threshold: float,
+                 max_entries: int,
+                 db_path: str,
+                 ttl: float,
+                 num_perm: int = 64,
+                 bands: int = 16,
+                 sync_interval: float = 0.0):
+        """Initialize the cache and load persisted entries.
+
+        Args:
+            threshold: Minimum similarity (0-1) for reusing a result
+            max_entries: Maximum number of names kept in the index
+            db_path: Path of the SQLite database file
+            ttl: Time-to-live of each entry in seconds
+            num_perm: Number of MinHash permutations
+            bands: Number of LSH bands the signature is split into
+            sync_interval: Minimum seconds between reads of entries added by
+                other processes (0 disables them)
+        """
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.sync_interval = sync_interval
+        self._synced_at = 0.0
+        self._sync_task: Optional["asyncio.Task[List[Tuple[str, str, str, bytes, float]]]"] = None
+        self._synced_through = 0.0
+        self.lsh = MinHashLSH(num_perm, bands)
+        self._entries: "OrderedDict[Tuple[str, str], _Entry]" = OrderedDict()
+        self._buckets: Dict[int, Set[Tuple[str, str]]] = {}
+        self.lookups = 0
+        self.hits = 0
+        self.evictions = 0
+        self.synced = 0
+
+        self.path = Path(db_path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS similar_results ("
+            " namespace TEXT NOT NULL,"
+            " name TEXT NOT NULL,"
+            " value TEXT NOT NULL,"
+            " bands BLOB NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " PRIMARY KEY (namespace, name))"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS similar_results_created_at ON similar_results (created_at)"
+        )
+        self._load()
+
+    @staticmethod
+    def make_namespace(endpoint: str, prompt_hash: str, model_name: str, temperature: float) -> str:
+        """Build the namespace of results produced under the same prompt and model."""
+        raw = json.dumps([endpoint, prompt_hash, model_name, temperature])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+    def _load(self) -> None:
+        """Load the most recent unexpired entries and trim the rest from disk."""
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            self._conn.execute("DELETE FROM similar_results WHERE created_at <= ?", (cutoff,))
+            self._conn.execute(
+                "DELETE FROM similar_results WHERE rowid NOT IN ("
+                " SELECT rowid FROM similar_results ORDER BY created_at DESC LIMIT ?)",
+                (self.max_entries,)
+            )
+            rows = self._conn.execute(
+                "SELECT namespace, name, value, bands, created_at FROM similar_results ORDER BY created_at"
+            ).fetchall()
+
+        for namespace, name, value, bands, created_at in rows:
+            self._insert((namespace, name), _Entry(json.loads(value), tuple(array.array("Q", bands)), created_at))
+        if rows:
+            logger.info(f"Loaded {len(rows)} entries into the similarity cache")
+        self._synced_at = time.monotonic()
+        self._synced_through = rows[-1][4] if rows else cutoff
+
+    def _sync(self) -> None:
+        """Start indexing entries other processes persisted since the last load or sync.
+
+        The read runs in a thread, and its rows are indexed on the event loop
+        once it finishes, so lookups never wait for SQLite.
+        """
+        now = time.monotonic()
+        if self._sync_task is not None or now - self._synced_at < self.sync_interval:
+            return
+        self._synced_at = now
+        # Entries are persisted shortly after they are timestamped, so look
+        # back a little to catch ones written out of order
+        since = self._synced_through - SYNC_OVERLAP
+        self._sync_task = asyncio.get_running_loop().create_task(asyncio.to_thread(self._read_since, since))
+        self._sync_task.add_done_callback(self._apply_sync)
+
+    def _read_since(self, since: float) -> List[Tuple[str, str, str, bytes, float]]:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT namespace, name, value, bands, created_at FROM similar_results"
+                " WHERE created_at > ? ORDER BY created_at",
+                (since,)
+            ).fetchall()
+
+    def _apply_sync(self, task: "asyncio.Task[List[Tuple[str, str, str, bytes, float]]]") -> None:
+        self._sync_task = None
+        if task.cancelled():
+            return
+        if task.exception() is not None:
+            logger.warning(f"Failed to sync the similarity cache: {str(task.exception())}")
+            return
+
+        rows = task.result()
+        for namespace, name, value, bands, created_at in rows:
+            key = (namespace, name)
+            current = self._entries.get(key)
+            if current is not None and current.created_at >= created_at:
+                continue
+            self._insert(key, _Entry(json.loads(value), tuple(array.array("Q", bands)), created_at))
+            self.synced += 1
+        if rows:
+            self._synced_through = max(self._synced_through, rows[-1][4])
+
+    def _insert(self, key: Tuple[str, str], entry: _Entry) -> None:
+        self._remove(key)
+        self._entries[key] = entry
+        for band_key in entry.bands:
+            self._buckets.setdefault(band_key, set()).add(key)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _remove(self, key: Tuple[str, str]) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for band_key in entry.bands:
+            bucket = self._buckets.get(band_key)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self._buckets[band_key]
+
+    def lookup(self, namespace: str, name: str, required_keys: Iterable[str] = ()) -> Optional[SimilarMatch]:
+        """Find the result of the most similar name categorized before.
+
+        Args:
+            namespace: Namespace from `make_namespace`
+            name: Product display name
+            required_keys: Keys a result must have to be reused
+
+        Returns:
+            The reused result, or None when no indexed name is similar enough
+        """
+        self.lookups += 1
+        if self.sync_interval > 0:
+            self._sync()
+        normalized = normalize_name(name)
+        if not normalized:
+            return None
+
+        required_keys = tuple(required_keys)
+        matches: List[Tuple[float, Tuple[str, str]]] = []
+        exact = self._entries.get((namespace, normalized))
+        if exact is not None and all(required in exact.value for required in required_keys):
+            matches.append((1.0, (namespace, normalized)))
+        grams = shingles(normalized)
+        candidates = set()
+        for band_key in self.lsh.band_keys(namespace, grams):
+            candidates.update(self._buckets.get(band_key, ()))
+        candidates.discard((namespace, normalized))
+        for key in candidates:
+            if key[0] != namespace or not all(required in self._entries[key].value for required in required_keys):
+                continue
+            similarity = jaccard(grams, shingles(key[1]))
+            if similarity >= self.threshold:
+                matches.append((similarity, key))
+
+        # Take the most similar unexpired entry, dropping expired ones on the way
+        now = time.time()
+        for similarity, key in sorted(matches, key=lambda match: match[0], reverse=True):
+            entry = self._entries[key]
+            if now - entry.created_at >= self.ttl:
+                self._remove(key)
+                continue
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return SimilarMatch(entry.value, similarity, key[1])
+        return None
+
+    async def add(self, namespace: str, name: str, value: Dict[str, Any]) -> None:
+        """Index a categorization result under the product's normalized name."""
+        normalized = normalize_name(name)
+        if not normalized:
+            return
+
+        key = (namespace, normalized)
+        entry = _Entry(value, self.lsh.band_keys(namespace, shingles(normalized)), time.time())
+        self._insert(key, entry)
+        try:
+            await asyncio.to_thread(self._persist, key, entry)
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to persist similarity cache entry: {str(e)}")
+
+    def _persist(self, key: Tuple[str, str], entry: _Entry) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO similar_results (namespace, name, value, bands, created_at)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (key[0], key[1], json.dumps(entry.value), array.array("Q", entry.bands).tobytes(), entry.created_at)
+            )
+
+    def stats(self) -> Dict[str, Any]:
+        """Return lookup counters and the index size."""
+        return {
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_ratio": self.hits / self.lookups if self.lookups else 0.0,
+            "entries": len(self._entries),
+            "buckets": len(self._buckets),
+            "evictions": self.evictions,
+            "synced": self.synced,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,110 @@
+import asyncio
+import logging
+import math
+from typing import Any, Awaitable, Callable, Dict, Hashable, TypeVar
+
+from admission import Priority, current_priority
+from deadline import DeadlineExceeded, current_deadline, item_deadline
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class _Call:
+    """An in-flight call, the deadline and priority it runs under, and its waiters."""
+
+    def __init__(self, task: "asyncio.Future[Any]", expires_at: float, priority: Priority):
+        self.task = task
+        self.expires_at = expires_at
+        self.priority = priority
+        self.waiters = 0
+
+    def serves(self, expires_at: float, priority: Priority) -> bool:
+        """Whether the call runs under a deadline and priority at least as generous as the given ones."""
+        return self.expires_at >= expires_at and self.priority <= priority
+
+
+class SingleFlight:
+    """Coalesces concurrent calls that share a key into one execution.
+
+    The first caller for a key starts the work; callers arriving while it is
+    still running await the same future and receive its result or exception.
+    The work is cancelled only once every waiting caller has gone away.
+
+    The work runs under the deadline and priority of the caller that started
+    it, with a retry budget of its own. A caller only joins a call that runs
+    under a deadline at least as late and a priority at least as high as its
+    own; otherwise it starts a new call, which later callers join instead.
+    Each caller stops waiting when its own deadline passes.
+    """
+
+    def __init__(self, name: str):
+        """Initialize the single-flight group.
+
+        Args:
+            name: Name used in log messages
+        """
+        self.name = name
+        self._calls: Dict[Hashable, _Call] = {}
+        self.executed = 0
+        self.coalesced = 0
+
+    def _forget(self, key: Hashable, call: _Call) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    @staticmethod
+    async def _run(fn: Callable[[], Awaitable[T]]) -> T:
+        with item_deadline():
+            return await fn()
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        """Run `fn` for `key`, or join an identical call already in flight.
+
+        Args:
+            key: Identifies calls that can share a result
+            fn: Coroutine function performing the work
+
+        Returns:
+            The result of the (possibly shared) call
+
+        Raises:
+            DeadlineExceeded: If the caller's deadline passes while it waits
+            Exception: Whatever the shared call raised
+        """
+        deadline = current_deadline()
+        expires_at = math.inf if deadline is None else deadline.expires_at
+        priority = current_priority()
+
+        call = self._calls.get(key)
+        if call is None or not call.serves(expires_at, priority):
+            call = _Call(asyncio.ensure_future(self._run(fn)), expires_at, priority)
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _, key=key, call=call: self._forget(key, call))
+            self.executed += 1
+        else:
+            self.coalesced += 1
+            logger.debug(f"Joining in-flight {self.name} call for key: {key}")
+
+        call.waiters += 1
+        try:
+            if deadline is None:
+                return await asyncio.shield(call.task)
+            return await asyncio.wait_for(asyncio.shield(call.task), deadline.remaining())
+        except asyncio.TimeoutError:
+            if call.task.done():
+                raise
+            raise DeadlineExceeded(f"Request deadline of {deadline.timeout:g}s exceeded waiting for {self.name} call")
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                call.task.cancel()
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return execution and coalescing counters."""
+        return {"executed": self.executed, "coalesced": self.coalesced, "in_flight": self.in_flight}
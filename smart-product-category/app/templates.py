@@ -17,4 +17,44 @@ Important:
 7. Be specific and accurate - don't make up information that isn't in the prompt
 8. Keep each entry concise - use short phrases rather than sentences
 
-Response:"""
\ No newline at end of file
+Response:"""
+
+PACKED_JSON_RESPONSE_TEMPLATE = """You are a helpful AI assistant that always responds in valid JSON format.
+
+Your task is to follow the instructions below for EACH of the products listed, and structure the result for each product according to the exact JSON schema provided.
+
+Instructions: {prompt}
+
+Products:
+{products}
+
+You must format your entire response as a valid JSON array containing exactly one element per product, in this form:
+[{{"id": "<product id>", "result": <object following the schema>}}]
+
+Schema for each "result" object:
+{json_structure}
+
+Important:
+1. Ensure your response is valid JSON
+2. Start with a [ (opening square bracket)
+3. End with a ] (closing square bracket)
+4. Use double quotes for strings
+5. Copy each product id exactly as given
+6. Follow the schema exactly for every result
+7. For array fields, provide at least one item if information is available, or empty array if not
+8. Be specific and accurate - don't make up information that isn't in the product's own details
+9. Keep each entry concise - use short phrases rather than sentences
+
+Response:"""
+
+PACKED_PRODUCT_TEMPLATE = """### Product id: {product_id}
+{product}"""
+
+CATEGORY_PACK_ITEM_TEMPLATE = """PRODUCT NAME: {product_name}"""
+
+ENHANCED_CATEGORY_PACK_ITEM_TEMPLATE = """PRODUCT NAME: {product_name}
+PRODUCT DESCRIPTION: {product_description}
+INGREDIENTS: {ingredients}
+PACKAGE SIZE: {package_size}
+DIETARY INFO: {dietary_info}
+DEPARTMENT/CATEGORY: {department_category}"""
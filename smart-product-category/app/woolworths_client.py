@@ -1,15 +1,27 @@
 import aiohttp
+import asyncio
 import logging
-import backoff
-from typing import Dict, Any, Optional
-from aiohttp import ClientSession, ClientError, ClientTimeout
+import sqlite3
+import time
+from typing import Dict, Any, Optional, Set
+from aiohttp import ClientSession, ClientError, ClientTimeout, DummyCookieJar, TCPConnector
+from config import settings
+from deadline import deadline_retry
+from metrics import timed_stage, UPSTREAM_HEDGES, UPSTREAM_IN_FLIGHT
+from product_store import ProductSnapshotStore
+from rate_limiter import AdaptiveTokenBucket, create_rate_limiter
+from single_flight import SingleFlight
 
 logger = logging.getLogger(__name__)
 
 class WoolworthsClient:
     """Client for interacting with the Woolworths product API."""
     
-    BASE_URL = "https://www.woolworths.com.au/apis/ui/product/detail"
+    PRODUCT_DETAIL_PATH = "/apis/ui/product/detail"
+    COOKIE_PATH = "/shop/productdetails/"
+    
+    # Products waiting for a background refresh
+    REFRESH_QUEUE_SIZE = 1000
     
     # Default timeout values (in seconds)
     DEFAULT_TIMEOUT = ClientTimeout(total=30, connect=10, sock_read=30)
@@ -31,18 +43,106 @@ class WoolworthsClient:
         "x-user-id": "anonymous"
     }
 
-    def __init__(self, timeout: Optional[ClientTimeout] = None):
+    def __init__(self, timeout: Optional[ClientTimeout] = None,
+                 rate_limiter: Optional[AdaptiveTokenBucket] = None,
+                 base_url: Optional[str] = None,
+                 snapshots: Optional[ProductSnapshotStore] = None):
         """Initialize the Woolworths client.
         
+        The underlying HTTP session is created lazily (or by `start`) and is
+        shared by all requests made through this client.
+        
         Args:
             timeout: Optional custom timeout for API requests
+            rate_limiter: Token bucket pacing outbound requests (defaults to
+                one built from the WOOLWORTHS_RATE_LIMIT_* settings)
+            base_url: Site root to send requests to (defaults to the
+                WOOLWORTHS_BASE_URL setting)
+            snapshots: Store of fetched product details, read before the
+                API and refreshed in the background once stale
         """
         self.timeout = timeout or self.DEFAULT_TIMEOUT
+        self.base_url = (base_url or settings.woolworths_base_url).rstrip("/")
+        self.rate_limiter = rate_limiter or create_rate_limiter(
+            "Woolworths",
+            settings.rate_limit_enabled,
+            settings.woolworths_rate_limit_requests,
+            settings.woolworths_rate_limit_timeframe,
+            settings.woolworths_rate_limit_burst,
+            settings.rate_limit_db_path if settings.multi_worker else None
+        )
+        self._session: Optional[ClientSession] = None
+        self._cookies: Optional[Dict[str, str]] = None
+        self._cookies_expire_at = 0.0
+        self._cookie_lock = asyncio.Lock()
+        self.product_flights = SingleFlight("woolworths product details")
+        self.snapshots = snapshots
+        self._refresh_queue: "asyncio.Queue[str]" = asyncio.Queue(self.REFRESH_QUEUE_SIZE)
+        self._refresh_pending: Set[str] = set()
+        self._refresher: Optional["asyncio.Task[None]"] = None
+        self.snapshot_hits = 0
+        self.snapshot_stale_hits = 0
+        self.snapshot_misses = 0
+        self.refreshes = 0
+        self.refresh_failures = 0
+
+    async def start(self) -> None:
+        """Create the shared HTTP session and start refreshing stale snapshots."""
+        await self._get_session()
+        if self.snapshots is not None and self._refresher is None:
+            self._refresher = asyncio.create_task(self._refresh_loop())
+
+    async def close(self) -> None:
+        """Stop the snapshot refresher, close the shared HTTP session and drop cached cookies."""
+        if self._refresher is not None:
+            self._refresher.cancel()
+            await asyncio.gather(self._refresher, return_exceptions=True)
+            self._refresher = None
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        self._cookies = None
+        self._cookies_expire_at = 0.0
+
+    async def _get_session(self) -> ClientSession:
+        """Return the shared HTTP session, creating it on first use.
+        
+        Returns:
+            Long-lived ClientSession with a keep-alive connection pool
+        """
+        if self._session is None or self._session.closed:
+            connector = TCPConnector(
+                limit=settings.woolworths_pool_limit,
+                limit_per_host=settings.woolworths_pool_limit_per_host,
+                keepalive_timeout=settings.woolworths_keepalive_timeout,
+                ttl_dns_cache=settings.woolworths_dns_cache_ttl,
+            )
+            # Cookies are managed explicitly so they can be cached with a TTL
+            self._session = ClientSession(
+                connector=connector,
+                timeout=self.timeout,
+                headers=self.HEADERS,
+                cookie_jar=DummyCookieJar(),
+            )
+        return self._session
+
+    async def _acquire(self) -> None:
+        """Wait for the rate limiter before sending a request."""
+        if self.rate_limiter is not None:
+            await self.rate_limiter.acquire()
+
+    async def _record_status(self, status: int) -> None:
+        """Feed a response status back into the rate limiter."""
+        if self.rate_limiter is None:
+            return
+        if status == 429:
+            await self.rate_limiter.on_throttle()
+        else:
+            await self.rate_limiter.on_success()
 
-    @backoff.on_exception(
-        backoff.expo, 
+    @deadline_retry(
+        "woolworths",
         (ClientError, TimeoutError),
-        max_tries=3,
         giveup=lambda e: isinstance(e, aiohttp.ClientResponseError) and e.status >= 400 and e.status != 429
     )
     async def _get_session_cookies(self) -> Dict[str, str]:
@@ -54,28 +154,210 @@ class WoolworthsClient:
         Raises:
             Exception: If unable to retrieve cookies after retries
         """
-        async with ClientSession(timeout=self.timeout) as session:
-            try:
-                async with session.get(
-                    "https://www.woolworths.com.au/shop/productdetails/", 
-                    headers=self.HEADERS
-                ) as response:
+        session = await self._get_session()
+        await self._acquire()
+        try:
+            with timed_stage("cookie_fetch"), UPSTREAM_IN_FLIGHT.labels("woolworths").track_inprogress():
+                async with session.get(f"{self.base_url}{self.COOKIE_PATH}") as response:
+                    await self._record_status(response.status)
                     response.raise_for_status()
                     cookies = response.cookies
                     return {cookie.key: cookie.value for cookie in cookies.values()}
-            except ClientError as e:
-                logger.error(f"Error retrieving session cookies: {str(e)}")
-                raise
+        except ClientError as e:
+            logger.error(f"Error retrieving session cookies: {str(e)}")
+            raise
+
+    async def _get_cookies(self, force_refresh: bool = False) -> Dict[str, str]:
+        """Return cached session cookies, fetching new ones when expired.
+        
+        Concurrent callers share a single refresh.
+        
+        Args:
+            force_refresh: Discard the cached cookies and fetch new ones
+            
+        Returns:
+            Dictionary of cookies needed for API requests
+        """
+        async with self._cookie_lock:
+            if force_refresh or self._cookies is None or time.monotonic() >= self._cookies_expire_at:
+                logger.info("Refreshing Woolworths session cookies")
+                self._cookies = await self._get_session_cookies()
+                self._cookies_expire_at = time.monotonic() + settings.woolworths_cookie_ttl
+            return self._cookies
+
+    def _invalidate_cookies(self, stale_cookies: Dict[str, str]) -> None:
+        """Drop the cached cookies unless another request already refreshed them."""
+        if self._cookies is stale_cookies:
+            self._cookies = None
+
+    async def get_product_details(self, product_id: str) -> Dict[str, Any]:
+        """Fetch product details from Woolworths API.
+        
+        With a snapshot store, a stored snapshot younger than
+        PRODUCT_STORE_MAX_AGE is returned without calling the API; one older
+        than PRODUCT_STORE_REFRESH_AFTER is also queued for a background
+        refresh. Concurrent requests for the same product share a single
+        upstream fetch and receive the same result or error. With
+        WOOLWORTHS_HEDGE_AFTER set, a fetch still running after that many
+        seconds is hedged.
+        
+        Args:
+            product_id: The ID of the product to fetch
+        
+        Returns:
+            Dictionary containing product details
+        
+        Raises:
+            Exception: If the API request fails after retries
+        """
+        if self.snapshots is not None:
+            snapshot = await self._read_snapshot(product_id)
+            if snapshot is not None:
+                return snapshot
+            self.snapshot_misses += 1
+        return await self.product_flights.do(
+            product_id, lambda: self._fetch_and_store(product_id)
+        )
 
-    @backoff.on_exception(
-        backoff.expo, 
+    async def _read_snapshot(self, product_id: str) -> Optional[Dict[str, Any]]:
+        """Return the stored snapshot of a product unless it has expired."""
+        with timed_stage("snapshot_read"):
+            try:
+                snapshot = await asyncio.to_thread(self.snapshots.get, product_id)
+            except sqlite3.Error as e:
+                logger.warning(f"Failed to read snapshot of product {product_id}: {str(e)}")
+                return None
+        if snapshot is None:
+            return None
+        
+        age = time.time() - snapshot.fetched_at
+        max_age = settings.product_store_max_age
+        if max_age and age >= max_age:
+            return None
+        if age >= settings.product_store_refresh_after:
+            self.snapshot_stale_hits += 1
+            self._schedule_refresh(product_id)
+        else:
+            self.snapshot_hits += 1
+        return snapshot.data
+
+    async def _fetch_and_store(self, product_id: str) -> Dict[str, Any]:
+        """Fetch product details and save them in the snapshot store."""
+        data = await self._hedged_fetch(product_id)
+        if self.snapshots is not None:
+            try:
+                await asyncio.to_thread(self.snapshots.put, product_id, data)
+            except sqlite3.Error as e:
+                logger.warning(f"Failed to store snapshot of product {product_id}: {str(e)}")
+        return data
+
+    def _schedule_refresh(self, product_id: str) -> None:
+        """Queue a product for a background refresh unless it is already queued or the queue is full."""
+        if product_id in self._refresh_pending:
+            return
+        try:
+            self._refresh_queue.put_nowait(product_id)
+        except asyncio.QueueFull:
+            return
+        self._refresh_pending.add(product_id)
+
+    async def _refresh_loop(self) -> None:
+        """Refresh queued products one at a time and periodically queue stale snapshots.
+        
+        Refreshes go through the same rate limiter as other fetches, and as
+        only one runs at a time they take little of its capacity.
+        """
+        interval = settings.product_store_refresh_interval
+        next_sweep = time.monotonic()
+        while True:
+            timeout = max(0.0, next_sweep - time.monotonic()) if interval > 0 else None
+            try:
+                product_id = await asyncio.wait_for(self._refresh_queue.get(), timeout)
+            except asyncio.TimeoutError:
+                next_sweep = time.monotonic() + interval
+                try:
+                    stale = await asyncio.to_thread(
+                        self.snapshots.stale, settings.product_store_refresh_after, settings.product_store_refresh_batch
+                    )
+                except sqlite3.Error as e:
+                    logger.warning(f"Failed to look up stale snapshots: {str(e)}")
+                    continue
+                if stale:
+                    logger.info(f"Refreshing {len(stale)} stale product snapshots")
+                for stale_id in stale:
+                    self._schedule_refresh(stale_id)
+                continue
+            
+            self._refresh_pending.discard(product_id)
+            try:
+                await self.product_flights.do(product_id, lambda: self._fetch_and_store(product_id))
+                self.refreshes += 1
+            except Exception as e:
+                self.refresh_failures += 1
+                logger.warning(f"Failed to refresh snapshot of product {product_id}: {str(e)}")
+
+    def snapshot_stats(self) -> Dict[str, Any]:
+        """Return snapshot store usage and refresh counters."""
+        return {
+            **self.snapshots.stats(),
+            "hits": self.snapshot_hits,
+            "stale_hits": self.snapshot_stale_hits,
+            "misses": self.snapshot_misses,
+            "refresh_queued": self._refresh_queue.qsize(),
+            "refreshes": self.refreshes,
+            "refresh_failures": self.refresh_failures,
+        }
+
+    async def _hedged_fetch(self, product_id: str) -> Dict[str, Any]:
+        """Fetch product details, sending a duplicate request if the first is slow.
+        
+        The first successful response wins and the other request is
+        cancelled; if both fail, the first request's error is raised.
+        
+        Args:
+            product_id: The ID of the product to fetch
+        
+        Returns:
+            Dictionary containing product details
+        """
+        hedge_after = settings.woolworths_hedge_after
+        if hedge_after <= 0:
+            return await self._fetch_product_details(product_id)
+        
+        primary = asyncio.ensure_future(self._fetch_product_details(product_id))
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=hedge_after)
+            if done:
+                return primary.result()
+            
+            logger.info(f"Fetch of product {product_id} still running after {hedge_after}s; hedging")
+            hedge = asyncio.ensure_future(self._fetch_product_details(product_id))
+            try:
+                pending = {primary, hedge}
+                while pending:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        if task.exception() is None:
+                            UPSTREAM_HEDGES.labels("woolworths", "hedge" if task is hedge else "primary").inc()
+                            return task.result()
+                UPSTREAM_HEDGES.labels("woolworths", "none").inc()
+                return primary.result()
+            finally:
+                hedge.cancel()
+        finally:
+            primary.cancel()
+
+    @deadline_retry(
+        "woolworths",
         (ClientError, TimeoutError),
-        max_tries=3,
         giveup=lambda e: isinstance(e, aiohttp.ClientResponseError) and e.status >= 400 and e.status != 429
     )
-    async def get_product_details(self, product_id: str) -> Dict[str, Any]:
+    async def _fetch_product_details(self, product_id: str) -> Dict[str, Any]:
         """Fetch product details from Woolworths API.
         
+        Uses the cached session cookies; if the API answers 403 the cookies
+        are refreshed once and the request is repeated.
+        
         Args:
             product_id: The ID of the product to fetch
         
@@ -85,41 +367,55 @@ class WoolworthsClient:
         Raises:
             Exception: If the API request fails after retries
         """
-        url = f"{self.BASE_URL}/{product_id}/"
+        url = f"{self.base_url}{self.PRODUCT_DETAIL_PATH}/{product_id}/"
         logger.info(f"Fetching product details for ID: {product_id}")
         
-        # First get session cookies
-        try:
-            cookies = await self._get_session_cookies()
-        except Exception as e:
-            logger.error(f"Failed to get session cookies: {str(e)}")
-            raise
+        session = await self._get_session()
         
-        async with ClientSession(cookies=cookies, timeout=self.timeout) as session:
+        for attempt in range(2):
+            # Get (possibly cached) session cookies
             try:
-                async with session.get(url, headers=self.HEADERS, ssl=True) as response:
-                    if response.status == 403:
-                        logger.error("Access forbidden - might need to update headers or cookies")
-                        raise ValueError("Access forbidden by Woolworths API")
+                cookies = await self._get_cookies()
+            except Exception as e:
+                logger.error(f"Failed to get session cookies: {str(e)}")
+                raise
+            
+            await self._acquire()
+            try:
+                with timed_stage("detail_fetch"), UPSTREAM_IN_FLIGHT.labels("woolworths").track_inprogress():
+                    async with session.get(url, cookies=cookies, ssl=True) as response:
+                        await self._record_status(response.status)
                     
-                    if response.status == 404:
-                        logger.warning(f"Product not found: {product_id}")
-                        raise ValueError(f"Product ID {product_id} not found")
+                        if response.status == 403:
+                            self._invalidate_cookies(cookies)
+                            if attempt == 0:
+                                logger.warning("Access forbidden - refreshing session cookies and retrying")
+                                continue
+                            logger.error("Access forbidden - might need to update headers or cookies")
+                            raise ValueError("Access forbidden by Woolworths API")
                     
-                    response.raise_for_status()
+                        if response.status == 404:
+                            logger.warning(f"Product not found: {product_id}")
+                            raise ValueError(f"Product ID {product_id} not found")
                     
-                    try:
-                        data = await response.json()
-                        logger.info(f"Successfully fetched data for product ID: {product_id}")
-                        return data
-                    except Exception as je:
-                        text = await response.text()
-                        logger.error(f"JSON parsing error: {str(je)}\nResponse text: {text[:200]}...")
-                        raise ValueError(f"Failed to parse response as JSON: {str(je)}")
+                        response.raise_for_status()
+                    
+                        try:
+                            data = await response.json()
+                            logger.info(f"Successfully fetched data for product ID: {product_id}")
+                            return data
+                        except Exception as je:
+                            text = await response.text()
+                            logger.error(f"JSON parsing error: {str(je)}\nResponse text: {text[:200]}...")
+                            raise ValueError(f"Failed to parse response as JSON: {str(je)}")
                     
             except ClientError as e:
+                if isinstance(e, aiohttp.ClientResponseError) and e.status == 429:
+                    # Let backoff retry once the rate limiter has slowed down
+                    logger.warning(f"Rate limited fetching product {product_id}")
+                    raise
                 logger.error(f"Network error fetching product {product_id}: {str(e)}")
                 raise ValueError(f"Failed to fetch product details: {str(e)}")
             except Exception as e:
                 logger.error(f"Unexpected error fetching product {product_id}: {str(e)}")
-                raise
\ No newline at end of file
+                raise
@@ -0,0 +1,7 @@
+import os
+import sys
+from pathlib import Path
+
+# The app uses flat imports (`from config import settings`) and runs from app/
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app"))
+os.environ.setdefault("GOOGLE_API_KEY", "test")
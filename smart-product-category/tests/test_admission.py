@@ -0,0 +1,137 @@
+import asyncio
+
+import pytest
+
+from admission import AdmissionController, AdmissionRejected, Priority
+from main import to_http_exception
+
+
+async def hold(controller, priority, release, admitted=None):
+    async with controller.slot(priority):
+        if admitted is not None:
+            admitted.append(priority)
+        await release.wait()
+
+
+def test_interactive_caller_displaces_queued_bulk_caller():
+    controller = AdmissionController(max_in_flight=1, max_queue=1)
+    admitted = []
+
+    async def run():
+        release = asyncio.Event()
+        running = asyncio.create_task(hold(controller, Priority.BULK, release))
+        await asyncio.sleep(0)
+        bulk = asyncio.create_task(hold(controller, Priority.BULK, release, admitted))
+        await asyncio.sleep(0)
+        interactive = asyncio.create_task(hold(controller, Priority.INTERACTIVE, release, admitted))
+        await asyncio.sleep(0)
+
+        with pytest.raises(AdmissionRejected):
+            await bulk
+        release.set()
+        await asyncio.gather(running, interactive)
+
+    asyncio.run(run())
+    assert admitted == [Priority.INTERACTIVE]
+    stats = controller.stats()
+    assert (stats["shed"], stats["rejected_bulk"], stats["admitted_interactive"]) == (1, 1, 1)
+    assert (stats["in_flight"], stats["queued"]) == (0, 0)
+
+
+def test_queued_interactive_callers_are_admitted_before_bulk():
+    controller = AdmissionController(max_in_flight=1, max_queue=4)
+    admitted = []
+
+    async def run():
+        release = asyncio.Event()
+        running = asyncio.create_task(hold(controller, Priority.BULK, release))
+        await asyncio.sleep(0)
+        waiting = [asyncio.create_task(hold(controller, priority, release, admitted))
+                   for priority in (Priority.BULK, Priority.INTERACTIVE, Priority.BULK, Priority.INTERACTIVE)]
+        await asyncio.sleep(0)
+        release.set()
+        await asyncio.gather(running, *waiting)
+
+    asyncio.run(run())
+    assert admitted == [Priority.INTERACTIVE, Priority.INTERACTIVE, Priority.BULK, Priority.BULK]
+
+
+def test_full_queue_rejects_with_503_and_retry_after():
+    controller = AdmissionController(max_in_flight=1, max_queue=1)
+
+    async def run():
+        release = asyncio.Event()
+        tasks = [asyncio.create_task(hold(controller, Priority.INTERACTIVE, release)) for _ in range(2)]
+        await asyncio.sleep(0)
+        try:
+            with pytest.raises(AdmissionRejected) as rejected:
+                await hold(controller, Priority.INTERACTIVE, release)
+            # Bulk callers cannot displace interactive ones either
+            with pytest.raises(AdmissionRejected):
+                await hold(controller, Priority.BULK, release)
+        finally:
+            release.set()
+            await asyncio.gather(*tasks)
+        return rejected.value
+
+    error = to_http_exception(asyncio.run(run()))
+    assert error.status_code == 503
+    assert int(error.headers["Retry-After"]) >= 1
+
+
+def test_cancelled_waiter_gives_up_its_place():
+    controller = AdmissionController(max_in_flight=1, max_queue=1)
+    admitted = []
+
+    async def run():
+        release = asyncio.Event()
+        running = asyncio.create_task(hold(controller, Priority.INTERACTIVE, release))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(hold(controller, Priority.INTERACTIVE, release, admitted))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        assert controller.stats()["queued"] == 0
+
+        # The freed queue place can be taken, and the slot is handed on
+        successor = asyncio.create_task(hold(controller, Priority.INTERACTIVE, release, admitted))
+        await asyncio.sleep(0)
+        release.set()
+        await asyncio.gather(running, successor)
+
+    asyncio.run(run())
+    assert admitted == [Priority.INTERACTIVE]
+    assert controller.stats()["in_flight"] == 0
+
+
+def test_slot_is_released_when_holder_is_cancelled():
+    controller = AdmissionController(max_in_flight=1, max_queue=1)
+
+    async def run():
+        release = asyncio.Event()
+        holder = asyncio.create_task(hold(controller, Priority.BULK, release))
+        await asyncio.sleep(0)
+        assert controller.in_flight == 1
+        holder.cancel()
+        await asyncio.gather(holder, return_exceptions=True)
+        assert controller.in_flight == 0
+        release.set()
+        await hold(controller, Priority.BULK, release)
+
+    asyncio.run(run())
+
+
+def test_slot_handed_to_a_waiter_cancelled_before_it_runs_is_released():
+    controller = AdmissionController(max_in_flight=1, max_queue=1)
+
+    async def run():
+        release = asyncio.Event()
+        async with controller.slot(Priority.INTERACTIVE):
+            waiter = asyncio.create_task(hold(controller, Priority.INTERACTIVE, release))
+            await asyncio.sleep(0)
+        # Leaving the block handed the slot to the waiter, which has not run yet
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+
+    asyncio.run(run())
+    assert (controller.in_flight, controller.stats()["queued"]) == (0, 0)
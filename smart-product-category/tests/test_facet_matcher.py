@@ -0,0 +1,98 @@
+import pytest
+
+from facet_matcher import FacetMatcher, normalize_tokens
+
+FACETS = [
+    ("MILK", "Oat Milk"),
+    ("MILK", "Coconut Milk"),
+    ("MILK", "Skim Milk"),
+    ("MILK", "Long Life"),
+    ("CHOCOLATE", "Milk Chocolate"),
+    ("CHOCOLATE", "Chocolate Blocks"),
+    ("BREAD", "Sourdough"),
+    ("PASTRY", "Sourdough"),
+    ("YOGHURT", "Greek Yoghurt"),
+    ("DIPS", "Greek Yoghurt"),
+    ("Oil", "Olive Oil"),
+    ("cat", "Cat Food"),
+    ("drinks", "Soft Drinks"),
+    ("ICECREAM", "Icecream Tubs"),
+]
+
+
+@pytest.fixture
+def matcher():
+    return FacetMatcher(FACETS)
+
+
+def test_normalize_tokens_singularizes_and_splits():
+    assert normalize_tokens("Berries & Cherries, 2 Blocks") == ("berry", "and", "cherry", "2", "block")
+
+
+def test_single_facet_under_phrase_in_name(matcher):
+    match = matcher.match("Sanitarium So Good Oat Milk 1L")
+    assert (match.type, match.variety, match.confidence) == ("milk", ["Oat Milk"], 0.95)
+
+
+def test_longer_facet_hides_the_shorter_one_inside_it(matcher):
+    match = matcher.match("Cadbury Dairy Milk Chocolate Block 180g")
+    assert match.type == "chocolate"
+    assert match.variety == ["Milk Chocolate", "Chocolate Blocks"]
+    assert match.confidence == 0.9
+
+
+def test_several_facets_under_one_phrase(matcher):
+    match = matcher.match("Devondale Long Life Skim Milk 6 x 1L")
+    assert (match.type, match.variety, match.confidence) == ("milk", ["Long Life", "Skim Milk"], 0.9)
+
+
+def test_facet_under_several_phrases_resolved_by_name(matcher):
+    match = matcher.match("Helga's Sourdough Bread 680g")
+    assert (match.type, match.variety, match.confidence) == ("bread", ["Sourdough"], 0.85)
+
+
+def test_facet_under_several_phrases_without_phrase_is_left_to_the_model(matcher):
+    assert matcher.match("Bakers Delight Sourdough") is None
+
+
+@pytest.mark.parametrize("name", ["Coconut Milk Shampoo 400ml", "Uncle Tobys Oat Milk Porridge"])
+def test_facet_followed_by_other_words_is_a_modifier(matcher, name):
+    match = matcher.match(name)
+    assert match.type == "milk"
+    assert match.confidence == FacetMatcher.MODIFIER_CONFIDENCE
+    assert matcher.match(name, min_confidence=0.85) is None
+
+
+@pytest.mark.parametrize("name", ["John West Tuna In Olive Oil 95g", "Whiskas Tuna In Jelly Cat Food 85g"])
+def test_facet_after_connective_is_not_the_head(matcher, name):
+    assert matcher.match(name, min_confidence=0.85) is None
+
+
+def test_facet_before_connective_is_the_head(matcher):
+    match = matcher.match("Oat Milk with Vanilla 1L")
+    assert (match.type, match.confidence) == ("milk", 0.95)
+
+
+def test_search_phrase_is_mapped_to_product_type(matcher):
+    match = matcher.match("Peters Icecream Tubs 2L")
+    assert (match.type, match.variety) == ("ice cream", ["Icecream Tubs"])
+
+
+@pytest.mark.parametrize("name", ["Whiskas Cat Food 85g", "Coca Cola Soft Drinks 10 x 375ml"])
+def test_search_phrase_without_product_type_is_left_to_the_model(matcher, name):
+    assert matcher.match(name) is None
+
+
+def test_package_size_after_facet_is_not_a_modifier(matcher):
+    assert matcher.match("Oat Milk 6 Pack").confidence == 0.95
+
+
+def test_no_facet(matcher):
+    assert matcher.match("Woolworths Paper Towel 4 Pack") is None
+
+
+def test_min_confidence_and_stats(matcher):
+    assert matcher.match("Greek Yoghurt 1kg", min_confidence=0.85) is not None
+    assert matcher.match("Woolworths Paper Towel", min_confidence=0.85) is None
+    stats = matcher.stats()
+    assert (stats["lookups"], stats["hits"], stats["hit_ratio"]) == (2, 1, 0.5)
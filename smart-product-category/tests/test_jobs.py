@@ -0,0 +1,147 @@
+import asyncio
+import time
+
+import pytest
+
+from admission import AdmissionRejected
+from jobs import COMPLETED, JobStore, JobWorkers
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "jobs.db")
+
+
+@pytest.fixture
+def store(db_path):
+    store = JobStore(db_path, owner="a")
+    store.heartbeat()
+    yield store
+    store.close()
+
+
+def test_claims_items_in_job_order_then_position(store):
+    first = store.create(["1", "2"], "basic")
+    second = store.create(["3"], "enhanced", ["texture"])
+
+    claimed = [store.claim() for _ in range(4)]
+
+    assert [(item.job_id, item.position, item.product_id) for item in claimed[:3]] == [
+        (first["job_id"], 0, "1"), (first["job_id"], 1, "2"), (second["job_id"], 0, "3")
+    ]
+    assert claimed[2].mode == "enhanced" and claimed[2].fields == ["texture"]
+    assert claimed[3] is None
+
+
+def test_complete_counts_outcomes_and_finishes_job(store):
+    job = store.create(["1", "2"], "basic")
+    first, second = store.claim(), store.claim()
+
+    assert store.complete(second, error={"type": "ValueError"}) is False
+    assert store.complete(first, result={"type": "milk"}) is True
+
+    finished = store.get(job["job_id"])
+    assert (finished["status"], finished["succeeded"], finished["failed"]) == (COMPLETED, 1, 1)
+    # Results come back in completion order
+    assert store.results(job["job_id"]) == [
+        {"index": 1, "product_id": "2", "error": {"type": "ValueError"}},
+        {"index": 0, "product_id": "1", "result": {"type": "milk"}},
+    ]
+    assert store.results(job["job_id"], offset=1) == [{"index": 0, "product_id": "1", "result": {"type": "milk"}}]
+
+
+def test_release_returns_item_to_queue(store):
+    store.create(["1"], "basic")
+    item = store.claim()
+    store.release(item)
+    assert store.claim() == item
+
+
+def test_requeue_skips_items_of_live_owners(store, db_path):
+    other = JobStore(db_path, owner="b")
+    other.heartbeat()
+    store.create(["1", "2"], "basic")
+    store.claim()
+    other.claim()
+
+    assert store.requeue_interrupted(stale_after=30) == 0
+    other.retire()
+    assert store.requeue_interrupted(stale_after=30) == 1
+    other.close()
+
+
+def test_requeue_after_missed_heartbeats(store, db_path):
+    other = JobStore(db_path, owner="b")
+    other.heartbeat()
+    store.create(["1"], "basic")
+    other.claim()
+
+    time.sleep(0.05)
+    store.heartbeat()
+    assert store.requeue_interrupted(stale_after=0.01) == 1
+    assert store.claim() is not None
+    other.close()
+
+
+def test_reclaimed_item_is_counted_once(store, db_path):
+    other = JobStore(db_path, owner="b")
+    other.heartbeat()
+    job = store.create(["1", "2"], "basic")
+    stale = other.claim()
+    time.sleep(0.05)
+    store.heartbeat()
+    store.requeue_interrupted(stale_after=0.01)
+    reclaimed = store.claim()
+    assert reclaimed.position == stale.position
+
+    # The old owner finishing late records nothing
+    assert other.complete(stale, result={"by": "b"}) is False
+    assert store.complete(reclaimed, result={"by": "a"}) is False
+
+    unfinished = store.get(job["job_id"])
+    assert (unfinished["succeeded"], unfinished["status"]) == (1, "running")
+    assert store.results(job["job_id"]) == [{"index": 0, "product_id": "1", "result": {"by": "a"}}]
+    assert store.pending_items() == 1
+    other.close()
+
+
+def test_state_survives_reopening(db_path):
+    store = JobStore(db_path)
+    job = store.create(["1", "2"], "basic")
+    store.complete(store.claim(), result={"type": "milk"})
+    store.close()
+
+    reopened = JobStore(db_path)
+    assert reopened.get(job["job_id"])["succeeded"] == 1
+    assert reopened.pending_items() == 1
+    reopened.close()
+
+
+def test_workers_process_requeue_shed_items_and_retire(store):
+    job = store.create(["1", "2", "3"], "basic")
+    attempts = {}
+
+    async def process(item):
+        attempts[item.product_id] = attempts.get(item.product_id, 0) + 1
+        if item.product_id == "2" and attempts["2"] == 1:
+            raise AdmissionRejected("overloaded", retry_after=0)
+        if item.product_id == "3":
+            raise ValueError("bad product")
+        return {"type": item.product_id}
+
+    async def run():
+        workers = JobWorkers(store, process, lambda e: {"detail": str(e)}, workers=2, poll_interval=0.01, lease=1.0)
+        workers.start()
+        for _ in range(200):
+            if store.get(job["job_id"])["status"] == COMPLETED:
+                break
+            await asyncio.sleep(0.01)
+        await workers.stop()
+        return workers.stats()
+
+    stats = asyncio.run(run())
+
+    finished = store.get(job["job_id"])
+    assert (finished["status"], finished["succeeded"], finished["failed"]) == (COMPLETED, 2, 1)
+    assert attempts == {"1": 1, "2": 2, "3": 1}
+    assert (stats["items_succeeded"], stats["items_failed"], stats["items_requeued"]) == (2, 1, 1)
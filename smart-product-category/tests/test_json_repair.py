@@ -0,0 +1,60 @@
+import pytest
+
+from json_repair import JSONRepairError, repair_json
+
+
+def test_strict_json_is_not_repaired():
+    assert repair_json('{"type": "milk", "variety": ["oat milk"]}') == (
+        {"type": "milk", "variety": ["oat milk"]}, False
+    )
+
+
+def test_prose_around_object():
+    value, repaired = repair_json('Here is the result: {"type": "milk"} Hope that helps!')
+    assert value == {"type": "milk"}
+    assert repaired
+
+
+@pytest.mark.parametrize("text", [
+    "{'type': 'milk', 'variety': ['oat milk']}",
+    '{“type”: “milk”, “variety”: [“oat milk”]}',
+    '{"type": "milk", "variety": ["oat milk",],}',
+    '{type: "milk", variety: ["oat milk"]}',
+])
+def test_common_mistakes(text):
+    value, repaired = repair_json(text)
+    assert value == {"type": "milk", "variety": ["oat milk"]}
+    assert repaired
+
+
+def test_python_literals():
+    value, _ = repair_json("{'vegan': True, 'organic': False, 'brand': None}")
+    assert value == {"vegan": True, "organic": False, "brand": None}
+
+
+def test_truncated_object_keeps_complete_members():
+    value, repaired = repair_json('{"type": "milk", "variety": ["oat milk", "barista"], "texture": ["cre')
+    assert repaired
+    assert value["type"] == "milk"
+    assert value["variety"] == ["oat milk", "barista"]
+
+
+def test_truncated_array_keeps_only_complete_records():
+    value, _ = repair_json('[{"type": "milk"}, {"type": "bread"}, {"type": "chee', expected=list)
+    assert value == [{"type": "milk"}, {"type": "bread"}]
+
+
+def test_expected_container_skips_other_kinds():
+    value, _ = repair_json('["ignored"] then {"type": "milk"}', expected=dict)
+    assert value == {"type": "milk"}
+
+
+def test_truncated_inside_first_member_gives_empty_object():
+    # Schema validation downstream rejects it; the repair itself succeeds
+    assert repair_json('{"type": "mi') == ({}, True)
+
+
+@pytest.mark.parametrize("text", ["no json here", "   ", "[1, 2]"])
+def test_unrecoverable(text):
+    with pytest.raises(JSONRepairError):
+        repair_json(text, expected=dict)
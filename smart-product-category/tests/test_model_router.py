@@ -0,0 +1,93 @@
+import asyncio
+
+import pytest
+
+from api_models import ProductResponse
+from model_router import CONFIDENCE_FIELD, ModelRouter, heuristic_confidence
+from schema import ModelResponse
+
+STRUCTURE = {"type": "string", "variety": ["string"]}
+
+
+class FakeTier:
+    """Model tier answering from a fixed table of results."""
+
+    def __init__(self, model_name, answers):
+        self.model_name = model_name
+        self.temperature = 0.0
+        self.answers = answers
+        self.prompts = []
+        self.packs = []
+
+    async def process_prompt(self, prompt, json_structure, response_model=None):
+        self.prompts.append(prompt)
+        return ModelResponse(response=dict(self.answers[prompt]), raw_response="{}")
+
+    async def process_packed_prompts(self, instructions, items, json_structure, response_model, output_tokens_per_item):
+        self.packs.append(sorted(items))
+        return {product_id: response_model(**self.answers[text]) for product_id, text in items.items()}
+
+
+@pytest.mark.parametrize("values, expected", [
+    ({"type": "", "variety": ["oat"]}, 0.0),
+    ({"type": "Product", "variety": ["oat"]}, 0.3),
+    ({"type": "milk", "variety": [" "]}, 0.5),
+    ({"type": "milk", "variety": ["oat"]}, 1.0),
+])
+def test_heuristic_confidence(values, expected):
+    assert heuristic_confidence(values) == expected
+
+
+def test_low_confidence_fast_result_escalates():
+    fast = FakeTier("fast", {"oat milk": {"type": "milk", "variety": ["oat"], CONFIDENCE_FIELD: 0.4}})
+    strong = FakeTier("strong", {"oat milk": {"type": "oat milk", "variety": ["barista"]}})
+
+    response = asyncio.run(ModelRouter([fast, strong]).process_prompt("oat milk", STRUCTURE, ProductResponse))
+
+    assert response.response == {"type": "oat milk", "variety": ["barista"]}
+    assert strong.prompts == ["oat milk"]
+
+
+def test_generic_fast_result_escalates_despite_reported_confidence():
+    fast = FakeTier("fast", {"oat milk": {"type": "product", "variety": ["oat"], CONFIDENCE_FIELD: 0.99}})
+    strong = FakeTier("strong", {"oat milk": {"type": "oat milk", "variety": ["barista"]}})
+
+    asyncio.run(ModelRouter([fast, strong]).process_prompt("oat milk", STRUCTURE, ProductResponse))
+
+    assert strong.prompts == ["oat milk"]
+
+
+def test_high_confidence_fast_result_is_kept():
+    fast = FakeTier("fast", {"oat milk": {"type": "milk", "variety": ["oat"], CONFIDENCE_FIELD: 0.9}})
+    strong = FakeTier("strong", {})
+
+    response = asyncio.run(ModelRouter([fast, strong]).process_prompt("oat milk", STRUCTURE, ProductResponse))
+
+    # The reported confidence is not passed on
+    assert response.response == {"type": "milk", "variety": ["oat"]}
+    assert strong.prompts == []
+
+
+def test_packed_prompt_escalates_only_weak_items():
+    fast = FakeTier("fast", {
+        "oat milk": {"type": "milk", "variety": ["oat"], CONFIDENCE_FIELD: 0.9},
+        "mystery": {"type": "item", "variety": [], CONFIDENCE_FIELD: 0.9},
+        "bread": {"type": "bread", "variety": ["sourdough"], CONFIDENCE_FIELD: 0.2},
+    })
+    strong = FakeTier("strong", {
+        "mystery": {"type": "gift card", "variety": ["digital"]},
+        "bread": {"type": "bread", "variety": ["white"]},
+    })
+    items = {"1": "oat milk", "2": "mystery", "3": "bread"}
+
+    results = asyncio.run(ModelRouter([fast, strong]).process_packed_prompts(
+        "Categorize", items, STRUCTURE, ProductResponse, 20
+    ))
+
+    assert fast.packs == [["1", "2", "3"]]
+    assert strong.packs == [["2", "3"]]
+    assert {product_id: (result.type, result.variety) for product_id, result in results.items()} == {
+        "1": ("milk", ["oat"]),
+        "2": ("gift card", ["digital"]),
+        "3": ("bread", ["white"]),
+    }
@@ -0,0 +1,114 @@
+import asyncio
+
+import pytest
+
+from config import settings
+from product_store import ZLIB, ZSTD, ProductSnapshotStore
+from woolworths_client import WoolworthsClient
+
+
+def product(index):
+    return {
+        "Product": {
+            "Stockcode": index,
+            "DisplayName": f"Woolworths Full Cream Milk {index}L",
+            "Brand": "Woolworths",
+            "IsAvailable": index % 2 == 0,
+        },
+        "AdditionalAttributes": {"nutritionalinformation": f"Energy {index * 10}kJ, Protein {index}g"},
+    }
+
+
+@pytest.mark.parametrize("codec", [ZSTD, ZLIB])
+def test_snapshots_round_trip_before_and_after_training(tmp_path, monkeypatch, codec):
+    if codec == ZLIB:
+        monkeypatch.setattr("product_store.zstandard", None)
+    path = str(tmp_path / "products.db")
+    store = ProductSnapshotStore(path, train_after=40, dictionary_size=1024)
+
+    for index in range(39):
+        store.put(str(index), product(index))
+    assert store.stats()["dictionary_bytes"] == 0
+    assert store.get("7").data == product(7)
+
+    store.put("39", product(39))
+    stats = store.stats()
+    assert (stats["codec"], stats["entries"]) == (codec, 40)
+    assert stats["dictionary_bytes"] > 0
+    # Snapshots stored before training were recompressed with the dictionary
+    assert [store.get(str(index)).data for index in range(40)] == [product(index) for index in range(40)]
+    store.put("40", product(40))
+    store.close()
+
+    reopened = ProductSnapshotStore(path, train_after=40, dictionary_size=1024)
+    assert reopened.get("40").data == product(40)
+    assert reopened.get("0").data == product(0)
+    assert reopened.stats()["entries"] == 41
+    reopened.close()
+
+
+def test_unchanged_refresh_only_touches_timestamp(tmp_path):
+    store = ProductSnapshotStore(str(tmp_path / "products.db"))
+    assert store.put("1", product(1)) is True
+    first = store.get("1")
+    assert store.put("1", product(1)) is False
+    second = store.get("1")
+    assert second.changed_at == first.changed_at and second.fetched_at >= first.fetched_at
+    assert store.put("1", product(2)) is True
+    assert store.stats()["unchanged_refreshes"] == 1
+    store.close()
+
+
+def test_only_one_caller_claims_a_stale_product(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("product_store.time.time", lambda: now[0])
+    path = str(tmp_path / "products.db")
+    first = ProductSnapshotStore(path)
+    second = ProductSnapshotStore(path)
+    first.put("old", product(1))
+    now[0] += 30
+    first.put("new", product(2))
+
+    now[0] += 45
+    assert first.stale(60, 10) == ["old"]
+    assert second.stale(60, 10) == []
+
+    # An unrefreshed claim lapses after another `older_than` seconds
+    now[0] += 61
+    assert second.stale(60, 10) == ["old", "new"]
+    assert first.stale(60, 10) == []
+    first.close()
+    second.close()
+
+
+def test_stale_snapshot_is_served_and_refreshed_once_in_the_background(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "product_store_refresh_after", 0)
+    monkeypatch.setattr(settings, "product_store_max_age", 0)
+    monkeypatch.setattr(settings, "product_store_refresh_interval", 0)
+    store = ProductSnapshotStore(str(tmp_path / "products.db"))
+    store.put("1", product(1))
+    fetches = []
+
+    async def fetch(product_id):
+        fetches.append(product_id)
+        return product(2)
+
+    async def run():
+        client = WoolworthsClient(snapshots=store)
+        client._hedged_fetch = fetch
+        stale = [await client.get_product_details("1") for _ in range(2)]
+        refresher = asyncio.create_task(client._refresh_loop())
+        for _ in range(100):
+            if client.refreshes:
+                break
+            await asyncio.sleep(0.01)
+        refresher.cancel()
+        await asyncio.gather(refresher, return_exceptions=True)
+        return stale, client.snapshot_stats()
+
+    stale, stats = asyncio.run(run())
+    assert stale == [product(1), product(1)]
+    assert fetches == ["1"]
+    assert store.get("1").data == product(2)
+    assert (stats["stale_hits"], stats["refreshes"]) == (2, 1)
+    store.close()
@@ -0,0 +1,118 @@
+import asyncio
+
+import pytest
+
+from rate_limiter import AdaptiveTokenBucket, SharedTokenBucket, is_rate_limit_error
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def sleeps(clock, monkeypatch):
+    """Record the waits of a bucket, advancing the clock instead of sleeping."""
+    waits = []
+
+    async def sleep(delay):
+        waits.append(delay)
+        clock.now += delay
+
+    monkeypatch.setattr("rate_limiter.asyncio.sleep", sleep)
+    return waits
+
+
+def acquire(bucket, times):
+    async def run():
+        for _ in range(times):
+            await bucket.acquire()
+    asyncio.run(run())
+
+
+def test_bucket_paces_calls_after_the_burst(clock, sleeps):
+    bucket = AdaptiveTokenBucket("test", requests=2, timeframe=1, burst=2, clock=clock)
+    acquire(bucket, 4)
+    assert sleeps == [pytest.approx(0.5), pytest.approx(0.5)]
+
+    clock.now += 10
+    acquire(bucket, 2)
+    assert len(sleeps) == 2
+
+
+def test_throttle_cuts_rate_and_successes_restore_it(clock, sleeps):
+    bucket = AdaptiveTokenBucket("test", requests=60, timeframe=60, recovery_calls=4,
+                                 min_rate_fraction=0.1, clock=clock)
+
+    asyncio.run(bucket.on_throttle())
+    assert bucket.rate == pytest.approx(0.5)
+    # The bucket is drained, so the next call waits at the reduced rate
+    acquire(bucket, 1)
+    assert sleeps == [pytest.approx(2.0)]
+
+    for _ in range(5):
+        asyncio.run(bucket.on_throttle())
+    assert bucket.rate == pytest.approx(0.1)
+    assert bucket.throttles == 6
+
+    for expected in (0.325, 0.55, 0.775, 1.0, 1.0):
+        asyncio.run(bucket.on_success())
+        assert bucket.rate == pytest.approx(expected)
+
+
+def test_shared_bucket_reserves_slots_across_processes(tmp_path, clock):
+    path = str(tmp_path / "rate_limits.db")
+    first = SharedTokenBucket("gemini", 60, 60, burst=2, path=path, clock=clock)
+    second = SharedTokenBucket("gemini", 60, 60, burst=2, path=path, clock=clock)
+
+    delays = [bucket._reserve() for bucket in (first, second, first, second)]
+    assert delays == [pytest.approx(0.0), pytest.approx(0.0), pytest.approx(1.0), pytest.approx(2.0)]
+
+    # Slots free up as time passes, up to the burst
+    clock.now += 60
+    assert [first._reserve(), second._reserve(), first._reserve()] == [
+        pytest.approx(0.0), pytest.approx(0.0), pytest.approx(1.0)
+    ]
+    first.close()
+    second.close()
+
+
+def test_shared_bucket_throttle_slows_every_process(tmp_path, clock):
+    path = str(tmp_path / "rate_limits.db")
+    first = SharedTokenBucket("gemini", 60, 60, path=path, recovery_calls=2, clock=clock)
+    second = SharedTokenBucket("gemini", 60, 60, path=path, recovery_calls=2, clock=clock)
+
+    asyncio.run(first.on_throttle())
+    assert first.rate == pytest.approx(0.5)
+    # The next free slot is pushed back to the reduced rate for everyone
+    assert second._reserve() == pytest.approx(2.0)
+    assert second.rate == pytest.approx(0.5)
+    assert second._reserve() == pytest.approx(4.0)
+
+    # A process starting later keeps the reduced rate
+    third = SharedTokenBucket("gemini", 60, 60, path=path, recovery_calls=2, clock=clock)
+    assert third._reserve() == pytest.approx(6.0)
+    assert third.rate == pytest.approx(0.5)
+
+    asyncio.run(second.on_success())
+    asyncio.run(third.on_success())
+    assert third.rate == pytest.approx(1.0)
+    for bucket in (first, second, third):
+        bucket.close()
+
+
+@pytest.mark.parametrize("message", ["429 Too Many Requests", "Quota exceeded", "Resource exhausted"])
+def test_rate_limit_errors_are_recognized(message):
+    assert is_rate_limit_error(Exception(message))
+
+
+def test_other_errors_are_not_rate_limit_errors():
+    assert not is_rate_limit_error(ValueError("invalid JSON"))
@@ -0,0 +1,84 @@
+import asyncio
+
+from categorizer import ProductCategorizer
+from product_utils import ProductDataExtractor
+from prompt_loader import PromptLoader
+from result_cache import CacheMode, ResultCache, SQLiteCache, cache_status, change_status
+from schema import ModelResponse
+
+
+def test_entry_count_tracks_writes_and_purges(tmp_path):
+    path = str(tmp_path / "cache.db")
+    cache = SQLiteCache(path, ttl=3600)
+    cache.set("a", {"type": "milk"})
+    cache.set("b", {"type": "bread"})
+    cache.set("a", {"type": "oat milk"})
+    assert cache.count() == 2
+
+    cache.ttl = 0
+    assert cache.purge_expired() == 2
+    assert cache.count() == 0
+    cache.set("c", {"type": "cheese"})
+    cache.close()
+
+    assert SQLiteCache(path, ttl=3600).count() == 1
+
+
+def test_purge_keeps_fingerprinted_entries_for_fingerprint_ttl(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("result_cache.time.time", lambda: now[0])
+    cache = SQLiteCache(str(tmp_path / "cache.db"), ttl=10, fingerprint_ttl=100)
+    cache.set("plain", {"type": "milk"})
+    cache.set("fingerprinted", {"type": "bread"}, fingerprint="abc")
+
+    now[0] += 50
+    assert cache.purge_expired() == 1
+    assert cache.get("fingerprinted") is None
+    assert cache.get_fingerprinted("fingerprinted") == ("abc", {"type": "bread"})
+
+    now[0] += 60
+    assert cache.purge_expired() == 1
+    assert cache.get_fingerprinted("fingerprinted") is None
+
+
+class FakeWoolworths:
+    def __init__(self, name):
+        self.name = name
+
+    async def get_product_details(self, product_id):
+        return {"Product": {"DisplayName": self.name}}
+
+
+class FakeRouter:
+    model_name = "fake"
+    temperature = 0.0
+
+    def __init__(self):
+        self.calls = 0
+
+    async def process_prompt(self, prompt, json_structure, response_model=None):
+        self.calls += 1
+        return ModelResponse(response={"type": "milk", "variety": [f"answer {self.calls}"]}, raw_response="{}")
+
+
+def test_revalidation_recomputes_only_changed_products(tmp_path):
+    woolworths = FakeWoolworths("Oat Milk 1L")
+    router = FakeRouter()
+    cache = ResultCache(100, 60, str(tmp_path / "cache.db"), disk_ttl=0)
+    categorizer = ProductCategorizer(
+        woolworths, router, PromptLoader(reload_interval=-1), ProductDataExtractor(), result_cache=cache
+    )
+
+    async def categorize():
+        result = await categorizer.categorize("123", CacheMode.REVALIDATE)
+        return result.variety, cache_status.get(), change_status.get()
+
+    assert asyncio.run(categorize()) == (["answer 1"], "MISS", "NEW")
+    assert asyncio.run(categorize()) == (["answer 1"], "UNCHANGED", "UNCHANGED")
+    assert router.calls == 1
+
+    woolworths.name = "Oat Milk Barista 1L"
+    assert asyncio.run(categorize()) == (["answer 2"], "MISS", "CHANGED")
+    assert asyncio.run(categorize()) == (["answer 2"], "UNCHANGED", "UNCHANGED")
+    assert router.calls == 2
+    cache.close()
@@ -0,0 +1,76 @@
+import asyncio
+
+import pytest
+
+from similarity_cache import SimilarityCache, normalize_name
+
+NAMESPACE = SimilarityCache.make_namespace("categorize", "prompt", "model", 0.0)
+MILK = {"type": "milk", "variety": ["full cream"]}
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = SimilarityCache(0.9, 100, str(tmp_path / "similarity.db"), ttl=3600)
+    yield cache
+    cache.close()
+
+
+def add(cache, name, value, namespace=NAMESPACE):
+    asyncio.run(cache.add(namespace, name, value))
+
+
+def test_normalize_name_drops_package_size_and_punctuation():
+    assert normalize_name("Woolworths Full Cream Milk 2L") == "woolworths full cream milk"
+    assert normalize_name("Berries & Cream, 500g") == "berries and cream"
+
+
+def test_same_product_in_another_size_matches(cache):
+    add(cache, "Woolworths Full Cream Milk 2L", MILK)
+    match = cache.lookup(NAMESPACE, "Woolworths Full Cream Milk 3L")
+    assert (match.value, match.similarity, match.name) == (MILK, 1.0, "woolworths full cream milk")
+
+
+def test_near_identical_name_matches(cache):
+    chocolate = {"type": "chocolate", "variety": ["milk chocolate"]}
+    add(cache, "Cadbury Dairy Milk Chocolate Block 180g", chocolate)
+    match = cache.lookup(NAMESPACE, "Cadbury Dairy Milk Chocolate Blocks 180g")
+    assert match.value == chocolate
+    assert 0.9 <= match.similarity < 1.0
+
+
+def test_variant_below_threshold_does_not_match(cache):
+    add(cache, "Woolworths Full Cream Milk 2L", MILK)
+    assert cache.lookup(NAMESPACE, "Woolworths Lite Milk 2L") is None
+    assert cache.stats()["hits"] == 0
+
+
+def test_other_namespaces_are_never_returned(cache):
+    enhanced = SimilarityCache.make_namespace("enhanced", "prompt", "model", 0.0)
+    add(cache, "Woolworths Full Cream Milk 2L", MILK, namespace=enhanced)
+    assert cache.lookup(NAMESPACE, "Woolworths Full Cream Milk 2L") is None
+    assert cache.lookup(enhanced, "Woolworths Full Cream Milk 2L").value == MILK
+
+
+def test_required_keys_must_be_present(cache):
+    add(cache, "Woolworths Full Cream Milk 2L", MILK)
+    assert cache.lookup(NAMESPACE, "Woolworths Full Cream Milk 2L", required_keys=["texture"]) is None
+
+
+def test_expired_entries_are_not_returned(cache, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("similarity_cache.time.time", lambda: now[0])
+    add(cache, "Woolworths Full Cream Milk 2L", MILK)
+    now[0] += 3600
+    assert cache.lookup(NAMESPACE, "Woolworths Full Cream Milk 2L") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_entries_survive_a_restart(tmp_path):
+    path = str(tmp_path / "similarity.db")
+    cache = SimilarityCache(0.9, 100, path, ttl=3600)
+    add(cache, "Woolworths Full Cream Milk 2L", MILK)
+    cache.close()
+
+    reloaded = SimilarityCache(0.9, 100, path, ttl=3600)
+    assert reloaded.lookup(NAMESPACE, "Woolworths Full Cream Milk 1L").value == MILK
+    reloaded.close()
@@ -0,0 +1,131 @@
+import asyncio
+
+import pytest
+
+from admission import Priority, set_priority
+from deadline import Deadline, DeadlineExceeded, current_deadline, start_deadline
+from single_flight import SingleFlight
+
+
+def test_short_deadline_caller_stops_waiting_on_long_call():
+    flights = SingleFlight("test")
+    release = asyncio.Event()
+
+    async def work():
+        await release.wait()
+        return "done"
+
+    async def caller(timeout):
+        start_deadline(Deadline(timeout, retry_budget=3))
+        return await flights.do("key", work)
+
+    async def run():
+        long_call = asyncio.create_task(caller(60))
+        await asyncio.sleep(0)
+        with pytest.raises(DeadlineExceeded):
+            await caller(0.05)
+        # The long caller keeps the shared call alive
+        release.set()
+        return await long_call
+
+    assert asyncio.run(run()) == "done"
+    assert flights.executed == 1 and flights.coalesced == 1
+
+
+def test_caller_does_not_join_call_with_shorter_deadline_or_lower_priority():
+    flights = SingleFlight("test")
+    seen = []
+    release = asyncio.Event()
+
+    async def work():
+        seen.append(current_deadline().expires_at)
+        await release.wait()
+        return len(seen)
+
+    async def caller(timeout, priority):
+        start_deadline(Deadline(timeout, retry_budget=3))
+        set_priority(priority)
+        return await flights.do("key", work)
+
+    async def run():
+        calls = [asyncio.create_task(caller(0.5, Priority.INTERACTIVE))]
+        await asyncio.sleep(0)
+        calls.append(asyncio.create_task(caller(60, Priority.BULK)))
+        await asyncio.sleep(0)
+        calls.append(asyncio.create_task(caller(60, Priority.INTERACTIVE)))
+        await asyncio.sleep(0)
+        # Joins the last call, which serves both its deadline and priority
+        calls.append(asyncio.create_task(caller(30, Priority.BULK)))
+        await asyncio.sleep(0)
+        release.set()
+        return await asyncio.gather(*calls)
+
+    assert asyncio.run(run()) == [3, 3, 3, 3]
+    assert flights.executed == 3 and flights.coalesced == 1
+    assert seen[0] < seen[1] <= seen[2]
+
+
+def test_concurrent_callers_share_one_call():
+    flights = SingleFlight("test")
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"type": "milk"}
+
+    async def run():
+        return await asyncio.gather(*(flights.do("key", work) for _ in range(10)))
+
+    results = asyncio.run(run())
+    assert results == [{"type": "milk"}] * 10
+    assert len(calls) == 1
+    assert flights.stats() == {"executed": 1, "coalesced": 9, "in_flight": 0}
+
+
+def test_callers_share_the_error():
+    flights = SingleFlight("test")
+
+    async def work():
+        await asyncio.sleep(0.01)
+        raise ValueError("upstream failed")
+
+    async def run():
+        return await asyncio.gather(*(flights.do("key", work) for _ in range(3)), return_exceptions=True)
+
+    errors = asyncio.run(run())
+    assert all(isinstance(e, ValueError) for e in errors)
+    assert flights.executed == 1
+
+
+def test_cancelling_last_waiter_cancels_call():
+    flights = SingleFlight("test")
+    started = asyncio.Event()
+    cancelled = []
+
+    async def work():
+        started.set()
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            cancelled.append(1)
+            raise
+
+    async def run():
+        first = asyncio.create_task(flights.do("key", work))
+        second = asyncio.create_task(flights.do("key", work))
+        await started.wait()
+
+        first.cancel()
+        await asyncio.gather(first, return_exceptions=True)
+        await asyncio.sleep(0)
+        # One caller is still waiting, so the call keeps running
+        assert not cancelled and flights.in_flight == 1
+
+        second.cancel()
+        await asyncio.gather(second, return_exceptions=True)
+        await asyncio.sleep(0)
+
+    asyncio.run(run())
+    assert cancelled == [1]
+    assert flights.in_flight == 0